@@ -0,0 +1,152 @@
+"""
+Icon index benchmark: how often nearest-neighbour caption reuse kicks in, and how
+often the reused caption is the one full captioning would have produced.
+
+Icons are cropped from synthetic screens. The index is filled with the captions
+of one set of screens; the held-out set is
+    perturbed - the same icons with hover/theme-like changes (brightness, tint, 2px shift)
+    unseen    - icons from other screens
+and every held-out crop is also captioned in full as the reference. For each
+distance threshold the report gives the reuse rate, exact caption agreement and
+token F1 of reused captions, per group. Synthetic icons also carry their drawn
+shape, reported as shape agreement. The caption model is the CPU stand-in unless
+--real is given.
+
+    python -m benchmarks.bench_icon_index
+    python -m benchmarks.bench_icon_index --embedder encoder --real --caption_model_path weights/icon_caption_florence
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+
+import numpy as np
+from PIL import Image
+
+from util.icon_index import IconIndex, get_icon_embedder
+from util.synthetic import generate_screen
+from util.utils import caption_crops, crop_icon
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Icon nearest-neighbour index benchmark')
+    parser.add_argument('--out', type=str, default=None, help='Write JSON results here (default: stdout)')
+    parser.add_argument('--embedder', type=str, default='pixel', help='pixel or encoder')
+    parser.add_argument('--thresholds', type=str, default='0.02,0.05,0.08,0.12,0.2')
+    parser.add_argument('--screens', type=int, default=6, help='Synthetic screens for the index, as many again are held out')
+    parser.add_argument('--resolution', type=str, default='1920x1080')
+    parser.add_argument('--density', type=float, default=0.6)
+    parser.add_argument('--real', action='store_true', help='Use the real caption model')
+    parser.add_argument('--caption_model_name', type=str, default='florence2')
+    parser.add_argument('--caption_model_path', type=str, default='weights/icon_caption_florence')
+    return parser.parse_args()
+
+
+def icon_crops(seeds, width, height, density):
+    crops, shapes = [], []
+    for seed in seeds:
+        for layout in ('icon_grid', 'mixed'):
+            image, elements = generate_screen(width, height, layout=layout, density=density, seed=seed)
+            image_np = np.asarray(image)
+            for elem in elements:
+                if elem['type'] != 'icon':
+                    continue
+                x1, y1, x2, y2 = elem['bbox']
+                crops.append(crop_icon([x1 / width, y1 / height, x2 / width, y2 / height], image_np))
+                shapes.append(elem['content'])
+    return crops, shapes
+
+
+def perturb(crop: np.ndarray, k: int) -> np.ndarray:
+    """Hover/theme-like variants: brighter, darker, tinted, shifted by 2px."""
+    crop = crop.astype(np.float32)
+    kind = k % 4
+    if kind == 0:
+        crop = crop * 1.12 + 8
+    elif kind == 1:
+        crop = crop * 0.88
+    elif kind == 2:
+        crop = crop + np.array([12, -6, 18], dtype=np.float32)
+    else:
+        crop = np.pad(crop, ((2, 0), (2, 0), (0, 0)), mode='edge')[:-2, :-2]
+    return np.clip(crop, 0, 255).astype(np.uint8)
+
+
+def token_f1(a: str, b: str) -> float:
+    ta, tb = a.lower().split(), b.lower().split()
+    if not ta or not tb:
+        return float(ta == tb)
+    common = sum(min(ta.count(t), tb.count(t)) for t in set(ta))
+    if common == 0:
+        return 0.0
+    precision, recall = common / len(ta), common / len(tb)
+    return 2 * precision * recall / (precision + recall)
+
+
+def caption_all(crops, caption_model_processor):
+    start = time.perf_counter()
+    captions = caption_crops([Image.fromarray(crop) for crop in crops], caption_model_processor)
+    return captions, (time.perf_counter() - start) / max(len(crops), 1)
+
+
+def evaluate(index, vectors, references, shapes, neighbour_shapes, thresholds):
+    nearest, distances = index.search(vectors)
+    rows = {}
+    for threshold in thresholds:
+        reused = [i for i, d in enumerate(distances) if d <= threshold]
+        exact = [index.captions[nearest[i]] == references[i] for i in reused]
+        rows[str(threshold)] = {
+            'reuse_rate': len(reused) / max(len(references), 1),
+            'exact_agreement': float(np.mean(exact)) if reused else None,
+            'token_f1': float(np.mean([token_f1(index.captions[nearest[i]], references[i]) for i in reused])) if reused else None,
+            'shape_agreement': float(np.mean([neighbour_shapes[nearest[i]] == shapes[i] for i in reused])) if reused else None,
+        }
+    return rows
+
+
+def main(args):
+    thresholds = sorted(float(t) for t in args.thresholds.split(','))
+    width, height = (int(v) for v in args.resolution.split('x'))
+    if args.real:
+        from util.utils import get_caption_model_processor
+        caption_model_processor = get_caption_model_processor(model_name=args.caption_model_name, model_name_or_path=args.caption_model_path)
+    else:
+        from benchmarks.stubs import get_stub_caption_model_processor
+        caption_model_processor = get_stub_caption_model_processor()
+    index = IconIndex(get_icon_embedder(args.embedder, caption_model_processor), max_distance=float('inf'))
+
+    index_crops, index_shapes = icon_crops(range(args.screens), width, height, args.density)
+    unseen_crops, unseen_shapes = icon_crops(range(1000, 1000 + args.screens), width, height, args.density)
+    perturbed_crops = [perturb(crop, k) for k, crop in enumerate(index_crops)]
+
+    index_captions, caption_seconds = caption_all(index_crops, caption_model_processor)
+    start = time.perf_counter()
+    index.add(index.embed(index_crops), index_captions)
+    embed_seconds = (time.perf_counter() - start) / max(len(index_crops), 1)
+
+    groups = {}
+    for name, crops, shapes in (('perturbed', perturbed_crops, index_shapes), ('unseen', unseen_crops, unseen_shapes)):
+        references, _ = caption_all(crops, caption_model_processor)
+        groups[name] = {'icons': len(crops), 'thresholds': evaluate(index, index.embed(crops), references, shapes, index_shapes, thresholds)}
+
+    report = {
+        'embedder': index.embedder.name,
+        'caption_model': caption_model_processor['model'].config.name_or_path,
+        'indexed_icons': len(index),
+        'caption_ms_per_icon': caption_seconds * 1000,
+        'embed_ms_per_icon': embed_seconds * 1000,
+        'groups': groups,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,194 @@
+"""
+Per-parse memory benchmark.
+
+Parses synthetic screens through `Omniparser.parse` (the same stand-in models
+and OCR reader as bench_parse unless --real / --real_ocr) and records, per parse:
+    rss_peak_delta_bytes   peak resident memory during the parse above the level before it
+    peak_traced_bytes      tracemalloc peak over the whole parse (numpy buffers and Python objects;
+                           not torch tensors)
+    peak_frame_copies      peak_traced_bytes in units of one decoded RGB frame
+    allocations_at_peak    memory blocks allocated by the parse and alive at its highest sampled
+                           traced level, from a tracemalloc snapshot (see `AllocationSampler`)
+    large_allocations      those of at least half a frame
+It only uses the public `parse` API, so the same script can be run on an older
+commit to get the "before" numbers:
+
+    git worktree add /tmp/base <base> && cp benchmarks/bench_memory.py /tmp/base/benchmarks/
+    (cd /tmp/base && python -m benchmarks.bench_memory --out $PWD/before.json)
+    python -m benchmarks.bench_memory --out after.json
+    python -m benchmarks.bench_memory --compare before.json after.json
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+
+from benchmarks.bench_parse import environment
+from util.metrics import process_rss_bytes
+from util.synthetic import generate_screen
+
+METRICS = ('rss_peak_delta_bytes', 'peak_traced_bytes', 'peak_frame_copies', 'allocations_at_peak', 'large_allocations')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Omniparser per-parse memory benchmark')
+    parser.add_argument('--out', type=str, default=None, help='Write JSON results here (default: stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='Compare two result files instead of running')
+    parser.add_argument('--resolutions', type=str, default='1280x720,1920x1080,3840x2160')
+    parser.add_argument('--density', type=float, default=0.5)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--real', action='store_true', help='Use the real detector and caption model')
+    parser.add_argument('--real_ocr', action='store_true', help='Use EasyOCR with the stub models (implied by --real)')
+    parser.add_argument('--som_model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--caption_model_name', type=str, default='florence2')
+    parser.add_argument('--caption_model_path', type=str, default='weights/icon_caption_florence')
+    parser.add_argument('--BOX_TRESHOLD', type=float, default=0.05)
+    return parser.parse_args()
+
+
+class AllocationSampler(object):
+    """
+    Background thread polling RSS and tracemalloc while a parse runs. Each poll reads the traced peak
+    since the previous poll, keeps the running maximum and resets the peak. Whenever the traced memory
+    has grown by `threshold` since the last snapshot, a tracemalloc snapshot is taken and its statistics
+    give the number of live blocks and of blocks of at least `threshold` bytes; the last one is from the
+    highest level sampled. Tracing must have been started just before the parse, so all traced blocks
+    belong to it.
+    """
+
+    def __init__(self, threshold: int, interval: float = 0.0005):
+        self.threshold = threshold
+        self.interval = interval
+        self.rss_peak = 0.0
+        self.peak_traced = 0
+        self.allocations_at_peak = 0
+        self.large_allocations = 0
+        self._snapshot_level = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _snapshot(self, level: int):
+        snapshot = tracemalloc.take_snapshot()
+        self.allocations_at_peak = sum(stat.count for stat in snapshot.statistics('lineno'))
+        self.large_allocations = sum(1 for trace in snapshot.traces if trace.size >= self.threshold)
+        self._snapshot_level = level
+        del snapshot
+
+    def _poll(self):
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak_traced = max(self.peak_traced, peak)
+        if current >= self._snapshot_level + self.threshold:
+            self._snapshot(current)
+        # also drops the snapshot's own (traced) objects from the next interval's peak
+        tracemalloc.reset_peak()
+        self.rss_peak = max(self.rss_peak, process_rss_bytes())
+
+    def _run(self):
+        tracemalloc.reset_peak()
+        while not self._stop.is_set():
+            time.sleep(self.interval)
+            self._poll()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        # the interval between the last poll and the end of the parse
+        _, peak = tracemalloc.get_traced_memory()
+        self.peak_traced = max(self.peak_traced, peak)
+
+
+def measure(omniparser, image_base64: str, frame_bytes: int) -> dict:
+    tracemalloc.start()
+    rss_before = process_rss_bytes()
+    with AllocationSampler(threshold=frame_bytes // 2) as sampler:
+        omniparser.parse(image_base64)
+    tracemalloc.stop()
+    return {
+        'rss_peak_delta_bytes': max(sampler.rss_peak - rss_before, 0.0),
+        'peak_traced_bytes': sampler.peak_traced,
+        'peak_frame_copies': sampler.peak_traced / frame_bytes,
+        'allocations_at_peak': sampler.allocations_at_peak,
+        'large_allocations': sampler.large_allocations,
+    }
+
+
+def run(args):
+    from util.omniparser import Omniparser
+    config = vars(args)
+    if args.real:
+        omniparser = Omniparser(config)
+    else:
+        from benchmarks.stubs import StubDetector, StubReaderPool, get_stub_caption_model_processor
+        omniparser = Omniparser(config, som_model=StubDetector(), caption_model_processor=get_stub_caption_model_processor())
+        # older commits read OCR through a module-level reader and have no pool to swap
+        if not args.real_ocr and hasattr(omniparser, 'reader_pool'):
+            omniparser.reader_pool = StubReaderPool(omniparser.reader_pool.default_languages)
+
+    cases = []
+    for resolution in args.resolutions.split(','):
+        width, height = (int(v) for v in resolution.split('x'))
+        image, _ = generate_screen(width, height, layout='mixed', density=args.density, seed=args.seed)
+        buffered = io.BytesIO()
+        image.save(buffered, format='PNG')
+        image_base64 = base64.b64encode(buffered.getvalue()).decode('ascii')
+        omniparser.parse(image_base64)  # warm up lazy initialization outside the measurement
+        runs = [measure(omniparser, image_base64, width * height * 3) for _ in range(args.repeats)]
+        result = {'name': f'synthetic/mixed/{resolution}', 'width': width, 'height': height}
+        result.update({metric: statistics.median(run[metric] for run in runs) for metric in METRICS})
+        print(f"{result['name']:<32} peak rss +{result['rss_peak_delta_bytes'] / 2 ** 20:8.1f} MiB  "
+              f"traced {result['peak_frame_copies']:5.1f} frames  {result['allocations_at_peak']:7d} blocks at peak, {result['large_allocations']:3d} large", file=sys.stderr)
+        cases.append(result)
+    return {'environment': environment(args), 'cases': cases}
+
+
+def compare(before_path: str, after_path: str):
+    with open(before_path) as f:
+        before = {case['name']: case for case in json.load(f)['cases']}
+    with open(after_path) as f:
+        after = {case['name']: case for case in json.load(f)['cases']}
+    print(f"{'case':<32} " + ' '.join(f'{metric:>24}' for metric in METRICS))
+    for name in before:
+        if name not in after:
+            continue
+        cells = []
+        for metric in METRICS:
+            old, new = before[name].get(metric), after[name].get(metric)
+            if old is None or new is None:
+                # results written before the metric existed
+                cells.append('n/a')
+                continue
+            change = f'{(new - old) / old * 100:+.0f}%' if old else 'n/a'
+            cells.append(f'{old:>9.3g} -> {new:<9.3g}{change:>5}')
+        print(f'{name:<32} ' + ' '.join(f'{cell:>24}' for cell in cells))
+
+
+def main():
+    args = parse_arguments()
+    if args.compare:
+        compare(*args.compare)
+        return
+    output = json.dumps(run(args), indent=2)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Frame-by-frame vs batched OCR throughput on a directory of screenshots.
+
+The screenshots are read once per frame, the way `check_ocr_box` reads them
+(`run_easyocr`, or `run_paddleocr` with --paddle), and then in groups of
+`--frames_per_batch` with `run_easyocr_batched` (recognizer batches filled across
+the frames of a group) or `run_paddleocr_batched`. The report gives frames per
+second for each setting and how closely the batched words agree with the
+frame-by-frame words (word F1). Recognizer batches only fill up on a GPU;
+EasyOCR recognizes box by box on the CPU.
+
+    python -m benchmarks.bench_ocr_batched --dir imgs
+    python -m benchmarks.bench_ocr_batched --dir trajectory/ --frames_per_batch 1,4,8,16 --batch_size 64
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.bench_ocr_modes import word_scores, words
+from util.ocr_engine import OCR_MODES, create_easyocr_reader, create_paddle_ocr, run_easyocr, run_easyocr_batched, run_easyocr_recognize, run_paddleocr, run_paddleocr_batched
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Frame-by-frame vs batched OCR throughput')
+    parser.add_argument('--dir', type=str, default=os.path.join(root_dir, 'imgs'), help='Directory of screenshots')
+    parser.add_argument('--max_images', type=int, default=32)
+    parser.add_argument('--out', type=str, default=None, help='Write JSON results here (default: stdout)')
+    parser.add_argument('--frames_per_batch', type=str, default='1,4,8')
+    parser.add_argument('--batch_size', type=int, default=32, help='Boxes per recognizer batch')
+    parser.add_argument('--mode', type=str, default='full', choices=OCR_MODES)
+    parser.add_argument('--paddle', action='store_true', help='Benchmark PaddleOCR instead of EasyOCR')
+    parser.add_argument('--cpu', action='store_true', help='Run EasyOCR on the CPU')
+    return parser.parse_args()
+
+
+def load_images(directory, max_images):
+    names = sorted(name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))[:max_images]
+    return names, [np.asarray(Image.open(os.path.join(directory, name)).convert('RGB')) for name in names]
+
+
+def main(args):
+    names, images = load_images(args.dir, args.max_images)
+    if not images:
+        sys.exit(f'No screenshots in {args.dir}')
+    easyocr_args = {'paragraph': False, 'text_threshold': 0.9}
+    if args.paddle:
+        engine = create_paddle_ocr()
+        if engine is None:
+            sys.exit('PaddleOCR is not available')
+
+        def read_one(image):
+            return run_paddleocr(engine, image, easyocr_args)
+
+        def read_many(batch):
+            return run_paddleocr_batched(engine, batch, easyocr_args)
+    else:
+        engine = create_easyocr_reader(gpu=not args.cpu)
+        single = run_easyocr_recognize if args.mode == 'recognize' else run_easyocr
+
+        def read_one(image):
+            return single(engine, image, easyocr_args)
+
+        def read_many(batch):
+            return run_easyocr_batched(engine, batch, easyocr_args, mode=args.mode, batch_size=args.batch_size)
+
+    # warm up (model load, cudnn autotuning) outside the timings
+    read_one(images[0])
+
+    start = time.perf_counter()
+    reference = [read_one(image) for image in images]
+    seconds = time.perf_counter() - start
+    megapixels = sum(image.shape[0] * image.shape[1] for image in images) / 1e6
+    rows = [{'setting': 'per_frame', 'frames_per_batch': 1, 'seconds': seconds, 'frames_per_second': len(images) / seconds}]
+    print(f"{'per_frame':<12} {len(images) / seconds:7.2f} frames/s  {megapixels / seconds:7.2f} MP/s", file=sys.stderr)
+
+    for frames_per_batch in (int(v) for v in args.frames_per_batch.split(',')):
+        start = time.perf_counter()
+        results = []
+        for i in range(0, len(images), frames_per_batch):
+            results.extend(read_many(images[i:i + frames_per_batch]))
+        seconds = time.perf_counter() - start
+        agreement = [word_scores(words(text), words(ref_text))['f1'] for (_, text), (_, ref_text) in zip(results, reference)]
+        rows.append({
+            'setting': 'batched',
+            'frames_per_batch': frames_per_batch,
+            'seconds': seconds,
+            'frames_per_second': len(images) / seconds,
+            'word_f1_vs_per_frame': float(np.mean(agreement)),
+        })
+        print(f"{'batched':<12} {len(images) / seconds:7.2f} frames/s  {megapixels / seconds:7.2f} MP/s  "
+              f"frames/batch {frames_per_batch:3d}  word F1 vs per-frame {np.mean(agreement):.3f}", file=sys.stderr)
+
+    text = json.dumps({
+        'engine': 'paddleocr' if args.paddle else 'easyocr',
+        'mode': args.mode,
+        'batch_size': args.batch_size,
+        'images': names,
+        'megapixels': megapixels,
+        'results': rows,
+    }, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,130 @@
+"""
+Full vs recognition-only EasyOCR (util/ocr_engine.py).
+
+For each screen, OCR runs both ways: `run_easyocr` (CRAFT detection, then
+recognition) and `run_easyocr_recognize` (recognition of `text_line_proposals`
+only). The report gives the median latency of each mode, how many proposals
+were recognized, how many ground-truth text elements a proposal covers, and
+word-level precision/recall/F1. Synthetic screens (util/synthetic.py) are
+scored against their ground truth; the imgs/ samples, which have none, against
+the full mode's words.
+
+    python -m benchmarks.bench_ocr_modes
+    python -m benchmarks.bench_ocr_modes --resolutions 1920x1080,2560x1440 --repeats 5 --cpu
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.bench_parse import SAMPLE_IMAGES
+from util.ocr_engine import create_easyocr_reader, run_easyocr, run_easyocr_recognize, text_line_proposals
+from util.synthetic import LAYOUTS, generate_screen
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Full vs recognition-only OCR benchmark')
+    parser.add_argument('--out', type=str, default=None, help='Write JSON results here (default: stdout)')
+    parser.add_argument('--resolutions', type=str, default='1280x720,1920x1080')
+    parser.add_argument('--layouts', type=str, default='text_rows,mixed')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--cpu', action='store_true', help='Run EasyOCR on the CPU')
+    parser.add_argument('--no_samples', action='store_true', help='Skip the bundled imgs/ screenshots')
+    return parser.parse_args()
+
+
+def build_cases(args):
+    cases = []
+    for resolution in args.resolutions.split(','):
+        width, height = (int(v) for v in resolution.split('x'))
+        for layout in args.layouts.split(','):
+            assert layout in LAYOUTS, layout
+            image, elements = generate_screen(width, height, layout=layout, density=0.6)
+            texts = [e for e in elements if e['type'] == 'text']
+            cases.append({'name': f'synthetic/{layout}/{resolution}', 'image': np.asarray(image), 'texts': texts})
+    if not args.no_samples:
+        for name in SAMPLE_IMAGES:
+            path = os.path.join(root_dir, 'imgs', name)
+            if os.path.exists(path):
+                cases.append({'name': f'sample/{name}', 'image': np.asarray(Image.open(path).convert('RGB')), 'texts': None})
+    return cases
+
+
+def words(texts):
+    return Counter(word for text in texts for word in text.lower().split())
+
+
+def word_scores(predicted, reference):
+    common = sum((predicted & reference).values())
+    precision = common / max(sum(predicted.values()), 1)
+    recall = common / max(sum(reference.values()), 1)
+    f1 = 2 * precision * recall / (precision + recall) if common else 0.0
+    return {'precision': precision, 'recall': recall, 'f1': f1}
+
+
+def covered(texts, proposals):
+    """Ground-truth text elements whose centre lies in some proposal ([x_min, x_max, y_min, y_max])."""
+    count = 0
+    for elem in texts:
+        x, y = (elem['bbox'][0] + elem['bbox'][2]) / 2, (elem['bbox'][1] + elem['bbox'][3]) / 2
+        count += any(x1 <= x <= x2 and y1 <= y <= y2 for x1, x2, y1, y2 in proposals)
+    return count
+
+
+def timed(fn, repeats):
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        latencies.append(time.perf_counter() - start)
+    return result, statistics.median(latencies)
+
+
+def run_case(case, reader, args):
+    image = case['image']
+    start = time.perf_counter()
+    proposals = text_line_proposals(image)
+    proposal_seconds = time.perf_counter() - start
+    (_, full_text), full_seconds = timed(lambda: run_easyocr(reader, image, {'paragraph': False, 'text_threshold': 0.9}), args.repeats)
+    (_, recognize_text), recognize_seconds = timed(lambda: run_easyocr_recognize(reader, image, proposals=proposals), args.repeats)
+    result = {
+        'name': case['name'],
+        'proposals': len(proposals),
+        'proposal_ms': proposal_seconds * 1000,
+        'full': {'ms': full_seconds * 1000, 'boxes': len(full_text)},
+        'recognize': {'ms': (recognize_seconds + proposal_seconds) * 1000, 'boxes': len(recognize_text)},
+    }
+    if case['texts'] is not None:
+        reference = words(elem['content'] for elem in case['texts'])
+        result['text_elements'] = len(case['texts'])
+        result['proposal_coverage'] = covered(case['texts'], proposals) / max(len(case['texts']), 1)
+        result['full'].update(word_scores(words(full_text), reference))
+        result['recognize'].update(word_scores(words(recognize_text), reference))
+    else:
+        result['recognize']['vs_full'] = word_scores(words(recognize_text), words(full_text))
+    print(f"{case['name']:<36} proposals {len(proposals):4d}  full {full_seconds * 1000:8.1f} ms  "
+          f"recognize {result['recognize']['ms']:8.1f} ms", file=sys.stderr)
+    return result
+
+
+def main(args):
+    reader = create_easyocr_reader(gpu=not args.cpu)
+    results = [run_case(case, reader, args) for case in build_cases(args)]
+    text = json.dumps({'repeats': args.repeats, 'cases': results}, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
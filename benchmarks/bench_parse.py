@@ -0,0 +1,174 @@
+"""
+Parser benchmark on synthetic screens and the bundled imgs/ samples.
+
+Runs `Omniparser.parse` end to end (base64 in, SOM image + elements out) and
+records per-stage latency, throughput and memory for every case. By default
+the icon detector, caption model and OCR reader are CPU stand-ins
+(benchmarks/stubs.py) so the suite runs anywhere without downloaded weights.
+Pass --real_ocr to read text with EasyOCR (downloads its weights on first use),
+or --real to load all the actual models.
+
+    python -m benchmarks.bench_parse --out results/bench.json
+    python -m benchmarks.bench_parse --quick
+    python -m benchmarks.bench_parse --quick --real_ocr
+    python -m benchmarks.bench_parse --real --som_model_path weights/icon_detect/model.pt --caption_model_path weights/icon_caption_florence
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+
+from PIL import Image
+import torch
+
+from util.metrics import process_rss_bytes
+from util.omniparser import Omniparser
+from util.synthetic import LAYOUTS, generate_screen
+
+SAMPLE_IMAGES = ['google_page.png', 'windows.png', 'windows_multitab.png', 'excel.png', 'word.png', 'teams.png', 'onenote.png', 'mobile.png', 'ios.png']
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Omniparser parse benchmark')
+    parser.add_argument('--out', type=str, default=None, help='Write JSON results here (default: stdout)')
+    parser.add_argument('--resolutions', type=str, default='1280x720,1920x1080,3840x2160')
+    parser.add_argument('--layouts', type=str, default=','.join(LAYOUTS))
+    parser.add_argument('--densities', type=str, default='0.3,0.8')
+    parser.add_argument('--no_samples', action='store_true', help='Skip the bundled imgs/ screenshots')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quick', action='store_true', help='One resolution, one density, no samples')
+    parser.add_argument('--real', action='store_true', help='Use the real detector, caption model and OCR')
+    parser.add_argument('--real_ocr', action='store_true', help='Use EasyOCR with the stand-in detector and caption model')
+    parser.add_argument('--som_model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--caption_model_name', type=str, default='florence2')
+    parser.add_argument('--caption_model_path', type=str, default='weights/icon_caption_florence')
+    parser.add_argument('--BOX_TRESHOLD', type=float, default=0.05)
+    return parser.parse_args()
+
+
+def encode_image(image: Image.Image) -> str:
+    buffered = io.BytesIO()
+    image.save(buffered, format='PNG')
+    return base64.b64encode(buffered.getvalue()).decode('ascii')
+
+
+def build_cases(args):
+    resolutions = ['1920x1080'] if args.quick else args.resolutions.split(',')
+    densities = [0.5] if args.quick else [float(d) for d in args.densities.split(',')]
+    cases = []
+    for resolution in resolutions:
+        width, height = (int(v) for v in resolution.split('x'))
+        for layout in args.layouts.split(','):
+            for density in densities:
+                image, elements = generate_screen(width, height, layout=layout, density=density, seed=args.seed)
+                cases.append({'name': f'synthetic/{layout}/{resolution}/d{density}', 'image': image, 'ground_truth': len(elements)})
+    if not (args.quick or args.no_samples):
+        for name in SAMPLE_IMAGES:
+            path = os.path.join(root_dir, 'imgs', name)
+            if os.path.exists(path):
+                cases.append({'name': f'sample/{name}', 'image': Image.open(path).convert('RGB'), 'ground_truth': None})
+    return cases
+
+
+def summarize(values):
+    return {'mean': statistics.fmean(values), 'median': statistics.median(values), 'min': min(values)}
+
+
+def run_case(omniparser: Omniparser, case: dict, repeats: int, warmup: int) -> dict:
+    image_base64 = encode_image(case['image'])
+    for _ in range(warmup):
+        omniparser.parse(image_base64)
+
+    totals, stage_times, num_elements = [], {}, 0
+    for _ in range(repeats):
+        stats = {}
+        start = time.perf_counter()
+        _, parsed_content_list = omniparser.parse(image_base64, stats=stats)
+        totals.append(time.perf_counter() - start)
+        for stage, seconds in stats['timings'].items():
+            stage_times.setdefault(stage, []).append(seconds)
+        num_elements = len(parsed_content_list)
+
+    # separate pass so tracing overhead does not skew the timings above
+    tracemalloc.start()
+    omniparser.parse(image_base64)
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = summarize(totals)
+    width, height = case['image'].size
+    return {
+        'name': case['name'],
+        'width': width,
+        'height': height,
+        'ground_truth_elements': case['ground_truth'],
+        'num_elements': num_elements,
+        'total_seconds': total,
+        'stage_seconds': {stage: summarize(values) for stage, values in stage_times.items()},
+        'frames_per_second': 1.0 / total['median'],
+        'megapixels_per_second': width * height / 1e6 / total['median'],
+        'peak_traced_bytes': peak_traced,
+        'rss_bytes': process_rss_bytes(),
+    }
+
+
+def environment(args) -> dict:
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=root_dir, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+        'models': 'real' if args.real else 'stub',
+        'ocr': 'easyocr' if args.real or args.real_ocr else 'stub',
+        'repeats': args.repeats,
+        'seed': args.seed,
+    }
+
+
+def main():
+    args = parse_arguments()
+    config = vars(args)
+    if args.real:
+        omniparser = Omniparser(config)
+    else:
+        from benchmarks.stubs import StubDetector, StubReaderPool, get_stub_caption_model_processor
+        omniparser = Omniparser(config, som_model=StubDetector(), caption_model_processor=get_stub_caption_model_processor())
+        if not args.real_ocr:
+            omniparser.reader_pool = StubReaderPool(omniparser.reader_pool.default_languages)
+
+    results = []
+    for case in build_cases(args):
+        result = run_case(omniparser, case, args.repeats, args.warmup)
+        print(f"{result['name']:<45} {result['total_seconds']['median'] * 1000:9.1f} ms  {result['num_elements']:5d} elements", file=sys.stderr)
+        results.append(result)
+
+    output = json.dumps({'environment': environment(args), 'cases': results}, indent=2)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
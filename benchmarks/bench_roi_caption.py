@@ -0,0 +1,121 @@
+"""
+Per-crop vs shared-backbone (roi) Florence-2 captioning.
+
+For each screen, the same icon boxes are captioned both ways: `caption_crops`
+(one vision pass per 64x64 crop) and `RoiCaptioner` (one tiled vision pass over
+the frame, roi_align per icon). The report gives latency per path, the pixels
+fed to the vision encoder (a proxy for its FLOPs), and how well roi captions
+agree with per-crop captions (exact match and token F1). Boxes come from the
+synthetic screens' ground truth and, for the imgs/ samples, from the icon
+detector. Needs the Florence-2 caption weights; the CPU stand-in has no vision
+tower to share.
+
+    python -m benchmarks.bench_roi_caption --caption_model_path weights/icon_caption_florence
+    python -m benchmarks.bench_roi_caption --scales 1.5,2,3 --roi_sizes 6,8,12
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.bench_icon_index import token_f1
+from benchmarks.bench_parse import SAMPLE_IMAGES
+from util.roi_caption import RoiCaptioner
+from util.synthetic import generate_screen
+from util.utils import caption_crops, crop_icon, get_caption_model_processor
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Per-crop vs roi caption benchmark')
+    parser.add_argument('--out', type=str, default=None, help='Write JSON results here (default: stdout)')
+    parser.add_argument('--caption_model_path', type=str, default='weights/icon_caption_florence')
+    parser.add_argument('--som_model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--scales', type=str, default='2')
+    parser.add_argument('--roi_sizes', type=str, default='8')
+    parser.add_argument('--resolutions', type=str, default='1280x720,1920x1080')
+    parser.add_argument('--no_samples', action='store_true', help='Skip the bundled imgs/ screenshots')
+    return parser.parse_args()
+
+
+def build_cases(args):
+    cases = []
+    for resolution in args.resolutions.split(','):
+        width, height = (int(v) for v in resolution.split('x'))
+        image, elements = generate_screen(width, height, layout='mixed', density=0.6)
+        boxes = [[e['bbox'][0] / width, e['bbox'][1] / height, e['bbox'][2] / width, e['bbox'][3] / height] for e in elements if e['type'] == 'icon']
+        cases.append({'name': f'synthetic/mixed/{resolution}', 'image': np.asarray(image), 'boxes': boxes})
+    if not args.no_samples:
+        if os.path.exists(args.som_model_path):
+            from util.utils import get_yolo_model
+            detector = get_yolo_model(args.som_model_path)
+        else:
+            from benchmarks.stubs import StubDetector
+            detector = StubDetector()
+        for name in SAMPLE_IMAGES:
+            path = os.path.join(root_dir, 'imgs', name)
+            if not os.path.exists(path):
+                continue
+            image = Image.open(path).convert('RGB')
+            width, height = image.size
+            xyxy = detector.predict(source=image, conf=0.05)[0].boxes.xyxy.tolist()
+            boxes = [[x1 / width, y1 / height, x2 / width, y2 / height] for x1, y1, x2, y2 in xyxy]
+            cases.append({'name': f'sample/{name}', 'image': np.asarray(image), 'boxes': boxes})
+    return cases
+
+
+def run_case(case, caption_model_processor, captioners):
+    image, boxes = case['image'], case['boxes']
+    model = caption_model_processor['model']
+    crops = [Image.fromarray(crop_icon(box, image)) for box in boxes]
+    start = time.perf_counter()
+    reference = caption_crops(crops, caption_model_processor)
+    crop_seconds = time.perf_counter() - start
+    # on cuda the per-crop path feeds crops at 64x64 (do_resize=False), elsewhere at the processor's 768x768
+    crop_side = 64 if model.device.type == 'cuda' else 768
+    result = {
+        'name': case['name'],
+        'icons': len(boxes),
+        'crop': {'seconds': crop_seconds, 'encoder_megapixels': len(boxes) * crop_side * crop_side / 1e6},
+        'roi': [],
+    }
+    for captioner in captioners:
+        start = time.perf_counter()
+        features = captioner.encode_frame(image)
+        encode_seconds = time.perf_counter() - start
+        captions = captioner.caption(image, boxes, features=features)
+        seconds = time.perf_counter() - start
+        rows, cols = captioner.grid(*image.shape[:2])
+        result['roi'].append({
+            'scale': captioner.scale,
+            'roi_size': captioner.roi_size,
+            'seconds': seconds,
+            'encode_seconds': encode_seconds,
+            'encoder_megapixels': rows * cols * captioner.tile * captioner.tile / 1e6,
+            'exact_agreement': float(np.mean([a == b for a, b in zip(captions, reference)])) if boxes else None,
+            'token_f1': float(np.mean([token_f1(a, b) for a, b in zip(captions, reference)])) if boxes else None,
+            'examples': [{'crop': b, 'roi': a} for a, b in list(zip(captions, reference))[:5]],
+        })
+    return result
+
+
+def main(args):
+    caption_model_processor = get_caption_model_processor(model_name='florence2', model_name_or_path=args.caption_model_path)
+    captioners = [RoiCaptioner(caption_model_processor, scale=float(scale), roi_size=int(roi_size))
+                  for scale in args.scales.split(',') for roi_size in args.roi_sizes.split(',')]
+    results = [run_case(case, caption_model_processor, captioners) for case in build_cases(args)]
+    text = json.dumps({'caption_model': args.caption_model_path, 'cases': results}, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
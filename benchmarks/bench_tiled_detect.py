@@ -0,0 +1,112 @@
+"""
+Single-pass vs tiled icon detection on high-resolution screens.
+
+Synthetic 4K, 1440p and ultra-wide screens are drawn with 1080p-sized elements
+(100% display scaling, so icons are small relative to the frame), and detected
+in three ways:
+    single   - `predict_yolo` at the detector's own input size (the default)
+    native   - one pass at the frame's longer side
+    tiled    - `predict_yolo_tiled` for each --tiles size
+For each mode the report gives icon recall (a ground-truth icon counts as found
+when a detection overlaps it with IoU >= --match_iou), the number of boxes, and
+the median latency. The detector is the icon model if its weights exist, else
+the CPU stand-in; only the real model says anything about recall.
+
+    python -m benchmarks.bench_tiled_detect --som_model_path weights/icon_detect/model.pt
+    python -m benchmarks.bench_tiled_detect --resolutions 3840x2160 --tiles 960,1280,1600
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+
+import numpy as np
+import torch
+from torchvision.ops import box_iou
+
+from util.synthetic import generate_screen
+from util.tiled_detect import predict_yolo_tiled, tile_grid
+from util.utils import predict_yolo
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Single-pass vs tiled detection benchmark')
+    parser.add_argument('--out', type=str, default=None, help='Write JSON results here (default: stdout)')
+    parser.add_argument('--som_model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--resolutions', type=str, default='2560x1440,3440x1440,3840x2160,5120x1440')
+    parser.add_argument('--tiles', type=str, default='1280')
+    parser.add_argument('--overlap', type=int, default=160)
+    parser.add_argument('--ui_scale', type=float, default=1.0, help='Element size relative to 1080p')
+    parser.add_argument('--density', type=float, default=0.6)
+    parser.add_argument('--screens', type=int, default=3, help='Screens per resolution')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--match_iou', type=float, default=0.5)
+    parser.add_argument('--BOX_TRESHOLD', type=float, default=0.05)
+    return parser.parse_args()
+
+
+def icon_recall(detected: torch.Tensor, truth: torch.Tensor, match_iou: float) -> float:
+    if not len(truth):
+        return 1.0
+    if not len(detected):
+        return 0.0
+    return (box_iou(truth, detected.float().cpu()).max(dim=1).values >= match_iou).float().mean().item()
+
+
+def run_mode(detect, screens, repeats, match_iou):
+    latencies, recalls, boxes = [], [], []
+    for image_bgr, truth in screens:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            xyxy, _, _ = detect(image_bgr)
+            latencies.append(time.perf_counter() - start)
+        recalls.append(icon_recall(xyxy, truth, match_iou))
+        boxes.append(len(xyxy))
+    return {'recall': statistics.mean(recalls), 'boxes': statistics.mean(boxes), 'latency_p50': statistics.median(latencies)}
+
+
+def main(args):
+    if os.path.exists(args.som_model_path):
+        from util.utils import get_yolo_model
+        model, detector = get_yolo_model(args.som_model_path), 'real'
+    else:
+        from benchmarks.stubs import StubDetector
+        model, detector = StubDetector(), 'stub'
+    results = []
+    for resolution in args.resolutions.split(','):
+        width, height = (int(v) for v in resolution.split('x'))
+        screens = []
+        for seed in range(args.screens):
+            image, elements = generate_screen(width, height, layout='mixed', density=args.density, seed=seed, ui_scale=args.ui_scale)
+            truth = torch.tensor([e['bbox'] for e in elements if e['type'] == 'icon'], dtype=torch.float32).reshape(-1, 4)
+            screens.append((np.ascontiguousarray(np.asarray(image)[:, :, ::-1]), truth))
+        native = -(-max(width, height) // 32) * 32
+        modes = {
+            'single': lambda im: predict_yolo(model, im, args.BOX_TRESHOLD, imgsz=None, scale_img=False, iou_threshold=0.1),
+            f'native_{native}': lambda im: predict_yolo(model, im, args.BOX_TRESHOLD, imgsz=native, scale_img=True, iou_threshold=0.1),
+        }
+        for tile in (int(t) for t in args.tiles.split(',')):
+            modes[f'tiled_{tile}'] = lambda im, tile=tile: predict_yolo_tiled(model, im, args.BOX_TRESHOLD, tile=tile, overlap=args.overlap, iou_threshold=0.1)
+        case = {'resolution': resolution, 'icons': statistics.mean(len(t) for _, t in screens), 'modes': {}}
+        for name, detect in modes.items():
+            detect(screens[0][0])  # warm up (kernel selection for this input shape)
+            case['modes'][name] = run_mode(detect, screens, args.repeats, args.match_iou)
+            if name.startswith('tiled_'):
+                case['modes'][name]['tiles'] = len(tile_grid(width, height, int(name.split('_')[1]), args.overlap))
+            m = case['modes'][name]
+            print(f"{resolution:<10} {name:<14} recall {m['recall']:.3f}  boxes {m['boxes']:7.1f}  p50 {m['latency_p50'] * 1000:8.1f} ms", file=sys.stderr)
+        results.append(case)
+    text = json.dumps({'detector': detector, 'ui_scale': args.ui_scale, 'overlap': args.overlap, 'cases': results}, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,261 @@
+"""
+Parity and speed check for the tensor overlap filters (util/box_ops.py).
+
+`remove_overlap` and `remove_overlap_new` are compared against the list-based
+originals they replaced (`remove_overlap_legacy`, `remove_overlap_new_legacy`,
+kept in this script) on random boxes and on the elements of synthetic screens
+(`util/synthetic.py`), with OCR boxes and without. Outputs must be identical;
+the script exits non-zero on the first mismatch and otherwise prints the median
+time of both versions for each case.
+
+    python -m benchmarks.check_box_ops
+    python -m benchmarks.check_box_ops --sizes 50,200,800 --cases 20
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+
+import torch
+
+from util.synthetic import generate_screen
+from util.utils import remove_overlap, remove_overlap_new
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Tensor vs list-based overlap filtering')
+    parser.add_argument('--sizes', type=str, default='20,100,400', help='Icon boxes per random case')
+    parser.add_argument('--cases', type=int, default=10, help='Random cases per size')
+    parser.add_argument('--screens', type=int, default=5, help='Synthetic screens')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--iou_threshold', type=float, default=0.7)
+    return parser.parse_args()
+
+
+def remove_overlap_legacy(boxes, iou_threshold, ocr_bbox=None):
+    """List-based original of `remove_overlap`, the reference for the parity check."""
+    assert ocr_bbox is None or isinstance(ocr_bbox, list)
+
+    def box_area(box):
+        return (box[2] - box[0]) * (box[3] - box[1])
+
+    def intersection_area(box1, box2):
+        x1 = max(box1[0], box2[0])
+        y1 = max(box1[1], box2[1])
+        x2 = min(box1[2], box2[2])
+        y2 = min(box1[3], box2[3])
+        return max(0, x2 - x1) * max(0, y2 - y1)
+
+    def IoU(box1, box2):
+        intersection = intersection_area(box1, box2)
+        union = box_area(box1) + box_area(box2) - intersection + 1e-6
+        if box_area(box1) > 0 and box_area(box2) > 0:
+            ratio1 = intersection / box_area(box1)
+            ratio2 = intersection / box_area(box2)
+        else:
+            ratio1, ratio2 = 0, 0
+        return max(intersection / union, ratio1, ratio2)
+
+    def is_inside(box1, box2):
+        # return box1[0] >= box2[0] and box1[1] >= box2[1] and box1[2] <= box2[2] and box1[3] <= box2[3]
+        intersection = intersection_area(box1, box2)
+        ratio1 = intersection / box_area(box1)
+        return ratio1 > 0.95
+
+    boxes = boxes.tolist()
+    filtered_boxes = []
+    if ocr_bbox:
+        filtered_boxes.extend(ocr_bbox)
+    # print('ocr_bbox!!!', ocr_bbox)
+    for i, box1 in enumerate(boxes):
+        # if not any(IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2) for j, box2 in enumerate(boxes) if i != j):
+        is_valid_box = True
+        for j, box2 in enumerate(boxes):
+            # keep the smaller box
+            if i != j and IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2):
+                is_valid_box = False
+                break
+        if is_valid_box:
+            # add the following 2 lines to include ocr bbox
+            if ocr_bbox:
+                # only add the box if it does not overlap with any ocr bbox
+                if not any(IoU(box1, box3) > iou_threshold and not is_inside(box1, box3) for k, box3 in enumerate(ocr_bbox)):
+                    filtered_boxes.append(box1)
+            else:
+                filtered_boxes.append(box1)
+    return torch.tensor(filtered_boxes)
+
+
+def remove_overlap_new_legacy(boxes, iou_threshold, ocr_bbox=None):
+    '''
+    List-based original of `remove_overlap_new`, the reference for the parity check.
+
+    ocr_bbox format: [{'type': 'text', 'bbox':[x,y], 'interactivity':False, 'content':str }, ...]
+    boxes format: [{'type': 'icon', 'bbox':[x,y], 'interactivity':True, 'content':None }, ...]
+
+    '''
+    assert ocr_bbox is None or isinstance(ocr_bbox, list)
+
+    def box_area(box):
+        return (box[2] - box[0]) * (box[3] - box[1])
+
+    def intersection_area(box1, box2):
+        x1 = max(box1[0], box2[0])
+        y1 = max(box1[1], box2[1])
+        x2 = min(box1[2], box2[2])
+        y2 = min(box1[3], box2[3])
+        return max(0, x2 - x1) * max(0, y2 - y1)
+
+    def IoU(box1, box2):
+        intersection = intersection_area(box1, box2)
+        union = box_area(box1) + box_area(box2) - intersection + 1e-6
+        if box_area(box1) > 0 and box_area(box2) > 0:
+            ratio1 = intersection / box_area(box1)
+            ratio2 = intersection / box_area(box2)
+        else:
+            ratio1, ratio2 = 0, 0
+        return max(intersection / union, ratio1, ratio2)
+
+    def is_inside(box1, box2):
+        # return box1[0] >= box2[0] and box1[1] >= box2[1] and box1[2] <= box2[2] and box1[3] <= box2[3]
+        intersection = intersection_area(box1, box2)
+        ratio1 = intersection / box_area(box1)
+        return ratio1 > 0.80
+
+    # boxes = boxes.tolist()
+    filtered_boxes = []
+    if ocr_bbox:
+        filtered_boxes.extend(ocr_bbox)
+    # print('ocr_bbox!!!', ocr_bbox)
+    for i, box1_elem in enumerate(boxes):
+        box1 = box1_elem['bbox']
+        is_valid_box = True
+        for j, box2_elem in enumerate(boxes):
+            # keep the smaller box
+            box2 = box2_elem['bbox']
+            if i != j and IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2):
+                is_valid_box = False
+                break
+        if is_valid_box:
+            if ocr_bbox:
+                # keep yolo boxes + prioritize ocr label
+                box_added = False
+                ocr_labels = ''
+                for box3_elem in ocr_bbox:
+                    if not box_added:
+                        box3 = box3_elem['bbox']
+                        if is_inside(box3, box1): # ocr inside icon
+                            # box_added = True
+                            # delete the box3_elem from ocr_bbox
+                            try:
+                                # gather all ocr labels
+                                ocr_labels += box3_elem['content'] + ' '
+                                filtered_boxes.remove(box3_elem)
+                            except:
+                                continue
+                            # break
+                        elif is_inside(box1, box3): # icon inside ocr, don't added this icon box, no need to check other ocr bbox bc no overlap between ocr bbox, icon can only be in one ocr box
+                            box_added = True
+                            break
+                        else:
+                            continue
+                if not box_added:
+                    if ocr_labels:
+                        filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': ocr_labels, 'source':'box_yolo_content_ocr'})
+                    else:
+                        filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': None, 'source':'box_yolo_content_yolo'})
+            else:
+                filtered_boxes.append(box1)
+    return filtered_boxes # torch.tensor(filtered_boxes)
+
+
+def random_boxes(rng, n, max_side=0.2):
+    boxes = []
+    for _ in range(n):
+        x, y = rng.random(), rng.random()
+        bw, bh = rng.random() * max_side, rng.random() * max_side
+        # some duplicates and nested boxes, which is where the filters disagree if anything does
+        if boxes and rng.random() < 0.15:
+            x0, y0, x1, y1 = rng.choice(boxes)
+            s = rng.uniform(0.5, 1.0)
+            boxes.append([x0, y0, x0 + (x1 - x0) * s, y0 + (y1 - y0) * s])
+            continue
+        boxes.append([x, y, min(x + bw, 1.0), min(y + bh, 1.0)])
+    return boxes
+
+
+def random_case(rng, n):
+    icons = random_boxes(rng, n)
+    ocr = random_boxes(rng, max(n // 2, 1), max_side=0.1)
+    contents = [None if rng.random() < 0.05 else f'text {i}' for i in range(len(ocr))]
+    return icons, ocr, contents
+
+
+def screen_case(seed):
+    image, elements = generate_screen(1920, 1080, layout='mixed', density=0.8, seed=seed)
+    w, h = image.size
+
+    def ratio(b):
+        return [b[0] / w, b[1] / h, b[2] / w, b[3] / h]
+
+    icons = [ratio(e['bbox']) for e in elements if e['type'] != 'text']
+    ocr = [ratio(e['bbox']) for e in elements if e['type'] == 'text']
+    return icons, ocr, [f'text {i}' for i in range(len(ocr))]
+
+
+def timed(fn, repeats):
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        latencies.append(time.perf_counter() - start)
+    return result, statistics.median(latencies)
+
+
+def check(name, icons, ocr, contents, args):
+    tensor = torch.tensor(icons, dtype=torch.float32).reshape(-1, 4)
+
+    def icon_elems():
+        return [{'type': 'icon', 'bbox': b, 'interactivity': True, 'content': None} for b in icons]
+
+    def ocr_elems():
+        return [{'type': 'text', 'bbox': b, 'interactivity': False, 'content': c, 'source': 'box_ocr_content_ocr'} for b, c in zip(ocr, contents)]
+
+    variants = {
+        'remove_overlap': (lambda: remove_overlap_legacy(tensor, args.iou_threshold, None), lambda: remove_overlap(tensor, args.iou_threshold, None)),
+        'remove_overlap+ocr': (lambda: remove_overlap_legacy(tensor, args.iou_threshold, list(ocr)), lambda: remove_overlap(tensor, args.iou_threshold, list(ocr))),
+        'remove_overlap_new': (lambda: remove_overlap_new_legacy(icon_elems(), args.iou_threshold, None), lambda: remove_overlap_new(icon_elems(), args.iou_threshold, None)),
+        'remove_overlap_new+ocr': (lambda: remove_overlap_new_legacy(icon_elems(), args.iou_threshold, ocr_elems()), lambda: remove_overlap_new(icon_elems(), args.iou_threshold, ocr_elems())),
+    }
+    rows = []
+    for variant, (legacy_fn, tensor_fn) in variants.items():
+        expected, legacy_s = timed(legacy_fn, args.repeats)
+        got, tensor_s = timed(tensor_fn, args.repeats)
+        same = torch.equal(expected, got) if isinstance(expected, torch.Tensor) else expected == got
+        if not same:
+            print(f'MISMATCH {name} {variant}:\n  legacy {expected}\n  tensor {got}', file=sys.stderr)
+            sys.exit(1)
+        rows.append({'case': name, 'variant': variant, 'icons': len(icons), 'ocr': len(ocr), 'legacy_ms': legacy_s * 1000, 'tensor_ms': tensor_s * 1000})
+        print(f'{name:<16} {variant:<24} icons {len(icons):5d}  legacy {legacy_s * 1000:9.2f} ms  tensor {tensor_s * 1000:7.2f} ms', file=sys.stderr)
+    return rows
+
+
+def main(args):
+    rng = random.Random(0)
+    results = []
+    for n in (int(s) for s in args.sizes.split(',')):
+        for i in range(args.cases):
+            results.extend(check(f'random_{n}_{i}', *random_case(rng, n), args))
+    for seed in range(args.screens):
+        results.extend(check(f'screen_{seed}', *screen_case(seed), args))
+    print(json.dumps({'iou_threshold': args.iou_threshold, 'identical': True, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,54 @@
+"""
+Compare two bench_parse.py JSON results case by case.
+
+    python -m benchmarks.compare before.json after.json [--stage caption]
+
+Prints median latency before/after and the after/before ratio (<1.0 is faster).
+"""
+import argparse
+import json
+
+
+def load(path):
+    with open(path) as f:
+        data = json.load(f)
+    return data['environment'], {case['name']: case for case in data['cases']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--stage', type=str, default=None, help='Compare one stage instead of the total')
+    args = parser.parse_args()
+
+    env_before, before = load(args.before)
+    env_after, after = load(args.after)
+    print(f"before: {env_before.get('commit')} ({env_before.get('models')})  after: {env_after.get('commit')} ({env_after.get('models')})")
+    print(f"{'case':<45} {'before ms':>10} {'after ms':>10} {'ratio':>7} {'peak MB':>9}")
+    ratios = []
+    for name, case_after in after.items():
+        case_before = before.get(name)
+        if case_before is None:
+            continue
+        if args.stage:
+            if args.stage not in case_before['stage_seconds'] or args.stage not in case_after['stage_seconds']:
+                continue
+            t_before = case_before['stage_seconds'][args.stage]['median']
+            t_after = case_after['stage_seconds'][args.stage]['median']
+        else:
+            t_before = case_before['total_seconds']['median']
+            t_after = case_after['total_seconds']['median']
+        ratio = t_after / t_before if t_before > 0 else float('nan')
+        ratios.append(ratio)
+        peak_mb = case_after['peak_traced_bytes'] / 2 ** 20
+        print(f'{name:<45} {t_before * 1000:10.1f} {t_after * 1000:10.1f} {ratio:7.2f} {peak_mb:9.1f}')
+    if ratios:
+        geomean = 1.0
+        for ratio in ratios:
+            geomean *= ratio
+        print(f"{'geometric mean ratio':<45} {'':>10} {'':>10} {geomean ** (1 / len(ratios)):7.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Tiny CPU stand-ins for the icon detector, caption model and OCR reader.
+
+They implement just the interfaces `util.utils` calls (ultralytics `predict`,
+HF processor/`generate`/`batch_decode`, EasyOCR `readtext`/`detect`/`recognize`)
+and do a small amount of real work that scales with the input, so stage timings
+move when the pipeline around them changes, without needing downloaded weights.
+"""
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from util.ocr_engine import normalize_languages, text_line_proposals
+
+
+class _Boxes(object):
+    def __init__(self, xyxy: torch.Tensor, conf: torch.Tensor):
+        self.xyxy = xyxy
+        self.conf = conf
+
+
+class _Result(object):
+    def __init__(self, boxes: _Boxes):
+        self.boxes = boxes
+
+
+class StubDetector(object):
+    """Edge + contour box proposer with the `YOLO.predict` call signature."""
+
+    def __init__(self, min_size: int = 6, max_fraction: float = 0.25):
+        self.min_size = min_size
+        self.max_fraction = max_fraction
+
+    def _detect(self, image) -> _Result:
+        # like ultralytics: PIL images are RGB, arrays are BGR
+        if isinstance(image, Image.Image):
+            gray = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2GRAY)
+        else:
+            gray = cv2.cvtColor(np.ascontiguousarray(image), cv2.COLOR_BGR2GRAY)
+        h, w = gray.shape[:2]
+        edges = cv2.Canny(gray, 50, 150)
+        edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = []
+        for contour in contours:
+            x, y, bw, bh = cv2.boundingRect(contour)
+            if bw >= self.min_size and bh >= self.min_size and bw * bh <= self.max_fraction * w * h:
+                boxes.append([x, y, x + bw, y + bh])
+        xyxy = torch.tensor(boxes, dtype=torch.float32).reshape(-1, 4)
+        return _Result(_Boxes(xyxy, torch.full((len(boxes),), 0.5)))
+
+    def predict(self, source, conf=0.25, iou=0.7, imgsz=None, **kwargs):
+        sources = source if isinstance(source, (list, tuple)) else [source]
+        return [self._detect(image) for image in sources]
+
+
+class _StubBatch(dict):
+    def to(self, device=None, dtype=None):
+        for k, v in self.items():
+            if v.is_floating_point() and dtype is not None:
+                self[k] = v.to(device=device, dtype=dtype)
+            else:
+                self[k] = v.to(device=device)
+        return self
+
+
+class StubCaptionProcessor(object):
+    labels = ['button', 'menu', 'settings', 'search', 'close', 'folder', 'document', 'arrow', 'user', 'star']
+
+    def __call__(self, images=None, text=None, return_tensors='pt', **kwargs):
+        pixels = np.stack([np.asarray(im.convert('RGB').resize((64, 64))) for im in images]).astype(np.float32) / 255.0
+        pixel_values = torch.from_numpy(pixels).permute(0, 3, 1, 2).contiguous()
+        input_ids = torch.zeros((len(images), 4), dtype=torch.long)
+        return _StubBatch(input_ids=input_ids, pixel_values=pixel_values)
+
+    def batch_decode(self, ids, skip_special_tokens=True, **kwargs):
+        return [' '.join(self.labels[int(t) % len(self.labels)] for t in row) for row in ids]
+
+
+class _StubConfig(object):
+    # 'florence' selects the florence prompt and generate() call in get_parsed_content_icon
+    name_or_path = 'stub-florence'
+    model_type = 'stub'
+
+
+class StubCaptionModel(torch.nn.Module):
+    """A few conv layers and a linear head, decoded greedily for `max_new_tokens` steps."""
+
+    def __init__(self, width: int = 32, vocab: int = 10):
+        super().__init__()
+        torch.manual_seed(0)
+        self.config = _StubConfig()
+        self.encoder = torch.nn.Sequential(
+            torch.nn.Conv2d(3, width, 3, stride=2, padding=1), torch.nn.ReLU(),
+            torch.nn.Conv2d(width, width, 3, stride=2, padding=1), torch.nn.ReLU(),
+            torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten(),
+        )
+        self.step = torch.nn.Linear(width + vocab, width)
+        self.head = torch.nn.Linear(width, vocab)
+        self.vocab = vocab
+
+    @property
+    def device(self):
+        return next(self.parameters()).device
+
+    @torch.no_grad()
+    def generate(self, input_ids=None, pixel_values=None, max_new_tokens=20, **kwargs):
+        state = self.encoder(pixel_values)
+        token = torch.zeros((state.shape[0], self.vocab), device=state.device)
+        out = []
+        for _ in range(min(max_new_tokens, 4)):
+            state = torch.tanh(self.step(torch.cat([state, token], dim=1)))
+            ids = self.head(state).argmax(dim=1)
+            token = torch.nn.functional.one_hot(ids, self.vocab).float()
+            out.append(ids)
+        return torch.stack(out, dim=1)
+
+
+def get_stub_caption_model_processor(device='cpu'):
+    return {'model': StubCaptionModel().to(device), 'processor': StubCaptionProcessor()}
+
+
+class StubOcrReader(object):
+    """Text line proposals (util/ocr_engine.py) read as placeholder words, with EasyOCR's call signatures."""
+    words = ['File', 'Edit', 'View', 'Help', 'Save', 'Open', 'Search', 'Settings', 'Cancel', 'OK']
+
+    def detect(self, img, **kwargs):
+        images = img if img.ndim == 4 else [img]
+        return [text_line_proposals(image) for image in images], [[] for _ in images]
+
+    def recognize(self, img_cv_grey, horizontal_list=None, free_list=None, detail=1, **kwargs):
+        result = []
+        for x_min, x_max, y_min, y_max in horizontal_list or []:
+            quad = [[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]]
+            result.append((quad, self.words[(x_min + y_min) % len(self.words)], 0.9))
+        for poly in free_list or []:
+            result.append((poly, self.words[int(poly[0][0] + poly[0][1]) % len(self.words)], 0.9))
+        return result if detail else [text for _, text, _ in result]
+
+    def readtext(self, image, **kwargs):
+        (horizontal_list,), _ = self.detect(image)
+        return self.recognize(None, horizontal_list=horizontal_list)
+
+
+class StubReaderPool(object):
+    """`util.ocr_engine.ReaderPool` interface around one StubOcrReader, whatever the languages."""
+
+    def __init__(self, default_languages=('en',), max_readers: int = 1):
+        self.default_languages = normalize_languages(default_languages)
+        self.max_readers = max_readers
+        self.reader = StubOcrReader()
+        self.loads = 0
+        self.fallbacks = 0
+
+    def get(self, languages=None):
+        return self.reader, normalize_languages(languages) or self.default_languages
+
+    def __len__(self) -> int:
+        return 1
@@ -1,38 +1,159 @@
 import requests
 import base64
+import atexit
+import copy
+import io
+import sys
+import uuid
 from pathlib import Path
+import numpy as np
+from PIL import Image
 from tools.screen_capture import get_screenshot
 from agent.llm_utils.utils import encode_image
 
 OUTPUT_DIR = "./tmp/outputs"
+# repo root, for the shared memory transport in util/shm_transport.py
+sys.path.append(str(Path(__file__).resolve().parents[4]))
 
 class OmniParserClient:
-    def __init__(self, 
-                 url: str) -> None:
+    def __init__(self,
+                 url: str,
+                 transport: str = "http",
+                 reuse_max_changed_blocks: int | None = 0,
+                 ui_tree: bool = False,
+                 diff: bool = False) -> None:
+        """
+        transport: "http" posts the screenshot as base64, "shm" hands raw frames to a parser on the
+        same host through shared memory (server started with --enable_shm). A screenshot that cannot go
+        through shared memory (no shm on the server, too large, shared memory or connection errors) is
+        sent over http; the next one tries shared memory again.
+        reuse_max_changed_blocks: when the screenshot differs from the previous one in at most this many
+        16px cells (0 = pixel identical), the previous parse is returned without calling the server.
+        None disables reuse on both sides.
+        ui_tree: ask the server for the containment tree of the elements and indent screen_info by nesting.
+        diff: after the first parse, receive only the changes against the previous parse (/parse/diff/);
+        the full element list is rebuilt here and the changes are summarized in screen_info_delta.
+        """
+        from util.frame_hash import FrameChangeDetector
         self.url = url
+        self.transport = transport
+        self.frame_ring = None
+        self.reuse_max_changed_blocks = reuse_max_changed_blocks
+        self.ui_tree = ui_tree
+        self.diff = diff
+        # (parse_id, parsed_content_list) of the last parse, the base of the next diff
+        self.last_parse = None
+        self.session_id = uuid.uuid4().hex
+        self.frame_detector = FrameChangeDetector(max_changed_blocks=reuse_max_changed_blocks or 0)
+        self.last_signature = None
+        self.last_response = None
+
+    def _post_shm(self, screenshot):
+        """Parse response for a screenshot sent through shared memory, None if the server or the ring cannot take it."""
+        frame = np.asarray(screenshot.convert("RGB"))
+        if self.frame_ring is None:
+            from util.shm_transport import FrameRing
+            base_url = self.url.rsplit('/parse/', 1)[0]
+            if not requests.get(f"{base_url}/transport/", timeout=3).json().get("shm"):
+                print("omniparser: server does not accept shared memory frames, using http")
+                return None
+            self.frame_ring = FrameRing.create()
+            atexit.register(self.frame_ring.close)
+        if frame.nbytes > self.frame_ring.slot_bytes:
+            return None
+        frame_ref = self.frame_ring.write(frame)
+        response = self._post({"shm_frame": {k: frame_ref[k] for k in ("name", "slot", "seq")}, **self._request_fields()})
+        response.raise_for_status()
+        return response
+
+    def _post(self, payload: dict):
+        if self.diff and self.last_parse is not None:
+            response = requests.post(self.url.rstrip('/') + '/diff/', json={**payload, "previous_parse_id": self.last_parse[0]})
+            if response.status_code != 404:
+                return response
+            print('omniparser: previous parse expired, requesting a full parse')
+        return requests.post(self.url, json=payload)
+
+    def _request_fields(self):
+        fields = {"ui_tree": True} if self.ui_tree else {}
+        if self.reuse_max_changed_blocks is None:
+            return fields
+        return {"session_id": self.session_id, "reuse_max_changed_blocks": self.reuse_max_changed_blocks, **fields}
 
     def __call__(self,):
         screenshot, screenshot_path = get_screenshot()
         screenshot_path = str(screenshot_path)
         image_base64 = encode_image(screenshot_path)
-        response = requests.post(self.url, json={"base64_image": image_base64})
+        screenshot_path_uuid = Path(screenshot_path).stem.replace("screenshot_", "")
+        signature = None
+        if self.reuse_max_changed_blocks is not None:
+            signature = self.frame_detector.signature(screenshot)
+            if self.frame_detector.is_unchanged(self.last_signature, signature):
+                print('omniparser: screen unchanged, reusing previous parse')
+                return self._reuse_last_response(image_base64, screenshot_path_uuid)
+        response = None
+        if self.transport == "shm":
+            try:
+                response = self._post_shm(screenshot)
+            except (OSError, requests.ConnectionError) as e:
+                # requests' HTTP errors are OSErrors too; the server already got those requests, don't parse twice
+                if isinstance(e, requests.RequestException) and not isinstance(e, requests.ConnectionError):
+                    raise
+                print(f"shared memory transport failed ({e}), sending this screenshot over http")
+        if response is None:
+            response = self._post({"base64_image": image_base64, **self._request_fields()})
         response_json = response.json()
+        if "diff" in response_json:
+            from util.parse_diff import apply_diff, diff_screen_info
+            response_json['parsed_content_list'] = apply_diff(self.last_parse[1], response_json['diff'])
+            response_json['screen_info_delta'] = diff_screen_info(response_json['diff'])
+        if self.diff:
+            self.last_parse = (response_json['parse_id'], response_json['parsed_content_list'])
         print('omniparser latency:', response_json['latency'])
 
-        som_image_data = base64.b64decode(response_json['som_image_base64'])
-        screenshot_path_uuid = Path(screenshot_path).stem.replace("screenshot_", "")
-        som_screenshot_path = f"{OUTPUT_DIR}/screenshot_som_{screenshot_path_uuid}.png"
-        with open(som_screenshot_path, "wb") as f:
-            f.write(som_image_data)
-        
+        if response_json.get('som_image_format', 'png') != 'png':
+            # fast/balanced presets and deadline degradations return a JPEG overlay; the agents expect PNG
+            response_json['som_image_base64'] = self._to_png_base64(response_json['som_image_base64'])
+            response_json['som_image_format'] = 'png'
+        self._write_som_image(response_json['som_image_base64'], screenshot_path_uuid)
+
         response_json['width'] = screenshot.size[0]
         response_json['height'] = screenshot.size[1]
         response_json['original_screenshot_base64'] = image_base64
         response_json['screenshot_uuid'] = screenshot_path_uuid
         response_json = self.reformat_messages(response_json)
+        if signature is not None:
+            signature.release()
+            self.last_signature, self.last_response = signature, response_json
+        return response_json
+
+    @staticmethod
+    def _to_png_base64(image_base64: str) -> str:
+        buffered = io.BytesIO()
+        Image.open(io.BytesIO(base64.b64decode(image_base64))).save(buffered, format="PNG")
+        return base64.b64encode(buffered.getvalue()).decode('ascii')
+
+    def _write_som_image(self, som_image_base64: str, screenshot_path_uuid: str):
+        som_screenshot_path = f"{OUTPUT_DIR}/screenshot_som_{screenshot_path_uuid}.png"
+        with open(som_screenshot_path, "wb") as f:
+            f.write(base64.b64decode(som_image_base64))
+
+    def _reuse_last_response(self, image_base64: str, screenshot_path_uuid: str):
+        response_json = copy.deepcopy(self.last_response)
+        self._write_som_image(response_json['som_image_base64'], screenshot_path_uuid)
+        response_json['original_screenshot_base64'] = image_base64
+        response_json['screenshot_uuid'] = screenshot_path_uuid
+        response_json['latency'] = 0.0
+        response_json['reused'] = True
         return response_json
-    
+
     def reformat_messages(self, response_json: dict):
+        if "ui_tree" in response_json:
+            from util.ui_tree import tree_screen_info
+            for idx, element in enumerate(response_json["parsed_content_list"]):
+                element['idx'] = idx
+            response_json['screen_info'] = tree_screen_info(response_json["parsed_content_list"], response_json["ui_tree"])
+            return response_json
         screen_info = ""
         for idx, element in enumerate(response_json["parsed_content_list"]):
             element['idx'] = idx
@@ -41,4 +162,4 @@ class OmniParserClient:
             elif element['type'] == 'icon':
                 screen_info += f'ID: {idx}, Icon: {element["content"]}\n'
         response_json['screen_info'] = screen_info
-        return response_json
\ No newline at end of file
+        return response_json
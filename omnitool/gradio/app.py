@@ -37,6 +37,7 @@ def parse_arguments():
     parser = argparse.ArgumentParser(description="Gradio App")
     parser.add_argument("--windows_host_url", type=str, default='localhost:8006')
     parser.add_argument("--omniparser_server_url", type=str, default="localhost:8000")
+    parser.add_argument("--omniparser_transport", type=str, default="http", choices=["http", "shm"], help="shm: hand screenshots to a parser on the same host through shared memory")
     return parser.parse_args()
 args = parse_arguments()
 
@@ -242,7 +243,8 @@ def process_input(user_input, state):
         api_key=state["api_key"],
         only_n_most_recent_images=state["only_n_most_recent_images"],
         max_tokens=16384,
-        omniparser_url=args.omniparser_server_url
+        omniparser_url=args.omniparser_server_url,
+        omniparser_transport=args.omniparser_transport
     ):  
         if loop_msg is None or state.get("stop"):
             yield state['chatbot_messages']
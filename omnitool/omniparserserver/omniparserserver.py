@@ -5,13 +5,30 @@ python -m omniparserserver --som_model_path ../../weights/icon_detect/model.pt -
 import sys
 import os
 import time
-from fastapi import FastAPI
+import threading
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from pydantic import BaseModel
+from typing import List, Optional
 import argparse
+import requests
 import uvicorn
 root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(root_dir)
 from util.omniparser import Omniparser
+from util.frame import Frame
+from util.caption_budget import CaptionBudget
+from util.parse_store import ParseStore, StoredParse
+from util.parse_presets import PRESETS
+from util.regions import WindowNotFoundError, window_region
+from util.ui_tree import build_ui_tree, subtree, tree_screen_info
+from util.element_index import ElementIndex, TEXT_MATCHES
+from util.parse_diff import diff_parses
+from util.ocr_engine import OCR_MODES, normalize_languages
+from util.metrics import MetricsRegistry, process_rss_bytes
+from util.model_cache import DEFAULT_CACHE_DIR, LOAD_STATS
+from util.profiling import PSTATS_SORT_KEYS, ProfileStore, profile_call
+from util.shm_transport import FrameRingReader, StaleFrameError
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Omniparser API')
@@ -22,30 +39,436 @@ def parse_arguments():
     parser.add_argument('--BOX_TRESHOLD', type=float, default=0.05, help='Threshold for box detection')
     parser.add_argument('--host', type=str, default='127.0.0.1', help='Host for the API')
     parser.add_argument('--port', type=int, default=8000, help='Port for the API')
+    parser.add_argument('--weight_cache_dir', type=str, default=DEFAULT_CACHE_DIR, help='Memory-mapped weight cache shared by all processes on the host, empty to disable')
+    parser.add_argument('--workers', type=int, default=1, help='Number of server processes (disables auto-reload when > 1)')
+    parser.add_argument('--warmup_resolutions', type=str, default='1920x1080,1280x720', help='Comma separated WxH screens parsed at startup, empty to skip warmup')
+    parser.add_argument('--warmup_densities', type=str, default='0.3,0.9', help='Element densities of the warmup screens (varies caption batch sizes)')
+    parser.add_argument('--reuse_max_changed_blocks', type=int, default=0, help='Per-session result reuse: max changed 16px cells to still count a frame as unchanged')
+    parser.add_argument('--max_sessions', type=int, default=64, help='Sessions whose last parse is kept for reuse')
+    parser.add_argument('--disable_tracking', action='store_true', help='Do not track elements across the frames of a session (track_id and caption carry-over)')
+    parser.add_argument('--max_stored_parses', type=int, default=8, help='Recent parses (with their screenshots) kept for follow-up requests')
+    parser.add_argument('--preset', type=str, default=None, choices=['fast', 'balanced', 'accurate'], help='Parse preset for requests that name none (default: accurate)')
+    parser.add_argument('--detect_tile_min_side', type=int, default=0, help='Detect icons on overlapping tiles for frames whose longer side is at least this (e.g. 2560 for 4K and ultra-wide), 0 to always use one pass')
+    parser.add_argument('--detect_tile_size', type=int, default=1280, help='Tile side for tiled detection')
+    parser.add_argument('--caption_mode', type=str, default='crop', choices=['crop', 'roi'], help='crop: encode each icon crop; roi (experimental, florence2): pool icon features from one pass over the frame')
+    parser.add_argument('--roi_scale', type=float, default=2.0, help='Upscaling of the frame before the shared vision pass in roi caption mode')
+    parser.add_argument('--caption_batch_size', type=int, default=0, help='Icons per caption batch, 0 to adapt to free memory and batch latency')
+    parser.add_argument('--speculative_caption', action='store_true', help='Caption likely icons while OCR is still running (helps on CPU, where OCR is the slowest stage)')
+    parser.add_argument('--ocr_workers', type=int, default=0, help='OCR worker processes, each with its own reader (per server process), 0 to run OCR in the request thread')
+    parser.add_argument('--ocr_tiles', type=int, default=0, help='With --ocr_workers, split each frame into this many overlapping bands read in parallel, 0 for one job per frame')
+    parser.add_argument('--ocr_languages', type=str, default='en,ko', help='EasyOCR languages for requests that name none, e.g. en for English-only screens (faster)')
+    parser.add_argument('--ocr_mode', type=str, default='full', choices=['full', 'recognize'], help='full: EasyOCR readtext; recognize: skip its text detector and recognize cheap text line proposals (faster, compare with benchmarks/bench_ocr_modes.py first)')
+    parser.add_argument('--ocr_max_readers', type=int, default=2, help='EasyOCR readers (one per language set requested) kept loaded, least recently used dropped')
+    parser.add_argument('--icon_embedder', type=str, default='', help='Reuse captions of near-duplicate icons: pixel or encoder (caption model vision encoder), empty to disable')
+    parser.add_argument('--icon_index_max_distance', type=float, default=0.08, help='Max cosine distance to the nearest captioned icon for its caption to be reused')
+    parser.add_argument('--icon_index_path', type=str, default='', help='Load the icon index from / save it to this .npz file')
+    parser.add_argument('--windows_host_url', type=str, default='', help='VM server (e.g. http://localhost:5000) used to resolve window_title in parse requests, empty to disable')
+    parser.add_argument('--enable_shm', action='store_true', help='Accept frames from co-located clients through shared memory')
+    parser.add_argument('--shm_max_rings', type=int, default=8, help='Client frame rings kept mapped, least recently used are closed first')
+    parser.add_argument('--enable_profiling', action='store_true', help='Allow per-request profiling via profile=true')
+    parser.add_argument('--max_profiles', type=int, default=32, help='Number of recent profiles kept in memory')
     args = parser.parse_args()
     return args
 
 args = parse_arguments()
 config = vars(args)
+config['weight_cache_dir'] = args.weight_cache_dir or None
 
 app = FastAPI()
 omniparser = Omniparser(config)
+# the models are not thread safe; requests run in the threadpool and queue on this lock
+parse_lock = threading.Lock()
+# set once the warmup parses finished; /probe/ and /health/ready report 503 until then
+ready = threading.Event()
+warmup_state = {'status': 'pending', 'report': [], 'error': None}
+
+profile_store = ProfileStore(max_items=args.max_profiles)
+frame_rings = FrameRingReader(max_rings=args.shm_max_rings)
+parse_store = ParseStore(max_items=args.max_stored_parses)
+
+metrics = MetricsRegistry()
+requests_total = metrics.counter('omniparser_requests_total', 'Parse requests by outcome', ['status'])
+request_latency = metrics.histogram('omniparser_request_latency_seconds', 'End-to-end parse request latency')
+queue_latency = metrics.histogram('omniparser_queue_latency_seconds', 'Time a request waited for the parser')
+speculative_captions = metrics.counter('omniparser_speculative_captions_total', 'Icons captioned while OCR ran, by whether filtering kept them', ['result'])
+stage_latency = metrics.histogram('omniparser_stage_latency_seconds', 'Per-stage parse latency', ['stage'])
+elements_per_frame = metrics.histogram('omniparser_elements_per_frame', 'Parsed elements per frame', ['type'], buckets=(0, 10, 25, 50, 100, 200, 400, 800))
+cache_requests = metrics.counter('omniparser_cache_requests_total', 'Cache lookups by cache and result', ['cache', 'result'])
+in_flight = metrics.gauge('omniparser_requests_in_flight', 'Parse requests currently queued or running')
+metrics.gauge('omniparser_process_resident_memory_bytes', 'Resident set size of the server process', fn=process_rss_bytes)
+model_load_seconds = metrics.gauge('omniparser_model_load_seconds', 'Time spent loading each model at startup', ['model', 'source'])
+for model_name, load_stats in LOAD_STATS.items():
+    model_load_seconds.set(load_stats['seconds'], model=model_name, source=load_stats['source'])
+caption_batch_size = metrics.histogram('omniparser_caption_batch_size', 'Icons per caption model batch', buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+caption_oom_retries = metrics.counter('omniparser_caption_oom_retries_total', 'Caption batches retried smaller after running out of memory')
+ocr_jobs = metrics.counter('omniparser_ocr_jobs_total', 'OCR jobs run by the worker pool')
+ocr_busy_seconds = metrics.counter('omniparser_ocr_busy_seconds_total', 'Time OCR workers spent on jobs')
+if omniparser.ocr_pool is not None:
+    metrics.gauge('omniparser_ocr_workers', 'OCR worker processes', fn=lambda: omniparser.ocr_pool.workers)
+    metrics.gauge('omniparser_ocr_utilization', 'Share of OCR worker time spent on jobs over the last minute', fn=lambda: omniparser.ocr_pool.utilization())
+    metrics.gauge('omniparser_ocr_jobs_in_flight', 'OCR jobs submitted and not yet collected', fn=lambda: omniparser.ocr_pool.in_flight)
+ocr_language_parses = metrics.counter('omniparser_ocr_language_parses_total', 'Parses by EasyOCR language set read', ['languages'])
+ocr_language_fallbacks = metrics.counter('omniparser_ocr_language_fallbacks_total', 'Parses whose requested OCR languages could not be loaded and fell back to the default')
+metrics.gauge('omniparser_ocr_readers', 'EasyOCR readers loaded in the server process', fn=lambda: len(omniparser.reader_pool))
+degradations_total = metrics.counter('omniparser_parse_degradations_total', 'Cheaper settings applied to meet request deadlines, by setting', ['setting'])
+deadline_misses = metrics.counter('omniparser_deadline_misses_total', 'Requests with a deadline that took longer')
+tracked_elements = metrics.counter('omniparser_tracked_elements_total', 'Elements of session parses by tracking result', ['result'])
+diff_elements = metrics.counter('omniparser_diff_elements_total', 'Elements reported by /parse/diff/, by kind of change', ['kind'])
+queries_total = metrics.counter('omniparser_queries_total', 'Element queries on stored parses, by kind', ['kind'])
+metrics.gauge('omniparser_ready', 'Whether warmup finished and the replica accepts traffic', fn=lambda: float(ready.is_set()))
+
+def run_warmup():
+    resolutions = [tuple(int(v) for v in r.split('x')) for r in args.warmup_resolutions.split(',') if r.strip()]
+    densities = [float(d) for d in args.warmup_densities.split(',') if d.strip()]
+    if not resolutions:
+        warmup_state['status'] = 'skipped'
+        ready.set()
+        return
+    warmup_state['status'] = 'running'
+    start = time.time()
+    try:
+        with parse_lock:
+            warmup_state['report'] = omniparser.warmup(resolutions=resolutions, densities=densities)
+    except Exception as e:
+        # stay unready: a parser that cannot parse a synthetic screen should not receive traffic
+        warmup_state['status'] = 'failed'
+        warmup_state['error'] = repr(e)
+        print('warmup failed:', repr(e))
+        return
+    warmup_state['status'] = 'done'
+    print('warmup time:', time.time() - start)
+    ready.set()
+
+@app.on_event("startup")
+def start_warmup():
+    threading.Thread(target=run_warmup, name='omniparser-warmup', daemon=True).start()
+
+@app.on_event("shutdown")
+def shutdown_parser():
+    with parse_lock:
+        omniparser.save_icon_index()
+        omniparser.close()
+
+class ShmFrame(BaseModel):
+    name: str
+    slot: int
+    seq: int
 
 class ParseRequest(BaseModel):
-    base64_image: str
+    base64_image: Optional[str] = None
+    shm_frame: Optional[ShmFrame] = None
+    session_id: Optional[str] = None
+    reuse_max_changed_blocks: Optional[int] = None
+    max_captions: Optional[int] = None
+    caption_time_budget_ms: Optional[float] = None
+    focus_points: Optional[List[List[float]]] = None
+    preset: Optional[str] = None
+    deadline_ms: Optional[float] = None
+    regions: Optional[List[List[float]]] = None
+    window_title: Optional[str] = None
+    ui_tree: bool = False
+    ocr_languages: Optional[List[str]] = None
+    ocr_mode: Optional[str] = None
+    profile: bool = False
+    torch_profile: bool = False
 
-@app.post("/parse/")
-async def parse(parse_request: ParseRequest):
-    print('start parsing...')
+def run_parse(parse_request: ParseRequest, stats: dict, queued_seconds: float = 0.0):
     start = time.time()
-    dino_labled_img, parsed_content_list = omniparser.parse(parse_request.base64_image)
+    if parse_request.shm_frame is None:
+        image = Omniparser.decode_image(parse_request.base64_image)
+    else:
+        ref = parse_request.shm_frame
+        try:
+            ring = frame_rings.get(ref.name)
+            # copy once out of the shared slot; check afterwards that the client did not overwrite it meanwhile
+            image = Frame.from_array(ring.read(ref.slot, ref.seq), copy=True)
+            ring.check(ref.slot, ref.seq)
+        except StaleFrameError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except (OSError, ValueError) as e:
+            frame_rings.drop(ref.name)
+            raise HTTPException(status_code=400, detail=f'Cannot read shared memory frame: {e}')
+    caption_budget = None
+    if parse_request.max_captions is not None or parse_request.caption_time_budget_ms is not None or parse_request.focus_points:
+        caption_budget = CaptionBudget(max_captions=parse_request.max_captions, time_budget_ms=parse_request.caption_time_budget_ms, focus_points=[tuple(p) for p in parse_request.focus_points or []])
+    # the deadline counts from arrival, time spent queueing is gone
+    deadline_ms = parse_request.deadline_ms - queued_seconds * 1000 if parse_request.deadline_ms is not None else None
+    regions = list(parse_request.regions or [])
+    if parse_request.window_title:
+        try:
+            regions.append(window_region(args.windows_host_url, parse_request.window_title, image.size))
+        except WindowNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except requests.RequestException as e:
+            raise HTTPException(status_code=502, detail=f'Cannot list windows on {args.windows_host_url}: {e}')
+    try:
+        dino_labled_img, parsed_content_list = omniparser.parse_image(image, stats=stats, timings={'decode': time.time() - start}, session_id=parse_request.session_id, reuse_max_changed_blocks=parse_request.reuse_max_changed_blocks, caption_budget=caption_budget, preset=parse_request.preset, deadline_ms=deadline_ms, regions=regions or None, ui_tree=parse_request.ui_tree, ocr_languages=parse_request.ocr_languages, ocr_mode=parse_request.ocr_mode)
+    except ValueError as e:
+        if not regions:
+            raise
+        raise HTTPException(status_code=400, detail=str(e))
+    parse_id = parse_store.add(StoredParse(image, parsed_content_list, dino_labled_img, session_id=parse_request.session_id, ui_tree=stats.get('ui_tree')))
+    return dino_labled_img, parsed_content_list, parse_id
+
+def handle_parse(parse_request: ParseRequest):
+    print('start parsing...')
+    if (parse_request.profile or parse_request.torch_profile) and not args.enable_profiling:
+        raise HTTPException(status_code=403, detail='Profiling is disabled, start the server with --enable_profiling')
+    if parse_request.shm_frame is not None and not args.enable_shm:
+        raise HTTPException(status_code=403, detail='Shared memory transport is disabled, start the server with --enable_shm')
+    if parse_request.shm_frame is None and parse_request.base64_image is None:
+        raise HTTPException(status_code=400, detail='Either base64_image or shm_frame is required')
+    if parse_request.window_title and not args.windows_host_url:
+        raise HTTPException(status_code=400, detail='window_title needs the server to be started with --windows_host_url')
+    if parse_request.regions is not None and any(len(region) != 4 for region in parse_request.regions):
+        raise HTTPException(status_code=400, detail='regions are [x1, y1, x2, y2] ratio rectangles')
+    if parse_request.ocr_mode is not None and parse_request.ocr_mode not in OCR_MODES:
+        raise HTTPException(status_code=400, detail=f'Unknown ocr_mode {parse_request.ocr_mode}, expected one of {list(OCR_MODES)}')
+    if parse_request.preset is not None and parse_request.preset not in PRESETS:
+        raise HTTPException(status_code=400, detail=f'Unknown preset {parse_request.preset}, expected one of {sorted(PRESETS)}')
+    arrived = time.time()
+    in_flight.inc()
+    stats = {}
+    try:
+        with parse_lock:
+            start = time.time()
+            queue_latency.observe(start - arrived)
+            if parse_request.profile or parse_request.torch_profile:
+                (dino_labled_img, parsed_content_list, parse_id), profile = profile_call(run_parse, parse_request, stats, start - arrived, use_torch=parse_request.torch_profile)
+                profile_id = profile_store.add(profile)
+            else:
+                dino_labled_img, parsed_content_list, parse_id = run_parse(parse_request, stats, start - arrived)
+                profile_id = None
+    except Exception:
+        requests_total.inc(status='error')
+        raise
+    finally:
+        in_flight.dec()
     latency = time.time() - start
     print('time:', latency)
-    return {"som_image_base64": dino_labled_img, "parsed_content_list": parsed_content_list, 'latency': latency}
+    requests_total.inc(status='ok')
+    request_latency.observe(time.time() - arrived)
+    for stage, seconds in stats['timings'].items():
+        stage_latency.observe(seconds, stage=stage)
+    elements_per_frame.observe(stats['num_text'], type='text')
+    elements_per_frame.observe(stats['num_icon'], type='icon')
+    if 'reused' in stats:
+        cache_requests.inc(cache='frame', result='hit' if stats['reused'] else 'miss')
+    caption_stats = stats.get('caption') or {}
+    for size in caption_stats.get('batch_sizes', []):
+        caption_batch_size.observe(size)
+    caption_oom_retries.inc(caption_stats.get('oom_retries', 0))
+    if 'captioned' in caption_stats:
+        cache_requests.inc(caption_stats['cached'], cache='caption', result='hit')
+        cache_requests.inc(caption_stats['nearest'] + caption_stats['captioned'] + caption_stats['pending'], cache='caption', result='miss')
+        if omniparser.icon_index is not None:
+            cache_requests.inc(caption_stats['nearest'], cache='icon_index', result='hit')
+            cache_requests.inc(caption_stats['captioned'] + caption_stats['pending'], cache='icon_index', result='miss')
+    response = {"som_image_base64": dino_labled_img, "parsed_content_list": parsed_content_list, 'latency': latency, 'reused': stats.get('reused', False), 'parse_id': parse_id}
+    if caption_stats:
+        response['caption_stats'] = caption_stats
+    if 'ocr_pool' in stats:
+        ocr_jobs.inc(stats['ocr_pool']['jobs'])
+        ocr_busy_seconds.inc(stats['ocr_pool']['busy_seconds'])
+    if 'speculative' in stats:
+        speculative_captions.inc(stats['speculative']['used'], result='used')
+        speculative_captions.inc(stats['speculative']['discarded'], result='discarded')
+    if 'plan' in stats:
+        for degradation in stats['plan']['degradations']:
+            degradations_total.inc(setting=degradation.split('=')[0])
+        response['som_image_format'] = stats['plan']['overlay_format'].lower()
+        if parse_request.preset is not None or parse_request.deadline_ms is not None or args.preset is not None or parse_request.ocr_mode is not None:
+            response['plan'] = stats['plan']
+    if parse_request.deadline_ms is not None and (time.time() - arrived) * 1000 > parse_request.deadline_ms:
+        deadline_misses.inc()
+    if 'regions' in stats:
+        response['regions'] = stats['regions']
+    if 'ui_tree' in stats:
+        response['ui_tree'] = stats['ui_tree']
+    if 'ocr_languages' in stats:
+        ocr_language_parses.inc(languages=','.join(stats['ocr_languages']))
+        if parse_request.ocr_languages and tuple(stats['ocr_languages']) != normalize_languages(parse_request.ocr_languages):
+            ocr_language_fallbacks.inc()
+        response['ocr_languages'] = stats['ocr_languages']
+    if 'tracking' in stats:
+        for result in ('matched', 'new', 'carried'):
+            tracked_elements.inc(stats['tracking'][result], result=result)
+        response['tracking'] = stats['tracking']
+    if profile_id is not None:
+        response['profile_id'] = profile_id
+    return response
+
+@app.post("/parse/")
+def parse(parse_request: ParseRequest):
+    return handle_parse(parse_request)
+
+class ParseDiffRequest(ParseRequest):
+    previous_parse_id: str
+    include_elements: bool = False
+
+@app.post("/parse/diff/")
+def parse_diff(parse_request: ParseDiffRequest):
+    '''Parse, then return the changes against a stored earlier parse instead of the full element list.'''
+    previous = parse_store.get(parse_request.previous_parse_id)
+    if previous is None:
+        raise HTTPException(status_code=404, detail=f'Unknown or expired parse id {parse_request.previous_parse_id}')
+    response = handle_parse(parse_request)
+    start = time.time()
+    current = response['parsed_content_list'] if parse_request.include_elements else response.pop('parsed_content_list')
+    if previous.element_index is None:
+        previous.element_index = ElementIndex(previous.parsed_content_list)
+    # track ids are per session; otherwise pair by overlap and content
+    by_track_id = (parse_request.session_id is not None and previous.session_id == parse_request.session_id
+                   and all('track_id' in elem for elem in current) and all('track_id' in elem for elem in previous.parsed_content_list))
+    diff = diff_parses(previous.parsed_content_list, current, previous_index=previous.element_index, by_track_id=by_track_id)
+    for kind in ('added', 'removed', 'moved', 'changed'):
+        diff_elements.inc(len(diff[kind]), kind=kind)
+    response['diff'] = diff
+    response['previous_parse_id'] = previous.parse_id
+    response['diff_latency'] = time.time() - start
+    return response
+
+class CaptionRequest(BaseModel):
+    parse_id: str
+    element_ids: Optional[List[int]] = None
+
+@app.post("/caption/")
+def caption(caption_request: CaptionRequest):
+    stored = parse_store.get(caption_request.parse_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail=f'Unknown or expired parse id {caption_request.parse_id}')
+    start = time.time()
+    with parse_lock:
+        updated = omniparser.caption_pending(stored.image, stored.parsed_content_list, caption_request.element_ids)
+    if updated:
+        # the text index holds the old placeholders
+        stored.element_index = None
+    pending = sum(1 for elem in stored.parsed_content_list if elem.get('caption_pending'))
+    return {"parse_id": stored.parse_id, "updated": {i: stored.parsed_content_list[i] for i in updated}, "pending": pending, "latency": time.time() - start}
+
+class TreeRequest(BaseModel):
+    parse_id: str
+    element_id: Optional[int] = None
+    max_depth: Optional[int] = None
+
+@app.post("/tree/")
+def tree(tree_request: TreeRequest):
+    stored = parse_store.get(tree_request.parse_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail=f'Unknown or expired parse id {tree_request.parse_id}')
+    if stored.ui_tree is None:
+        stored.ui_tree = build_ui_tree(stored.parsed_content_list)
+    element_id = tree_request.element_id
+    if element_id is not None and not 0 <= element_id < len(stored.parsed_content_list):
+        raise HTTPException(status_code=404, detail=f'No element {element_id} in parse {stored.parse_id}')
+    ids = subtree(stored.ui_tree, element_id) if element_id is not None else list(range(len(stored.parsed_content_list)))
+    return {
+        "parse_id": stored.parse_id,
+        "element_ids": ids,
+        "elements": {i: stored.parsed_content_list[i] for i in ids},
+        "parent": {i: stored.ui_tree['parent'][i] for i in ids},
+        "screen_info": tree_screen_info(stored.parsed_content_list, stored.ui_tree, root=element_id, max_depth=tree_request.max_depth),
+    }
+
+class QueryRequest(BaseModel):
+    parse_id: str
+    text: Optional[str] = None
+    match: str = 'fuzzy'
+    point: Optional[List[float]] = None
+    k: Optional[int] = None
+    region: Optional[List[float]] = None
+    inside: bool = False
+    limit: Optional[int] = None
+
+@app.post("/query/")
+def query(query_request: QueryRequest):
+    '''Exactly one of text (with match), point (hit test, or the k nearest with k) and region (with inside).'''
+    if sum(q is not None for q in (query_request.text, query_request.point, query_request.region)) != 1:
+        raise HTTPException(status_code=400, detail='Give exactly one of text, point and region')
+    if query_request.match not in TEXT_MATCHES:
+        raise HTTPException(status_code=400, detail=f'Unknown match {query_request.match}, expected one of {list(TEXT_MATCHES)}')
+    if query_request.point is not None and len(query_request.point) != 2:
+        raise HTTPException(status_code=400, detail='point is [x, y] in ratios')
+    if query_request.region is not None and len(query_request.region) != 4:
+        raise HTTPException(status_code=400, detail='region is [x1, y1, x2, y2] in ratios')
+    stored = parse_store.get(query_request.parse_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail=f'Unknown or expired parse id {query_request.parse_id}')
+    index = stored.element_index
+    if index is None:
+        index = stored.element_index = ElementIndex(stored.parsed_content_list)
+    start = time.perf_counter()
+    distances = None
+    if query_request.text is not None:
+        kind = query_request.match
+        ids = index.find_text(query_request.text, match=query_request.match, limit=query_request.limit)
+    elif query_request.region is not None:
+        kind = 'region'
+        ids = index.in_region(query_request.region, inside=query_request.inside)[:query_request.limit]
+    elif query_request.k is not None:
+        kind = 'nearest'
+        nearest = index.nearest(*query_request.point, k=query_request.k)
+        ids, distances = [i for i, _ in nearest], [d for _, d in nearest]
+    else:
+        kind = 'point'
+        ids = index.at_point(*query_request.point)[:query_request.limit]
+    latency = time.perf_counter() - start
+    queries_total.inc(kind=kind)
+    response = {"parse_id": stored.parse_id, "element_ids": ids, "elements": [stored.parsed_content_list[i] for i in ids], "latency_us": latency * 1e6}
+    if distances is not None:
+        response['distances'] = distances
+    return response
+
+@app.get("/transport/")
+async def transport():
+    return {"shm": args.enable_shm}
 
 @app.get("/probe/")
 async def root():
+    if not ready.is_set():
+        return JSONResponse(status_code=503, content={"message": f"Omniparser API warming up ({warmup_state['status']})"})
     return {"message": "Omniparser API ready"}
 
+@app.get("/health/live")
+async def liveness():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    content = {"ready": ready.is_set(), "warmup": warmup_state}
+    return JSONResponse(status_code=200 if ready.is_set() else 503, content=content)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+@app.get("/profiles/")
+async def list_profiles():
+    return {"profiles": profile_store.list()}
+
+@app.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = 'pstats', sort: str = 'cumulative', limit: int = 80):
+    '''format: pstats (text), raw (binary pstats dump), collapsed (sampled stacks), torch (operator table), torch_collapsed'''
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f'Unknown profile id {profile_id}')
+    if format == 'pstats':
+        if sort not in PSTATS_SORT_KEYS:
+            raise HTTPException(status_code=400, detail=f'Unknown sort {sort}, expected one of {list(PSTATS_SORT_KEYS)}')
+        return PlainTextResponse(profile.pstats_text(sort=sort, limit=limit))
+    if format == 'raw':
+        return Response(profile.pstats_raw(), media_type='application/octet-stream', headers={'Content-Disposition': f'attachment; filename="{profile_id}.pstats"'})
+    if format == 'collapsed':
+        return PlainTextResponse(profile.collapsed_text())
+    if format in ('torch', 'torch_collapsed'):
+        if profile.torch_table is None:
+            raise HTTPException(status_code=404, detail='Profile was recorded without torch_profile=true')
+        return PlainTextResponse(profile.torch_table if format == 'torch' else profile.torch_stacks)
+    raise HTTPException(status_code=400, detail=f'Unknown format {format}')
+
 if __name__ == "__main__":
-    uvicorn.run("omniparserserver:app", host=args.host, port=args.port, reload=True)
\ No newline at end of file
+    if args.workers > 1:
+        # each worker maps the same weight cache file, so the weights are resident once
+        uvicorn.run("omniparserserver:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run("omniparserserver:app", host=args.host, port=args.port, reload=True)
@@ -0,0 +1,141 @@
+"""
+Adaptive caption batch size.
+
+`AdaptiveBatchSizer` picks how many icon crops go through the caption model at
+once. The size is capped by the memory the device has free divided by the
+measured (CUDA) or assumed (CPU/MPS) bytes per item, grows while batches finish
+well under `target_seconds` and shrinks when they take longer. An out-of-memory
+error halves the size, lowers the memory cap and retries the same items, so a
+request degrades to smaller batches instead of failing. `run_batched` applies
+it to any per-batch function.
+"""
+import gc
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import torch
+
+
+def available_memory_bytes(device: torch.device) -> Optional[int]:
+    """Free memory on `device`: CUDA free memory, otherwise MemAvailable of the host (None if unknown)."""
+    if device.type == 'cuda':
+        free, _ = torch.cuda.mem_get_info(device)
+        return free
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def is_oom_error(e: BaseException) -> bool:
+    if isinstance(e, MemoryError):
+        return True
+    oom_type = getattr(torch.cuda, 'OutOfMemoryError', None)
+    if oom_type is not None and isinstance(e, oom_type):
+        return True
+    return isinstance(e, RuntimeError) and 'out of memory' in str(e).lower()
+
+
+class AdaptiveBatchSizer(object):
+    def __init__(self, start: int = 32, min_size: int = 1, max_size: int = 256, target_seconds: float = 2.0, bytes_per_item: float = 48 * 2 ** 20, memory_fraction: Optional[float] = 0.5):
+        """
+        start: size of the first batch (before anything was measured).
+        target_seconds: batches should take about this long; it keeps caption budgets responsive
+            and bounds the time one request holds the model.
+        bytes_per_item: initial estimate of the activation memory one item needs; replaced by
+            measurements on CUDA.
+        memory_fraction: share of the currently free memory a batch may use; None for no memory cap.
+        """
+        self.size = start
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.bytes_per_item = bytes_per_item
+        self.memory_fraction = memory_fraction
+        self.oom_ceiling = max_size
+        self.ooms = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def fixed(cls, size: int) -> 'AdaptiveBatchSizer':
+        """Always `size` (the caller's explicit choice), only backing off after an OOM."""
+        return cls(start=size, max_size=size, target_seconds=float('inf'), memory_fraction=None)
+
+    def memory_limit(self, device: torch.device) -> int:
+        free = available_memory_bytes(device) if self.memory_fraction is not None else None
+        if free is None:
+            return self.max_size
+        return max(self.min_size, int(free * self.memory_fraction / self.bytes_per_item))
+
+    def next_size(self, device: torch.device, remaining: int) -> int:
+        with self._lock:
+            size = min(self.size, self.oom_ceiling, self.max_size)
+        return max(self.min_size, min(size, self.memory_limit(device), remaining))
+
+    def observe(self, items: int, seconds: float, peak_bytes: Optional[int] = None):
+        with self._lock:
+            if peak_bytes:
+                self.bytes_per_item += 0.3 * (peak_bytes / items - self.bytes_per_item)
+            if items < self.size:
+                # a short final batch says little about the full size
+                return
+            if seconds < self.target_seconds / 2 and self.size < min(self.max_size, self.oom_ceiling):
+                self.size = min(self.size * 2, self.max_size, self.oom_ceiling)
+            elif seconds > self.target_seconds and self.size > self.min_size:
+                self.size = max(self.size // 2, self.min_size)
+
+    def record_oom(self, items: int):
+        with self._lock:
+            self.ooms += 1
+            self.oom_ceiling = max(self.min_size, items // 2)
+            self.size = min(self.size, self.oom_ceiling)
+
+
+def run_batched(items: Sequence, run_batch: Callable[[Sequence], List], sizer: AdaptiveBatchSizer, device: torch.device, batch_stats: Optional[Dict] = None) -> List:
+    """
+    Apply `run_batch` to consecutive batches of `items` sized by `sizer` and concatenate the results.
+    `batch_stats`, if given, gets the sizes used ('batch_sizes') and the number of OOM retries ('oom_retries').
+    """
+    results = []
+    sizes, oom_retries = [], 0
+    i = 0
+    while i < len(items):
+        n = sizer.next_size(device, len(items) - i)
+        batch = items[i:i + n]
+        if device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(device)
+            baseline = torch.cuda.memory_allocated(device)
+        start = time.time()
+        try:
+            batch_results = run_batch(batch)
+        except Exception as e:
+            if not is_oom_error(e) or len(batch) <= sizer.min_size:
+                raise
+            batch_results = None
+        if batch_results is None:
+            # outside the except block, so the traceback no longer pins the failed batch's tensors
+            print(f'caption batch of {len(batch)} ran out of memory, retrying smaller')
+            gc.collect()
+            if device.type == 'cuda':
+                torch.cuda.empty_cache()
+            sizer.record_oom(len(batch))
+            oom_retries += 1
+            continue
+        peak = torch.cuda.max_memory_allocated(device) - baseline if device.type == 'cuda' else None
+        sizer.observe(len(batch), time.time() - start, peak)
+        results.extend(batch_results)
+        sizes.append(len(batch))
+        i += len(batch)
+    if batch_stats is not None:
+        batch_stats.setdefault('batch_sizes', []).extend(sizes)
+        batch_stats['oom_retries'] = batch_stats.get('oom_retries', 0) + oom_retries
+    return results
@@ -0,0 +1,83 @@
+"""
+Tensor box operations for overlap filtering.
+
+Pairwise versions of the rules in `remove_overlap` / `remove_overlap_new`
+(util/utils.py), computed on (N, 4) xyxy tensors instead of per-pair Python
+loops. Comparisons use float64, the precision the list-based versions computed
+in, so both keep the same boxes. benchmarks/check_box_ops.py compares them
+against the list-based originals.
+"""
+from typing import List, Optional, Sequence, Tuple
+
+import torch
+
+
+def box_area(boxes: torch.Tensor) -> torch.Tensor:
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+
+def intersection_area(boxes1: torch.Tensor, boxes2: torch.Tensor) -> torch.Tensor:
+    """(N, M) intersection areas."""
+    lt = torch.max(boxes1[:, None, :2], boxes2[None, :, :2])
+    rb = torch.min(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    wh = (rb - lt).clamp(min=0)
+    return wh[..., 0] * wh[..., 1]
+
+
+def overlap_matrix(boxes1: torch.Tensor, boxes2: torch.Tensor, inter: Optional[torch.Tensor] = None) -> torch.Tensor:
+    """
+    (N, M) max of IoU and the intersection as a share of either box, the `IoU` of the list-based
+    filters. The shares count as 0 when either box has no area.
+    """
+    if inter is None:
+        inter = intersection_area(boxes1, boxes2)
+    area1, area2 = box_area(boxes1)[:, None], box_area(boxes2)[None, :]
+    iou = inter / (area1 + area2 - inter + 1e-6)
+    both = (area1 > 0) & (area2 > 0)
+    ratio = torch.where(both, torch.max(inter / area1, inter / area2), torch.zeros_like(inter))
+    return torch.max(iou, ratio)
+
+
+def suppress_larger(boxes: torch.Tensor, iou_threshold: float) -> torch.Tensor:
+    """Keep mask: a box is dropped if it overlaps a smaller box by more than `iou_threshold`."""
+    area = box_area(boxes)
+    larger = area[:, None] > area[None, :]
+    return ~((overlap_matrix(boxes, boxes) > iou_threshold) & larger).any(dim=1)
+
+
+def int_box_area(boxes: torch.Tensor, w: int, h: int) -> torch.Tensor:
+    """Areas of ratio boxes after truncating their corners to whole pixels."""
+    pixels = (boxes * torch.tensor([w, h, w, h], dtype=boxes.dtype, device=boxes.device)).trunc()
+    return box_area(pixels)
+
+
+def merge_ocr_into_icons(icon_boxes: torch.Tensor, iou_threshold: float, ocr_boxes: torch.Tensor, ocr_contents: Sequence[Optional[str]]) -> Tuple[torch.Tensor, List[Optional[str]], torch.Tensor]:
+    """
+    Tensor form of `remove_overlap_new` with OCR boxes. Icons that survive `suppress_larger` scan the
+    OCR boxes in order. An OCR box more than 80% inside the icon is absorbed: its text is appended to
+    the icon's label and the OCR box is removed. The scan stops at the first OCR box the icon is
+    more than 80% inside, and that icon is dropped.
+    Returns (indices of kept icons, their labels or None, keep mask over OCR boxes).
+    """
+    icon_idx = suppress_larger(icon_boxes, iou_threshold).nonzero().flatten()
+    n_ocr = len(ocr_boxes)
+    if n_ocr == 0:
+        return icon_idx, [None] * len(icon_idx), torch.ones(0, dtype=torch.bool, device=icon_boxes.device)
+    icons = icon_boxes[icon_idx]
+    inter = intersection_area(icons, ocr_boxes)
+    ocr_in_icon = inter / box_area(ocr_boxes)[None, :] > 0.8
+    icon_in_ocr = inter / box_area(icons)[:, None] > 0.8
+    stops = icon_in_ocr & ~ocr_in_icon
+    has_stop = stops.any(dim=1)
+    first_stop = torch.where(has_stop, stops.int().argmax(dim=1), torch.full_like(has_stop, n_ocr, dtype=torch.long))
+    scanned = torch.arange(n_ocr, device=icons.device)[None, :] < first_stop[:, None]
+    has_content = torch.tensor([content is not None for content in ocr_contents], dtype=torch.bool, device=icons.device)
+    absorbed = ocr_in_icon & scanned & has_content[None, :]
+
+    ocr_keep = ~absorbed.any(dim=0)
+    kept = ~has_stop
+    labels = []
+    for row in absorbed[kept]:
+        hits = row.nonzero().flatten().tolist()
+        labels.append(''.join(ocr_contents[k] + ' ' for k in hits) if hits else None)
+    return icon_idx[kept], labels, ocr_keep
@@ -0,0 +1,109 @@
+"""
+Caption budgeting: which icons get captioned when not all of them can be.
+
+Icons whose 64x64 crop was captioned before are served from `CaptionCache`
+for free. The rest are ranked by `rank_icons` (bigger, interactive, close to
+the caller's recent actions first) and captioned in that order until the
+request's `CaptionBudget` (count and/or milliseconds) runs out. Leftovers get
+CAPTION_PLACEHOLDER and 'caption_pending': True so a follow-up call can fill
+them in.
+"""
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+CAPTION_PLACEHOLDER = 'unlabeled icon'
+
+
+class CaptionBudget(object):
+    def __init__(self, max_captions: Optional[int] = None, time_budget_ms: Optional[float] = None, focus_points: Optional[Sequence[Tuple[float, float]]] = None):
+        """
+        max_captions: caption at most this many icons (cache hits are free).
+        time_budget_ms: stop starting new caption batches once this much time has been spent.
+        focus_points: recent action locations as (x, y) ratios; icons near them are captioned first.
+        """
+        self.max_captions = max_captions
+        self.time_budget_ms = time_budget_ms
+        self.focus_points = list(focus_points or [])
+
+    @property
+    def unlimited(self) -> bool:
+        return self.max_captions is None and self.time_budget_ms is None
+
+
+class CaptionCostModel(object):
+    """Running estimate of seconds per captioned icon, used to size batches under a time budget."""
+
+    def __init__(self, smoothing: float = 0.3):
+        self.smoothing = smoothing
+        self.seconds_per_item: Optional[float] = None
+
+    def observe(self, items: int, seconds: float):
+        if items <= 0:
+            return
+        cost = seconds / items
+        if self.seconds_per_item is None:
+            self.seconds_per_item = cost
+        else:
+            self.seconds_per_item += self.smoothing * (cost - self.seconds_per_item)
+
+    def items_within(self, seconds: float, upper: int) -> int:
+        if self.seconds_per_item is None:
+            # no estimate yet: a small first batch to calibrate
+            return min(upper, 8)
+        return max(1, min(upper, int(seconds / self.seconds_per_item)))
+
+
+class CaptionCache(object):
+    """LRU of caption by digest of the resized icon crop."""
+
+    def __init__(self, max_items: int = 4096):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(crop: np.ndarray) -> bytes:
+        return hashlib.blake2b(np.ascontiguousarray(crop).tobytes(), digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[str]:
+        with self._lock:
+            caption = self._items.get(key)
+            if caption is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return caption
+
+    def put(self, key: bytes, caption: str):
+        with self._lock:
+            self._items[key] = caption
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+def rank_icons(elems: List[Dict], focus_points: Sequence[Tuple[float, float]] = ()) -> List[int]:
+    """
+    Indices of `elems` (ratio 'bbox' xyxy) from most to least worth captioning. Score terms:
+    log area (large controls are more often targets), interactivity, and proximity to the nearest
+    focus point (Gaussian with sigma of 15% of the screen).
+    """
+    scores = []
+    for elem in elems:
+        x1, y1, x2, y2 = elem['bbox']
+        area = max((x2 - x1) * (y2 - y1), 1e-8)
+        score = 0.15 * math.log(area) + (1.0 if elem.get('interactivity', True) else 0.0)
+        if focus_points:
+            cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+            nearest = min((cx - fx) ** 2 + (cy - fy) ** 2 for fx, fy in focus_points)
+            score += 3.0 * math.exp(-nearest / (2 * 0.15 ** 2))
+        scores.append(score)
+    return sorted(range(len(elems)), key=lambda i: -scores[i])
@@ -0,0 +1,149 @@
+"""
+Lookup indexes over the elements of one parse.
+
+`ElementIndex` is built once per stored parse and answers the lookups agents
+otherwise do by scanning `parsed_content_list`:
+    text     - exact content, token prefix or fuzzy token match, through an
+               inverted index from lowercased tokens to element ids
+    point    - elements whose box contains a point, smallest first
+    nearest  - the k elements closest to a point (distance to the box edge)
+    region   - elements intersecting, or inside, a rectangle
+Spatial lookups go through a uniform grid of about one element per cell.
+Coordinates are those of the boxes, ratios for server parses. Ids are indices
+into `parsed_content_list`.
+"""
+import bisect
+import difflib
+import math
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+TEXT_MATCHES = ('exact', 'prefix', 'fuzzy')
+_TOKEN = re.compile(r'\w+')
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return _TOKEN.findall(text.lower()) if text else []
+
+
+class ElementIndex(object):
+    def __init__(self, parsed_content_list: List[Dict]):
+        self.boxes = [elem['bbox'] for elem in parsed_content_list]
+        self.areas = [max(b[2] - b[0], 0.0) * max(b[3] - b[1], 0.0) for b in self.boxes]
+        self.contents = [(elem.get('content') or '').strip().lower() for elem in parsed_content_list]
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        self.by_content: Dict[str, List[int]] = defaultdict(list)
+        self.token_counts = []
+        for i, content in enumerate(self.contents):
+            tokens = dict.fromkeys(tokenize(content))
+            self.token_counts.append(max(len(tokens), 1))
+            for token in tokens:
+                self.postings[token].append(i)
+            if content:
+                self.by_content[content].append(i)
+        self.vocabulary = sorted(self.postings)
+
+        n = len(self.boxes)
+        self.cells = max(1, int(math.sqrt(n)))
+        if n:
+            self.x0 = min(b[0] for b in self.boxes)
+            self.y0 = min(b[1] for b in self.boxes)
+            self.span_x = max(max(b[2] for b in self.boxes) - self.x0, 1e-9)
+            self.span_y = max(max(b[3] for b in self.boxes) - self.y0, 1e-9)
+        else:
+            self.x0 = self.y0 = 0.0
+            self.span_x = self.span_y = 1.0
+        self.grid: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for i, box in enumerate(self.boxes):
+            (c0x, c0y), (c1x, c1y) = self._cell(box[0], box[1]), self._cell(box[2], box[3])
+            for cx in range(c0x, c1x + 1):
+                for cy in range(c0y, c1y + 1):
+                    self.grid[(cx, cy)].append(i)
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        cx = min(max(int((x - self.x0) / self.span_x * self.cells), 0), self.cells - 1)
+        cy = min(max(int((y - self.y0) / self.span_y * self.cells), 0), self.cells - 1)
+        return cx, cy
+
+    def find_text(self, query: str, match: str = 'fuzzy', limit: Optional[int] = None, cutoff: float = 0.75) -> List[int]:
+        """
+        exact: content equal to `query` (case-insensitive). prefix: every query token starts a token of
+        the content. fuzzy: every query token is close (difflib ratio >= cutoff) to a token of the content.
+        Results are ordered by how many content tokens the query covers, then by id.
+        """
+        if match not in TEXT_MATCHES:
+            raise ValueError(f'Unknown match {match}, expected one of {TEXT_MATCHES}')
+        if match == 'exact':
+            return self.by_content.get(query.strip().lower(), [])[:limit]
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        hits = None
+        for token in tokens:
+            if match == 'prefix':
+                start = bisect.bisect_left(self.vocabulary, token)
+                end = bisect.bisect_left(self.vocabulary, token + '\uffff')
+                matched = self.vocabulary[start:end]
+            else:
+                matched = difflib.get_close_matches(token, self.vocabulary, n=16, cutoff=cutoff)
+            ids = {i for t in matched for i in self.postings[t]}
+            hits = ids if hits is None else hits & ids
+            if not hits:
+                return []
+        ranked = sorted(hits, key=lambda i: (-len(tokens) / self.token_counts[i], i))
+        return ranked[:limit]
+
+    def at_point(self, x: float, y: float) -> List[int]:
+        """Elements whose box contains (x, y), smallest first (the first is the one a click there hits)."""
+        if not self.boxes:
+            return []
+        ids = [i for i in self.grid.get(self._cell(x, y), ())
+               if self.boxes[i][0] <= x <= self.boxes[i][2] and self.boxes[i][1] <= y <= self.boxes[i][3]]
+        return sorted(ids, key=lambda i: (self.areas[i], i))
+
+    def distance(self, i: int, x: float, y: float) -> float:
+        x1, y1, x2, y2 = self.boxes[i]
+        return math.hypot(max(x1 - x, 0.0, x - x2), max(y1 - y, 0.0, y - y2))
+
+    def nearest(self, x: float, y: float, k: int = 5) -> List[Tuple[int, float]]:
+        """(id, distance) of the k elements nearest to (x, y), searching grid rings outwards."""
+        if not self.boxes or k <= 0:
+            return []
+        cx, cy = self._cell(x, y)
+        cell_w, cell_h = self.span_x / self.cells, self.span_y / self.cells
+        found: Dict[int, float] = {}
+        for ring in range(self.cells + 1):
+            for gx in range(cx - ring, cx + ring + 1):
+                for gy in range(cy - ring, cy + ring + 1):
+                    if max(abs(gx - cx), abs(gy - cy)) != ring:
+                        continue
+                    for i in self.grid.get((gx, gy), ()):
+                        if i not in found:
+                            found[i] = self.distance(i, x, y)
+            # boxes not seen yet lie outside the searched rings, at least this far away
+            reach = ring * min(cell_w, cell_h)
+            best = sorted(found.items(), key=lambda item: (item[1], item[0]))[:k]
+            if len(best) == min(k, len(self.boxes)) and best[-1][1] <= reach:
+                return best
+        return sorted(found.items(), key=lambda item: (item[1], item[0]))[:k]
+
+    def in_region(self, region: Sequence[float], inside: bool = False) -> List[int]:
+        """Elements intersecting the xyxy `region` (or entirely inside it), in id order."""
+        if not self.boxes:
+            return []
+        rx1, ry1, rx2, ry2 = region
+        (c0x, c0y), (c1x, c1y) = self._cell(rx1, ry1), self._cell(rx2, ry2)
+        candidates = {i for gx in range(c0x, c1x + 1) for gy in range(c0y, c1y + 1) for i in self.grid.get((gx, gy), ())}
+        ids = []
+        for i in candidates:
+            x1, y1, x2, y2 = self.boxes[i]
+            if inside:
+                if rx1 <= x1 and ry1 <= y1 and x2 <= rx2 and y2 <= ry2:
+                    ids.append(i)
+            elif x1 < rx2 and rx1 < x2 and y1 < ry2 and ry1 < y2:
+                ids.append(i)
+        return sorted(ids)
@@ -0,0 +1,111 @@
+"""
+Stable element ids across the frames of a session.
+
+Box ids are positions in `parsed_content_list` and change whenever an element
+appears or disappears. `ElementTracker` matches the elements of a frame to those
+of the session's previous frame and gives matched elements the previous
+'track_id'. Candidates must have the same type and overlap (IoU >= min_iou).
+They are scored by IoU plus content similarity: difflib ratio for text, an 8x8
+gray thumbnail for icons. Pairs are assigned greedily by score; elements of
+one frame seldom overlap, so an element rarely has more than one candidate.
+
+A matched icon that has not moved (IoU >= carry_iou) and looks the same
+(thumbnail distance <= carry_max_distance) takes over the previous caption
+instead of being captioned again.
+"""
+import difflib
+import itertools
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+THUMB = 8
+
+
+def thumbnail(bbox, image: np.ndarray) -> Optional[np.ndarray]:
+    """8x8 gray thumbnail (floats in [0, 1]) of a ratio xyxy box, None for an empty crop."""
+    h, w = image.shape[:2]
+    x1, y1, x2, y2 = int(bbox[0] * w), int(bbox[1] * h), int(bbox[2] * w), int(bbox[3] * h)
+    crop = image[max(y1, 0):y2, max(x1, 0):x2]
+    if crop.size == 0:
+        return None
+    gray = cv2.cvtColor(np.ascontiguousarray(crop), cv2.COLOR_RGB2GRAY)
+    return cv2.resize(gray, (THUMB, THUMB), interpolation=cv2.INTER_AREA).astype(np.float32) / 255
+
+
+def iou_matrix(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    lt = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    rb = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(axis=2)
+    area1 = (boxes1[:, 2:] - boxes1[:, :2]).prod(axis=1)
+    area2 = (boxes2[:, 2:] - boxes2[:, :2]).prod(axis=1)
+    return inter / (area1[:, None] + area2[None, :] - inter + 1e-9)
+
+
+class ElementTracker(object):
+    def __init__(self, min_iou: float = 0.3, carry_iou: float = 0.7, carry_max_distance: float = 0.04, max_distance: float = 0.2):
+        """
+        min_iou: least overlap for two elements to be the same element.
+        carry_iou, carry_max_distance: an icon reuses the previous caption when it overlaps the matched
+            icon by this much and their thumbnails differ by at most this mean absolute gray level.
+        max_distance: icons whose thumbnails differ more than this are not matched at all.
+        """
+        self.min_iou = min_iou
+        self.carry_iou = carry_iou
+        self.carry_max_distance = carry_max_distance
+        self.max_distance = max_distance
+        self._ids = itertools.count()
+        # elements of the previous frame (the dicts themselves, so later caption updates are seen) and their thumbnails
+        self._previous: List[Dict] = []
+        self._thumbs: List[Optional[np.ndarray]] = []
+        self.last_stats: Dict = {}
+
+    def _similarity(self, prev: Dict, prev_thumb, elem: Dict, thumb) -> Optional[float]:
+        if elem['type'] == 'text':
+            return difflib.SequenceMatcher(None, prev['content'] or '', elem['content'] or '').ratio()
+        if prev_thumb is None or thumb is None:
+            return 0.0
+        distance = float(np.abs(prev_thumb - thumb).mean())
+        return None if distance > self.max_distance else 1.0 - distance
+
+    def update(self, elems: List[Dict], image: np.ndarray) -> Dict:
+        """
+        Set 'track_id' on every elem (ratio boxes, HxWx3 RGB `image`) and fill 'content' of uncaptioned
+        icons (content None) from their unchanged match. Returns counts of matched, new, ended and carried.
+        """
+        thumbs = [thumbnail(elem['bbox'], image) if elem['type'] == 'icon' else None for elem in elems]
+        pairs = []
+        if self._previous and elems:
+            ious = iou_matrix(np.array([p['bbox'] for p in self._previous], dtype=np.float64).reshape(-1, 4),
+                              np.array([e['bbox'] for e in elems], dtype=np.float64).reshape(-1, 4))
+            for i, j in zip(*np.nonzero(ious >= self.min_iou)):
+                prev, elem = self._previous[i], elems[j]
+                if prev['type'] != elem['type']:
+                    continue
+                similarity = self._similarity(prev, self._thumbs[i], elem, thumbs[j])
+                if similarity is not None:
+                    pairs.append((ious[i, j] + similarity, int(i), int(j)))
+        pairs.sort(key=lambda pair: -pair[0])
+
+        used_prev, matched, carried = set(), {}, 0
+        for _, i, j in pairs:
+            if i in used_prev or j in matched:
+                continue
+            used_prev.add(i)
+            matched[j] = i
+        for j, elem in enumerate(elems):
+            if j not in matched:
+                elem['track_id'] = next(self._ids)
+                continue
+            prev = self._previous[matched[j]]
+            elem['track_id'] = prev['track_id']
+            if (elem['type'] == 'icon' and elem['content'] is None and prev['content'] is not None and not prev.get('caption_pending')
+                    and ious[matched[j], j] >= self.carry_iou and thumbs[j] is not None and self._thumbs[matched[j]] is not None
+                    and float(np.abs(thumbs[j] - self._thumbs[matched[j]]).mean()) <= self.carry_max_distance):
+                elem['content'] = prev['content']
+                elem['source'] = prev.get('source', 'box_yolo_content_yolo')
+                carried += 1
+        self.last_stats = {'matched': len(matched), 'new': len(elems) - len(matched), 'ended': len(self._previous) - len(matched), 'carried': carried}
+        self._previous, self._thumbs = elems, thumbs
+        return self.last_stats
@@ -0,0 +1,74 @@
+"""
+A decoded screenshot shared by every parse stage.
+
+`Frame` holds a single contiguous, read-only HxWx3 uint8 RGB buffer. OCR,
+detection, cropping, captioning and annotation all take views of it instead of
+converting and copying a PIL image at each step; the only other full-frame
+buffer a parse allocates is the annotated copy.
+"""
+import base64
+import io
+from typing import Union
+
+import numpy as np
+from PIL import Image
+
+
+class Frame(object):
+    def __init__(self, array: np.ndarray):
+        if array.dtype != np.uint8 or array.ndim != 3 or array.shape[2] != 3:
+            raise ValueError(f'Expected an (H, W, 3) uint8 RGB array, got {array.shape} {array.dtype}')
+        # a view, so the caller's own array (returned as is when already contiguous) stays writeable
+        self.array = np.ascontiguousarray(array).view()
+        self.array.flags.writeable = False
+        self._image = None
+
+    @classmethod
+    def from_image(cls, image: Image.Image) -> 'Frame':
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return cls(np.asarray(image))
+
+    @classmethod
+    def from_bytes(cls, image_bytes: bytes) -> 'Frame':
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            return cls.from_image(image)
+
+    @classmethod
+    def from_base64(cls, image_base64: str) -> 'Frame':
+        return cls.from_bytes(base64.b64decode(image_base64))
+
+    @classmethod
+    def from_array(cls, array: np.ndarray, copy: bool = False) -> 'Frame':
+        """Wrap an RGB array; pass copy=True when the caller may reuse its buffer (e.g. a shared memory slot)."""
+        return cls(np.array(array, copy=True) if copy else array)
+
+    @classmethod
+    def coerce(cls, image: Union['Frame', Image.Image, np.ndarray]) -> 'Frame':
+        if isinstance(image, Frame):
+            return image
+        if isinstance(image, np.ndarray):
+            return cls.from_array(image)
+        return cls.from_image(image)
+
+    @property
+    def size(self):
+        """(width, height), like PIL."""
+        return self.array.shape[1], self.array.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.array.nbytes
+
+    @property
+    def bgr(self) -> np.ndarray:
+        """BGR view (negative stride, no copy), the channel order ultralytics expects for arrays."""
+        return self.array[:, :, ::-1]
+
+    @property
+    def image(self) -> Image.Image:
+        """PIL image sharing the buffer, for the few consumers that need one."""
+        if self._image is None:
+            height, width = self.array.shape[:2]
+            self._image = Image.frombuffer('RGB', (width, height), self.array, 'raw', 'RGB', 0, 1)
+        return self._image
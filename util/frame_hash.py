@@ -0,0 +1,69 @@
+"""
+Cheap change detection between consecutive screenshots.
+
+A frame signature is the grid of mean gray levels over `block` x `block` pixel
+cells (computed with PIL's box reduction in C), plus an exact digest computed
+lazily only when the grids match. Two frames count as unchanged when at most
+`max_changed_blocks` cells differ by more than `tolerance` gray levels, so a
+blinking caret or a clock tick can be ignored by allowing a few cells.
+"""
+import hashlib
+from typing import Optional, Union
+
+import numpy as np
+from PIL import Image
+
+
+class FrameSignature(object):
+    def __init__(self, image: Image.Image, blocks: np.ndarray, array: Optional[np.ndarray] = None):
+        self.size = image.size
+        self.blocks = blocks
+        self._image = image
+        self._array = array
+        self._digest = None
+
+    @property
+    def digest(self) -> bytes:
+        if self._digest is None:
+            # hash a contiguous array in place rather than through a tobytes() copy
+            data = self._array if self._array is not None and self._array.flags.c_contiguous else self._image.tobytes()
+            self._digest = hashlib.blake2b(data, digest_size=16).digest()
+            self._image = self._array = None  # the signature outlives the request, don't pin the frame
+        return self._digest
+
+    def release(self):
+        """Compute the digest now and drop the frame reference (for signatures kept in caches)."""
+        self.digest
+
+
+class FrameChangeDetector(object):
+    def __init__(self, max_changed_blocks: int = 0, tolerance: float = 1.0, block: int = 16):
+        self.max_changed_blocks = max_changed_blocks
+        self.tolerance = tolerance
+        self.block = block
+
+    def signature(self, image: Union[Image.Image, np.ndarray]) -> FrameSignature:
+        array = None
+        if isinstance(image, np.ndarray):
+            array, image = image, Image.fromarray(image)
+        gray = image.convert('L')
+        grid = gray.reduce(self.block) if min(gray.size) >= self.block else gray
+        return FrameSignature(image, np.asarray(grid, dtype=np.float32), array=array)
+
+    def changed_blocks(self, previous: FrameSignature, current: FrameSignature) -> Optional[int]:
+        """Number of cells that changed, None if the frames are not comparable (different size)."""
+        if previous.size != current.size or previous.blocks.shape != current.blocks.shape:
+            return None
+        return int(np.count_nonzero(np.abs(previous.blocks - current.blocks) > self.tolerance))
+
+    def is_unchanged(self, previous: Optional[FrameSignature], current: FrameSignature, max_changed_blocks: Optional[int] = None) -> bool:
+        if previous is None:
+            return False
+        limit = self.max_changed_blocks if max_changed_blocks is None else max_changed_blocks
+        changed = self.changed_blocks(previous, current)
+        if changed is None or changed > limit:
+            return False
+        if limit == 0:
+            # strict mode promises pixel identity, confirm with the exact digest
+            return previous.digest == current.digest
+        return True
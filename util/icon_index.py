@@ -0,0 +1,169 @@
+"""
+Nearest-neighbour caption reuse for icons that are visually close to ones seen before.
+
+The exact crop-hash cache in util/caption_budget.py misses on hover states,
+theme tints and one-pixel shifts. Each captioned icon's crop is embedded
+(`PixelEmbedder` by default, or the caption model's own vision encoder with
+`EncoderEmbedder`) and kept in an `IconIndex`; a new crop whose nearest
+neighbour is within `max_distance` (cosine distance) reuses that caption and
+skips the autoregressive decoder. The index is a flat matrix searched with one
+matrix product, which is fast enough for the tens of thousands of icons a
+session sees, and can be saved to / loaded from an .npz file.
+"""
+import os
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import torch
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-6)).astype(np.float32)
+
+
+class PixelEmbedder(object):
+    """
+    Zero-mean, unit-norm grayscale thumbnail (shape) plus the mean color at a lower weight, so
+    brightness/contrast shifts of a hover state leave the embedding nearly unchanged.
+    """
+    name = 'pixel'
+
+    def __init__(self, size: int = 16, color_weight: float = 0.25):
+        self.size = size
+        self.color_weight = color_weight
+
+    def __call__(self, crops: Sequence[np.ndarray]) -> np.ndarray:
+        if not len(crops):
+            return np.zeros((0, self.size * self.size + 3), dtype=np.float32)
+        rows = []
+        for crop in crops:
+            small = cv2.resize(crop, (self.size, self.size), interpolation=cv2.INTER_AREA).astype(np.float32)
+            gray = small.mean(axis=2).ravel()
+            gray -= gray.mean()
+            gray /= max(np.linalg.norm(gray), 1e-6)
+            color = small.reshape(-1, 3).mean(axis=0) / 255.0
+            rows.append(np.concatenate([gray, self.color_weight * color]))
+        return _normalize(np.stack(rows))
+
+
+class EncoderEmbedder(object):
+    """Mean-pooled image features of the caption model's vision encoder (one forward pass, no decoding)."""
+
+    def __init__(self, caption_model_processor):
+        self.model = caption_model_processor['model']
+        self.processor = caption_model_processor['processor']
+        self.name = f'encoder:{self.model.config.name_or_path}'
+        if not (hasattr(self.model, '_encode_image') or hasattr(self.model, 'vision_model')):
+            raise ValueError(f'{self.model.config.name_or_path} has no vision encoder to embed icons with')
+
+    @torch.inference_mode()
+    def __call__(self, crops: Sequence[np.ndarray]) -> np.ndarray:
+        from PIL import Image
+        if not len(crops):
+            return np.zeros((0, 0), dtype=np.float32)
+        images = [Image.fromarray(crop) for crop in crops]
+        device = self.model.device
+        pixel_values = self.processor.image_processor(images, return_tensors='pt')['pixel_values'].to(device=device, dtype=self.model.dtype)
+        if hasattr(self.model, '_encode_image'):
+            # florence2: projected image tokens (B, N, D)
+            features = self.model._encode_image(pixel_values).mean(dim=1)
+        else:
+            # blip2
+            features = self.model.vision_model(pixel_values=pixel_values).pooler_output
+        return _normalize(features.float().cpu().numpy())
+
+
+def get_icon_embedder(name: str, caption_model_processor=None):
+    if name == 'pixel':
+        return PixelEmbedder()
+    if name == 'encoder':
+        return EncoderEmbedder(caption_model_processor)
+    raise ValueError(f'Unknown icon embedder {name}, expected pixel or encoder')
+
+
+class IconIndex(object):
+    def __init__(self, embedder, max_distance: float = 0.08, max_items: int = 50000):
+        """
+        embedder: callable mapping a list of HxWx3 uint8 crops to L2-normalized (N, D) float32 rows.
+        max_distance: reuse a neighbour's caption when 1 - cosine similarity is at most this.
+        max_items: oldest entries are overwritten once the index is full.
+        """
+        self.embedder = embedder
+        self.max_distance = max_distance
+        self.max_items = max_items
+        self.vectors: Optional[np.ndarray] = None
+        self.captions: List[str] = []
+        self._next = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.captions)
+
+    def embed(self, crops: Sequence[np.ndarray]) -> np.ndarray:
+        return self.embedder(crops)
+
+    def search(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(nearest entry index, cosine distance) per row; index -1 when the index is empty."""
+        with self._lock:
+            if not self.captions or not len(vectors):
+                return np.full(len(vectors), -1), np.full(len(vectors), np.inf, dtype=np.float32)
+            similarity = vectors @ self.vectors[:len(self.captions)].T
+        nearest = similarity.argmax(axis=1)
+        return nearest, 1.0 - similarity[np.arange(len(vectors)), nearest]
+
+    def lookup(self, vectors: np.ndarray) -> List[Optional[str]]:
+        """Caption of the nearest neighbour for each row, None where it is farther than max_distance."""
+        nearest, distances = self.search(vectors)
+        with self._lock:
+            result = [self.captions[i] if i >= 0 and d <= self.max_distance else None for i, d in zip(nearest, distances)]
+            hits = sum(1 for caption in result if caption is not None)
+            self.hits += hits
+            self.misses += len(result) - hits
+        return result
+
+    def add(self, vectors: np.ndarray, captions: Sequence[str]):
+        if not len(captions):
+            return
+        with self._lock:
+            if self.vectors is None:
+                self.vectors = np.zeros((self.max_items, vectors.shape[1]), dtype=np.float32)
+            for vector, caption in zip(vectors, captions):
+                slot = self._next % self.max_items
+                self.vectors[slot] = vector
+                if slot < len(self.captions):
+                    self.captions[slot] = caption
+                else:
+                    self.captions.append(caption)
+                self._next += 1
+
+    def save(self, path: str):
+        with self._lock:
+            n = len(self.captions)
+            vectors = self.vectors[:n] if n else np.zeros((0, 0), dtype=np.float32)
+            captions = np.array(self.captions, dtype=str)
+            next_slot = self._next
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, vectors=vectors, captions=captions, embedder=np.array(self.embedder.name), next=np.array(next_slot))
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> bool:
+        """Load entries saved by `save`; returns False (and keeps the index empty) if they came from another embedder."""
+        with np.load(path) as data:
+            if str(data['embedder']) != self.embedder.name:
+                print(f'icon index {path} was built with {data["embedder"]}, not {self.embedder.name}; starting empty')
+                return False
+            vectors, captions = data['vectors'], [str(c) for c in data['captions']]
+            next_slot = int(data['next'])
+        with self._lock:
+            self.vectors, self.captions, self._next = None, [], 0
+        # keep the newest entries if the saved index is larger than this one
+        order = [(next_slot - len(captions) + k) % len(captions) for k in range(len(captions))] if captions else []
+        order = order[-self.max_items:]
+        self.add(vectors[order], [captions[i] for i in order])
+        return True
@@ -0,0 +1,129 @@
+"""
+Memory-mapped weight cache for the caption models.
+
+The first load of a model converts its state dict to a safetensors file under
+the cache directory (keyed by source path, modification time and dtype). Later
+loads build the module skeleton without allocating weights and assign tensors
+that alias a private read-only mapping of that file, so:
+    - start-up skips deserialization and the extra copy into freshly allocated memory,
+    - every process mapping the same file (server workers, gradio demo, eval) shares
+      one copy of the weight pages through the OS page cache.
+Writes to the weights would trigger copy-on-write per page; inference never writes.
+"""
+import hashlib
+import json
+import os
+import struct
+import time
+from typing import Callable, Dict, Optional
+
+import torch
+
+DEFAULT_CACHE_DIR = os.environ.get('OMNIPARSER_WEIGHT_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'omniparser', 'weights'))
+
+# model name -> {'seconds': float, 'source': 'mmap_cache' | 'pretrained', 'cache_file': str | None}
+LOAD_STATS: Dict[str, Dict] = {}
+
+_SAFETENSORS_DTYPES = {
+    'F64': torch.float64, 'F32': torch.float32, 'F16': torch.float16, 'BF16': torch.bfloat16,
+    'I64': torch.int64, 'I32': torch.int32, 'I16': torch.int16, 'I8': torch.int8, 'U8': torch.uint8, 'BOOL': torch.bool,
+}
+
+
+def _source_fingerprint(path: str) -> str:
+    """Latest mtime of the weight files so a retrained checkpoint invalidates the cache."""
+    if os.path.isdir(path):
+        mtimes = [os.path.getmtime(os.path.join(path, f)) for f in os.listdir(path)]
+        return str(max(mtimes)) if mtimes else '0'
+    if os.path.exists(path):
+        return str(os.path.getmtime(path))
+    return 'hub'  # hub model ids are immutable enough for a cache key
+
+
+def cache_file_for(name: str, source_path: str, dtype: torch.dtype, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+    key = f'{os.path.abspath(source_path) if os.path.exists(source_path) else source_path}|{_source_fingerprint(source_path)}|{dtype}|{torch.__version__}'
+    return os.path.join(cache_dir, f'{name}-{hashlib.sha1(key.encode()).hexdigest()[:16]}.safetensors')
+
+
+def save_state_dict(state_dict: Dict[str, torch.Tensor], path: str):
+    """Write a safetensors file; tensors sharing storage (tied weights) are stored once and re-aliased on load."""
+    from safetensors.torch import save_file
+    tensors, aliases, seen = {}, {}, {}
+    for name, tensor in state_dict.items():
+        key = (tensor.untyped_storage().data_ptr(), tensor.storage_offset(), tuple(tensor.shape), tensor.dtype)
+        if key in seen:
+            aliases[name] = seen[key]
+            continue
+        seen[key] = name
+        tensors[name] = tensor.detach().to('cpu').contiguous().clone()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    save_file(tensors, tmp_path, metadata={'aliases': json.dumps(aliases)})
+    os.replace(tmp_path, path)
+
+
+def mmap_state_dict(path: str) -> Dict[str, torch.Tensor]:
+    """Tensors that alias a MAP_PRIVATE mapping of a safetensors file (no copy for aligned tensors)."""
+    with open(path, 'rb') as f:
+        header_len = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_len))
+    metadata = header.pop('__metadata__', None) or {}
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    data_start = 8 + header_len
+    state_dict = {}
+    for name, info in header.items():
+        dtype = _SAFETENSORS_DTYPES[info['dtype']]
+        begin, end = info['data_offsets']
+        offset = data_start + begin
+        itemsize = torch.empty((), dtype=dtype).element_size()
+        if offset % itemsize == 0:
+            tensor = torch.empty(0, dtype=dtype).set_(storage, offset // itemsize, info['shape'])
+        else:
+            # unaligned tensors cannot alias the mapping, copy them out
+            raw = torch.empty(0, dtype=torch.uint8).set_(storage, offset, (end - begin,))
+            tensor = raw.clone().view(dtype).reshape(info['shape'])
+        state_dict[name] = tensor
+    for alias, target in json.loads(metadata.get('aliases', '{}')).items():
+        state_dict[alias] = state_dict[target]
+    return state_dict
+
+
+def load_cached_module(name: str, source_path: str, dtype: torch.dtype, build_pretrained: Callable[[], torch.nn.Module],
+                       build_empty: Callable[[], torch.nn.Module], cache_dir: Optional[str] = DEFAULT_CACHE_DIR) -> torch.nn.Module:
+    """
+    Load `name` from the mmap cache if present, otherwise via `build_pretrained()` and populate the cache.
+    `build_empty()` must return the same architecture without allocated weights (meta device).
+    Any failure on the cache path falls back to `build_pretrained()`.
+    """
+    start = time.time()
+    cache_file = cache_file_for(name, source_path, dtype, cache_dir) if cache_dir else None
+    model, source = None, 'pretrained'
+    if cache_file and os.path.exists(cache_file):
+        try:
+            model = build_empty()
+            missing, unexpected = model.load_state_dict(mmap_state_dict(cache_file), strict=False, assign=True)
+            still_meta = [n for n, p in list(model.named_parameters()) + list(model.named_buffers()) if p.is_meta]
+            if still_meta:
+                raise RuntimeError(f'weights missing from cache: {still_meta[:5]}')
+            if hasattr(model, 'tie_weights'):
+                model.tie_weights()
+            model.eval()
+            source = 'mmap_cache'
+        except Exception as e:
+            print(f'Warning: weight cache {cache_file} unusable ({e}), loading {source_path}')
+            model = None
+    if model is None:
+        model = build_pretrained()
+        if cache_file:
+            try:
+                save_state_dict(model.state_dict(), cache_file)
+            except Exception as e:
+                print(f'Warning: could not write weight cache {cache_file}: {e}')
+    LOAD_STATS[name] = {'seconds': time.time() - start, 'source': source, 'cache_file': cache_file}
+    print(f"Loaded {name} from {source} in {LOAD_STATS[name]['seconds']:.2f}s")
+    return model
+
+
+def record_load_time(name: str, start: float, source: str = 'pretrained'):
+    LOAD_STATS[name] = {'seconds': time.time() - start, 'source': source, 'cache_file': None}
+    print(f"Loaded {name} from {source} in {LOAD_STATS[name]['seconds']:.2f}s")
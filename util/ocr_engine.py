@@ -0,0 +1,274 @@
+"""
+OCR engine construction and result parsing.
+
+Shared by the in-process readers in util/utils.py and the worker processes of
+util/ocr_pool.py. This module loads nothing besides the OCR engines, so a
+worker process doesn't import the detection and caption stack.
+
+OCR modes: 'full' is EasyOCR's `readtext`, which runs its CRAFT text detector
+over the whole frame before recognition. 'recognize' skips that network:
+`text_line_proposals` finds candidate text lines with morphology and connected
+components on a downscaled gray frame, and only EasyOCR's recognizer runs on
+them. Proposals that are not text (icons, borders) come back with low
+confidence and are dropped.
+
+Several frames (a trajectory, an eval set) can be read together with
+`run_easyocr_batched` or `run_paddleocr_batched`. EasyOCR's own
+`readtext_batched` only batches detection and still recognizes frame by frame.
+Here the text boxes of all frames are recognized in one call, so recognizer
+batches are filled across frames.
+"""
+import bisect
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import easyocr
+import numpy as np
+from paddleocr import PaddleOCR
+
+# EasyOCR with Korean support
+EASYOCR_LANGUAGES = ('en', 'ko')
+OCR_MODES = ('full', 'recognize')
+# readtext arguments that apply to recognition alone
+RECOGNIZE_ARGS = ('decoder', 'beamWidth', 'batch_size', 'allowlist', 'blocklist', 'contrast_ths', 'adjust_contrast', 'filter_ths')
+# readtext arguments that apply to CRAFT detection alone
+DETECT_ARGS = ('min_size', 'text_threshold', 'low_text', 'link_threshold', 'canvas_size', 'mag_ratio', 'slope_ths', 'ycenter_ths',
+               'height_ths', 'width_ths', 'add_margin', 'threshold', 'bbox_min_score', 'bbox_min_size', 'max_candidates')
+
+
+def create_easyocr_reader(languages: Sequence[str] = EASYOCR_LANGUAGES, gpu: bool = True):
+    return easyocr.Reader(list(languages), gpu=gpu)
+
+
+def normalize_languages(languages: Optional[Sequence[str]]) -> Tuple[str, ...]:
+    """EasyOCR language codes as a sorted, de-duplicated tuple (the key readers are cached under)."""
+    return tuple(sorted({lang.strip().lower() for lang in languages or () if lang.strip()}))
+
+
+class ReaderPool(object):
+    """
+    EasyOCR readers by language set, created on first use. Each reader holds its own detection and
+    recognition models, so at most `max_readers` are kept and the least recently used one is dropped.
+    A language set EasyOCR cannot load (unknown code, or scripts with no common model) falls back to
+    `default_languages` and is not tried again.
+    """
+
+    def __init__(self, default_languages: Sequence[str] = EASYOCR_LANGUAGES, max_readers: int = 2, gpu: bool = True):
+        self.default_languages = normalize_languages(default_languages) or normalize_languages(EASYOCR_LANGUAGES)
+        self.max_readers = max(1, max_readers)
+        self.gpu = gpu
+        self._readers = OrderedDict()
+        self._failed = set()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.fallbacks = 0
+
+    def get(self, languages: Optional[Sequence[str]] = None):
+        """(reader, languages it reads) for `languages`, default `default_languages`."""
+        wanted = normalize_languages(languages) or self.default_languages
+        with self._lock:
+            if wanted in self._failed:
+                self.fallbacks += 1
+                wanted = self.default_languages
+            try:
+                return self._reader(wanted), wanted
+            except Exception as e:
+                if wanted == self.default_languages:
+                    raise
+                print(f'Warning: cannot load an EasyOCR reader for {list(wanted)} ({e}), using {list(self.default_languages)}')
+                self._failed.add(wanted)
+                self.fallbacks += 1
+                return self._reader(self.default_languages), self.default_languages
+
+    def _reader(self, languages: Tuple[str, ...]):
+        reader = self._readers.get(languages)
+        if reader is not None:
+            self._readers.move_to_end(languages)
+            return reader
+        reader = create_easyocr_reader(languages, gpu=self.gpu)
+        self.loads += 1
+        self._readers[languages] = reader
+        while len(self._readers) > self.max_readers:
+            evicted, _ = self._readers.popitem(last=False)
+            print(f'Dropped the EasyOCR reader for {list(evicted)}')
+        return reader
+
+    def __len__(self) -> int:
+        return len(self._readers)
+
+
+def create_paddle_ocr():
+    """PaddleOCR 3.x reader, or None if it cannot be initialized (callers fall back to EasyOCR)."""
+    try:
+        return PaddleOCR(
+            use_doc_orientation_classify=False,
+            use_doc_unwarping=False,
+            use_textline_orientation=False,
+            text_recognition_model_name="korean_PP-OCRv5_mobile_rec"
+        )
+    except Exception as e:
+        print(f"Warning: PaddleOCR initialization failed: {e}")
+        print("Falling back to EasyOCR only")
+        return None
+
+
+def run_easyocr(reader, image_np: np.ndarray, easyocr_args: Optional[Dict] = None) -> Tuple[List, List[str]]:
+    """(quadrilaterals, texts) found in an RGB array."""
+    if easyocr_args is None:
+        easyocr_args = {}
+    result = reader.readtext(image_np, **easyocr_args)
+    coord = [item[0] for item in result]
+    text = [item[1] for item in result]
+    return coord, text
+
+
+def text_line_proposals(image_np: np.ndarray, max_side: int = 1600, min_height: int = 5, max_height: int = 60, char_gap: int = 7, pad: int = 2) -> List[List[int]]:
+    """
+    [x_min, x_max, y_min, y_max] pixel boxes of likely text lines in an RGB array (EasyOCR's
+    `horizontal_list` format). Edges (morphological gradient, Otsu threshold) are closed horizontally
+    over `char_gap` pixels so the characters of a line join, then connected components of line height
+    (`min_height`..`max_height`, measured at `max_side`) that are dense enough to be text are kept.
+    """
+    h, w = image_np.shape[:2]
+    scale = min(1.0, max_side / max(h, w))
+    gray = cv2.cvtColor(np.ascontiguousarray(image_np), cv2.COLOR_RGB2GRAY)
+    if scale < 1.0:
+        gray = cv2.resize(gray, (max(int(round(w * scale)), 1), max(int(round(h * scale)), 1)), interpolation=cv2.INTER_AREA)
+    edges = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, mask = cv2.threshold(edges, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (char_gap, 1)))
+    _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    boxes = []
+    for x, y, bw, bh, area in stats[1:].tolist():
+        # outlines of buttons and windows are tall or wide but hollow
+        if not min_height <= bh <= max_height or bw < min_height or area < 0.3 * bw * bh:
+            continue
+        boxes.append([max(int(x / scale) - pad, 0), min(int((x + bw) / scale) + pad, w), max(int(y / scale) - pad, 0), min(int((y + bh) / scale) + pad, h)])
+    return boxes
+
+
+def easyocr_gray(image_np: np.ndarray) -> np.ndarray:
+    """The gray image EasyOCR recognizes on for a 3-channel array (its `reformat_input` converts as if BGR)."""
+    return cv2.cvtColor(np.ascontiguousarray(image_np), cv2.COLOR_BGR2GRAY)
+
+
+def recognize_frames(reader, grays: Sequence[np.ndarray], horizontal_lists: Sequence[List], free_lists: Sequence[List], easyocr_args: Optional[Dict] = None, batch_size: int = 32, min_confidence: float = 0.0) -> List[Tuple[List, List[str]]]:
+    """
+    (quadrilaterals, texts) per frame of EasyOCR recognition on each frame's boxes (`horizontal_list`
+    and `free_list` format, in frame pixels). The gray frames are stacked into one canvas and all boxes,
+    clipped to their frame, are recognized in one `reader.recognize` call.
+    """
+    offsets, height = [], 0
+    for gray in grays:
+        offsets.append(height)
+        height += gray.shape[0]
+    results = [([], []) for _ in grays]
+    if not grays:
+        return results
+    canvas = np.zeros((height, max(gray.shape[1] for gray in grays)), dtype=np.uint8)
+    horizontal, free = [], []
+    for gray, y0, horizontal_list, free_list in zip(grays, offsets, horizontal_lists, free_lists):
+        h, w = gray.shape
+        canvas[y0:y0 + h, :w] = gray
+        for x_min, x_max, y_min, y_max in horizontal_list:
+            x_min, x_max, y_min, y_max = max(int(x_min), 0), min(int(x_max), w), max(int(y_min), 0), min(int(y_max), h)
+            if x_max > x_min and y_max > y_min:
+                horizontal.append([x_min, x_max, y_min + y0, y_max + y0])
+        free.extend([[min(max(x, 0), w - 1), min(max(y, 0), h - 1) + y0] for x, y in poly] for poly in free_list)
+    if not horizontal and not free:
+        return results
+    args = {'batch_size': batch_size}
+    args.update({k: v for k, v in (easyocr_args or {}).items() if k in RECOGNIZE_ARGS})
+    for box, txt, confidence in reader.recognize(canvas, horizontal_list=horizontal, free_list=free, detail=1, paragraph=False, reformat=False, **args):
+        if confidence < min_confidence or not txt.strip():
+            continue
+        i = bisect.bisect_right(offsets, min(point[1] for point in box)) - 1
+        coord, text = results[i]
+        coord.append([[int(x), int(y) - offsets[i]] for x, y in box])
+        text.append(txt)
+    return results
+
+
+def run_easyocr_recognize(reader, image_np: np.ndarray, easyocr_args: Optional[Dict] = None, proposals: Optional[List[List[int]]] = None, min_confidence: float = 0.4) -> Tuple[List, List[str]]:
+    """Same result as `run_easyocr`, recognizing only `proposals` (default `text_line_proposals`) without CRAFT."""
+    if proposals is None:
+        proposals = text_line_proposals(image_np)
+    return recognize_frames(reader, [easyocr_gray(image_np)], [proposals], [[]], easyocr_args, batch_size=8, min_confidence=min_confidence)[0]
+
+
+def run_easyocr_batched(reader, images: Sequence[np.ndarray], easyocr_args: Optional[Dict] = None, mode: str = 'full', batch_size: int = 32, detect_batch: int = 4) -> List[Tuple[List, List[str]]]:
+    """
+    `run_easyocr` (mode 'full') or `run_easyocr_recognize` ('recognize') of several RGB arrays, with
+    recognition batched across them (`recognize_frames`, `batch_size` boxes per recognizer batch). In
+    full mode, up to `detect_batch` frames of the same size also share a CRAFT pass. Unlike EasyOCR's
+    `readtext_batched`, frames may differ in size and are not resized.
+    """
+    easyocr_args = easyocr_args or {}
+    if easyocr_args.get('paragraph'):
+        # paragraphs are merged within one frame's results
+        return [run_easyocr(reader, image, easyocr_args) for image in images]
+    grays = [easyocr_gray(image) for image in images]
+    if mode == 'recognize':
+        return recognize_frames(reader, grays, [text_line_proposals(image) for image in images], [[] for _ in images], easyocr_args, batch_size=batch_size, min_confidence=0.4)
+    detect_args = {k: v for k, v in easyocr_args.items() if k in DETECT_ARGS}
+    horizontal_lists, free_lists = [[] for _ in images], [[] for _ in images]
+    by_shape = defaultdict(list)
+    for i, image in enumerate(images):
+        by_shape[image.shape].append(i)
+    for ids in by_shape.values():
+        for start in range(0, len(ids), detect_batch):
+            chunk = ids[start:start + detect_batch]
+            batch = np.stack([images[i] for i in chunk]) if len(chunk) > 1 else np.ascontiguousarray(images[chunk[0]])
+            horizontal_agg, free_agg = reader.detect(batch, reformat=False, **detect_args)
+            for i, horizontal_list, free_list in zip(chunk, horizontal_agg, free_agg):
+                horizontal_lists[i], free_lists[i] = horizontal_list, free_list
+    return recognize_frames(reader, grays, horizontal_lists, free_lists, easyocr_args, batch_size=batch_size)
+
+
+def _paddle_texts(result, text_threshold: float) -> Tuple[List, List[str]]:
+    """(quadrilaterals, texts) of one PaddleOCR 3.x result (dict/object with rec_texts, rec_scores, dt_polys)."""
+    if result is None or not hasattr(result, '__getitem__'):
+        return [], []
+    # Get the result dict (might be wrapped in 'res' key)
+    res = result.get('res', result) if isinstance(result, dict) else result
+
+    rec_texts = res.get('rec_texts', []) if isinstance(res, dict) else getattr(res, 'rec_texts', [])
+    rec_scores = res.get('rec_scores', []) if isinstance(res, dict) else getattr(res, 'rec_scores', [])
+    dt_polys = res.get('dt_polys', []) if isinstance(res, dict) else getattr(res, 'dt_polys', [])
+
+    # Filter by threshold and build coord/text lists
+    coord, text = [], []
+    for i, (txt, score) in enumerate(zip(rec_texts, rec_scores)):
+        if score > text_threshold and i < len(dt_polys):
+            # dt_polys are numpy arrays of shape (4, 2) - convert to list format
+            poly = dt_polys[i].tolist() if hasattr(dt_polys[i], 'tolist') else dt_polys[i]
+            coord.append(poly)
+            text.append(txt)
+    return coord, text
+
+
+def run_paddleocr(paddle_ocr, image_np: np.ndarray, easyocr_args: Optional[Dict] = None) -> Tuple[List, List[str]]:
+    """Same as `run_easyocr`; only `text_threshold` of `easyocr_args` applies."""
+    if easyocr_args is None:
+        text_threshold = 0.5
+    else:
+        text_threshold = easyocr_args.get('text_threshold', 0.5)
+
+    # PaddleOCR 3.x uses predict() and returns dict/object with rec_texts, rec_scores, dt_polys
+    result = paddle_ocr.predict(input=image_np)
+
+    # Handle result format - may be list of dicts or single dict
+    if isinstance(result, list) and len(result) > 0:
+        result = result[0]
+    return _paddle_texts(result, text_threshold)
+
+
+def run_paddleocr_batched(paddle_ocr, images: Sequence[np.ndarray], easyocr_args: Optional[Dict] = None) -> List[Tuple[List, List[str]]]:
+    """`run_paddleocr` of several RGB arrays in one `predict` call (PaddleOCR batches list input)."""
+    if not images:
+        return []
+    text_threshold = (easyocr_args or {}).get('text_threshold', 0.5)
+    results = list(paddle_ocr.predict(input=list(images)))
+    return [_paddle_texts(result, text_threshold) for result in results]
@@ -0,0 +1,223 @@
+"""
+OCR in worker processes.
+
+The module readers in util/utils.py run in the calling thread, so a parse
+uses one core for OCR and two threads parsing at once take turns on the same
+reader. `OcrPool` starts `workers` processes that each create their own
+EasyOCR (and optionally PaddleOCR) reader once, and runs OCR jobs on them:
+either the whole frame as one job, or the frame cut into horizontal bands
+that are read in parallel. Bands overlap by `tile_overlap` pixels and a box is
+kept only by the band whose core (the band without the overlap) contains its
+centre. A text line shorter than twice the overlap therefore appears once and
+uncut. The pool tracks the time workers spend on jobs, so utilization can be
+reported. Each worker keeps its own `ReaderPool`, so jobs can ask for other
+languages than the pool's default.
+"""
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import types
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from util.ocr_engine import EASYOCR_LANGUAGES, ReaderPool, create_paddle_ocr, run_easyocr, run_easyocr_recognize, run_paddleocr
+
+# per worker process, set by _init_worker
+_READERS = None
+_PADDLE_OCR = None
+
+
+def _init_worker(languages: Sequence[str], use_paddleocr: bool, gpu: bool, threads: int, max_readers: int):
+    global _READERS, _PADDLE_OCR
+    # each worker gets its share of the cores instead of every torch pool spanning all of them
+    torch.set_num_threads(threads)
+    _READERS = ReaderPool(default_languages=languages, max_readers=max_readers, gpu=gpu)
+    _READERS.get()
+    _PADDLE_OCR = create_paddle_ocr() if use_paddleocr else None
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _read(image_np: np.ndarray, y_offset: int, easyocr_args: Optional[Dict], use_paddleocr: bool, languages: Optional[Sequence[str]] = None, mode: str = 'full'):
+    start = time.perf_counter()
+    used = None
+    if use_paddleocr and _PADDLE_OCR is not None:
+        coord, text = run_paddleocr(_PADDLE_OCR, image_np, easyocr_args)
+    else:
+        reader, used = _READERS.get(languages)
+        if mode == 'recognize':
+            coord, text = run_easyocr_recognize(reader, image_np, easyocr_args)
+        else:
+            coord, text = run_easyocr(reader, image_np, easyocr_args)
+    coord = [[[int(round(float(x))), int(round(float(y))) + y_offset] for x, y in poly] for poly in coord]
+    return coord, text, time.perf_counter() - start, used
+
+
+@contextmanager
+def _bare_main():
+    """
+    Spawned children re-import the parent's __main__ (the server script, which loads every model at
+    import). Starting them with a placeholder __main__ makes them import only this module.
+    """
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
+
+
+def tile_bands(height: int, tiles: int, overlap: int) -> List[Tuple[int, int, int, int]]:
+    """(y0, y1, core0, core1) per band: read rows y0:y1, keep boxes centred in core0:core1."""
+    # bands much thinner than the overlap would mostly read the same rows twice
+    tiles = max(1, min(tiles, height // max(4 * overlap, 1)))
+    step = -(-height // tiles)
+    bands = []
+    for core0 in range(0, height, step):
+        core1 = min(core0 + step, height)
+        bands.append((max(core0 - overlap, 0), min(core1 + overlap, height), core0, core1))
+    return bands
+
+
+class OcrPool(object):
+    def __init__(self, workers: Optional[int] = None, use_paddleocr: bool = False, languages: Sequence[str] = EASYOCR_LANGUAGES, gpu: bool = False, tile_overlap: int = 64, threads_per_worker: Optional[int] = None, max_readers: int = 2):
+        """
+        workers: worker processes, default one per core.
+        use_paddleocr: also create a PaddleOCR reader in each worker (otherwise paddle jobs use EasyOCR).
+        gpu: create the readers on the GPU; the pool is meant for CPU nodes, keep False there.
+        tile_overlap: rows shared by neighbouring bands of a tiled job.
+        threads_per_worker: torch threads per worker, default the cores divided among the workers.
+        languages, max_readers: default language set of the workers' reader pools, and readers kept per worker.
+        """
+        cpus = os.cpu_count() or 1
+        self.workers = workers or cpus
+        self.use_paddleocr = use_paddleocr
+        self.languages = tuple(languages)
+        self.gpu = gpu
+        self.tile_overlap = tile_overlap
+        self.threads_per_worker = threads_per_worker or max(1, cpus // self.workers)
+        self.max_readers = max_readers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._in_flight = 0
+        self._jobs = 0
+        self._busy_seconds = 0.0
+        # (end time, seconds) of recent jobs for `utilization`
+        self._recent = deque()
+        self._started = time.time()
+        self.start()
+
+    def start(self):
+        """Start every worker and wait until its readers are loaded, so no parse pays for it."""
+        with self._lock:
+            if self._executor is not None:
+                return
+            context = multiprocessing.get_context('spawn')
+            executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_worker,
+                                           initargs=(self.languages, self.use_paddleocr, self.gpu, self.threads_per_worker, self.max_readers))
+            with _bare_main():
+                # submitting one job per worker before any of them is up starts all processes now
+                pings = [executor.submit(_ping) for _ in range(self.workers)]
+            pids = {ping.result() for ping in pings}
+            self._executor = executor
+            self._started = time.time()
+        print(f'OCR pool started {len(pids)} workers with {self.threads_per_worker} threads each')
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _submit(self, *job):
+        with self._lock:
+            if self._executor is None:
+                raise RuntimeError('OCR pool is shut down')
+            self._in_flight += 1
+            future = self._executor.submit(_read, *job)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _finished(self, seconds: float):
+        now = time.time()
+        with self._lock:
+            self._jobs += 1
+            self._busy_seconds += seconds
+            self._recent.append((now, seconds))
+            while self._recent and self._recent[0][0] < now - 600:
+                self._recent.popleft()
+
+    def readtext(self, image_np: np.ndarray, easyocr_args: Optional[Dict] = None, use_paddleocr: bool = False, tiles: int = 0, job_stats: Optional[Dict] = None, languages: Optional[Sequence[str]] = None, mode: str = 'full') -> Tuple[List, List[str]]:
+        """
+        (quadrilaterals, texts) of an RGB array, like `run_easyocr`. `tiles` > 1 splits the frame into
+        that many bands (fewer on short frames). `job_stats`, if given, gets 'jobs', 'busy_seconds'
+        (summed over workers), 'seconds' (wall time) and the EasyOCR 'languages' read. `mode` is the
+        OCR mode of util/ocr_engine.py.
+        """
+        start = time.perf_counter()
+        height = image_np.shape[0]
+        bands = tile_bands(height, tiles, self.tile_overlap) if tiles > 1 else [(0, height, 0, height)]
+        futures = [self._submit(np.ascontiguousarray(image_np[y0:y1]), y0, easyocr_args, use_paddleocr, languages, mode) for y0, y1, _, _ in bands]
+        coord, text = [], []
+        busy, used = 0.0, None
+        try:
+            for (_, _, core0, core1), future in zip(bands, futures):
+                band_coord, band_text, seconds, used = future.result()
+                self._finished(seconds)
+                busy += seconds
+                for poly, txt in zip(band_coord, band_text):
+                    ys = [y for _, y in poly]
+                    center = (min(ys) + max(ys)) / 2
+                    if len(bands) == 1 or core0 <= center < core1:
+                        coord.append(poly)
+                        text.append(txt)
+        except BrokenProcessPool:
+            # a worker died (e.g. killed for memory); start a fresh pool for the next request
+            with self._lock:
+                executor, self._executor = self._executor, None
+            if executor is not None:
+                executor.shutdown(wait=False)
+            self.start()
+            raise
+        if job_stats is not None:
+            job_stats['jobs'] = job_stats.get('jobs', 0) + len(bands)
+            job_stats['busy_seconds'] = job_stats.get('busy_seconds', 0.0) + busy
+            job_stats['seconds'] = job_stats.get('seconds', 0.0) + time.perf_counter() - start
+            if used is not None:
+                job_stats['languages'] = list(used)
+        return coord, text
+
+    @property
+    def in_flight(self) -> int:
+        """Jobs submitted and not yet collected; more than `workers` means jobs are queueing."""
+        return self._in_flight
+
+    @property
+    def jobs(self) -> int:
+        return self._jobs
+
+    @property
+    def busy_seconds(self) -> float:
+        return self._busy_seconds
+
+    def utilization(self, window: float = 60.0) -> float:
+        """Share of worker time spent on jobs over the last `window` seconds (0..1)."""
+        now = time.time()
+        window = min(window, max(now - self._started, 1e-6))
+        with self._lock:
+            busy = sum(min(seconds, end - (now - window)) for end, seconds in self._recent if end > now - window)
+        return min(busy / (window * self.workers), 1.0)
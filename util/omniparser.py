@@ -1,11 +1,27 @@
-from util.utils import get_som_labeled_img, get_caption_model_processor, get_yolo_model, check_ocr_box
+from util.utils import get_som_labeled_img, get_caption_model_processor, get_yolo_model, check_ocr_box, check_ocr_boxes, get_parsed_content_icon_budgeted, predict_yolo, speculative_icon_candidates
+from util.caption_budget import CaptionBudget, CaptionCache
+from util.model_cache import DEFAULT_CACHE_DIR
+from util.frame_hash import FrameChangeDetector
+from util.icon_index import IconIndex, get_icon_embedder
+from util.frame import Frame
+from util.parse_presets import ParsePlan, ParsePlanner, detector_imgsz
+from util.regions import clip_regions, window_region
+from util.ui_tree import build_ui_tree
+from util.element_tracker import ElementTracker
+from util.ocr_engine import EASYOCR_LANGUAGES, OCR_MODES, ReaderPool, normalize_languages
 import torch
 from PIL import Image
 import io
+import os
 import base64
-from typing import Dict
+import time
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 class Omniparser(object):
-    def __init__(self, config: Dict):
+    def __init__(self, config: Dict, som_model=None, caption_model_processor=None):
+        """Models are loaded from `config` unless already-loaded ones are passed in (e.g. stand-ins for benchmarks)."""
         self.config = config
         # Prioritize: CUDA > MPS (Apple Silicon NPU) > CPU
         if torch.cuda.is_available():
@@ -16,14 +32,232 @@ class Omniparser(object):
             device = 'cpu'
         print(f'Using device: {device}')
 
-        self.som_model = get_yolo_model(model_path=config['som_model_path'])
-        self.caption_model_processor = get_caption_model_processor(model_name=config['caption_model_name'], model_name_or_path=config['caption_model_path'], device=device)
+        self.som_model = som_model if som_model is not None else get_yolo_model(model_path=config['som_model_path'])
+        self.caption_model_processor = caption_model_processor if caption_model_processor is not None else get_caption_model_processor(model_name=config['caption_model_name'], model_name_or_path=config['caption_model_path'], device=device, weight_cache_dir=config.get('weight_cache_dir', DEFAULT_CACHE_DIR))
+        # per-session (frame signature, result) of the last parse, for unchanged-screen short-circuit
+        self.frame_detector = FrameChangeDetector(max_changed_blocks=config.get('reuse_max_changed_blocks', 0), block=config.get('reuse_block_size', 16))
+        # None: adapt caption batches to free memory and latency (util/batch_sizer.py)
+        self.caption_batch_size = config.get('caption_batch_size') or None
+        self.caption_cache = CaptionCache(max_items=config.get('caption_cache_size', 4096))
+        # experimental: caption icons from one vision pass over the whole frame (florence2 only)
+        self.roi_captioner = None
+        if config.get('caption_mode', 'crop') == 'roi':
+            from util.roi_caption import RoiCaptioner
+            self.roi_captioner = RoiCaptioner(self.caption_model_processor, scale=config.get('roi_scale', 2.0), roi_size=config.get('roi_size', 8))
+        # nearest-neighbour caption reuse for near-duplicate icons, off unless an embedder is configured
+        self.icon_index = None
+        if config.get('icon_embedder'):
+            self.icon_index = IconIndex(get_icon_embedder(config['icon_embedder'], self.caption_model_processor), max_distance=config.get('icon_index_max_distance', 0.08), max_items=config.get('icon_index_size', 50000))
+            path = config.get('icon_index_path')
+            if path and os.path.exists(path) and self.icon_index.load(path):
+                print(f'Loaded {len(self.icon_index)} icons from {path}')
+        # speculative mode: OCR runs here while the main thread detects and captions likely icons
+        self.speculative = config.get('speculative_caption', False)
+        self._ocr_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='omniparser-ocr') if self.speculative else None
+        # EasyOCR readers by language set for parses that ask for other languages, least recently used dropped
+        ocr_languages = config.get('ocr_languages') or EASYOCR_LANGUAGES
+        if isinstance(ocr_languages, str):
+            ocr_languages = ocr_languages.split(',')
+        self.reader_pool = ReaderPool(default_languages=ocr_languages, max_readers=config.get('ocr_max_readers', 2))
+        # 'recognize': skip EasyOCR's text detector and recognize cheap text line proposals only
+        self.ocr_mode = config.get('ocr_mode') or 'full'
+        # OCR in worker processes (each with its own readers) instead of the in-process readers
+        self.ocr_pool = None
+        self.ocr_tiles = config.get('ocr_tiles', 0)
+        if config.get('ocr_workers'):
+            from util.ocr_pool import OcrPool
+            self.ocr_pool = OcrPool(workers=config['ocr_workers'], tile_overlap=config.get('ocr_tile_overlap', 64), languages=self.reader_pool.default_languages, max_readers=self.reader_pool.max_readers)
+        # tiled detection for frames whose longer side is at least detect_tile_min_side (0: never)
+        self.detect_tile_min_side = config.get('detect_tile_min_side', 0)
+        self.detect_tile_size = config.get('detect_tile_size', 1280)
+        self.detect_tile_overlap = config.get('detect_tile_overlap', 160)
+        # preset for parses that name none; None behaves like 'accurate'
+        self.default_preset = config.get('preset')
+        self.planner = ParsePlanner(fixed_share=config.get('deadline_fixed_share', 0.6))
+        self.sessions = OrderedDict()
+        self.max_sessions = config.get('max_sessions', 64)
+        # per-session ElementTracker: stable 'track_id's and caption carry-over between consecutive frames
+        self.track_elements = not config.get('disable_tracking', False)
+        self.trackers = OrderedDict()
+        self._sessions_lock = threading.Lock()
         print('Omniparser initialized!!!')
 
-    def parse(self, image_base64: str):
-        image_bytes = base64.b64decode(image_base64)
-        image = Image.open(io.BytesIO(image_bytes))
+    @staticmethod
+    def decode_image(image_base64: str) -> Frame:
+        return Frame.from_base64(image_base64)
+
+    def parse(self, image_base64: str, stats: Optional[Dict] = None, session_id: Optional[str] = None, reuse_max_changed_blocks: Optional[int] = None, ui_tree: bool = False, **parse_options):
+        """
+        Parse a base64 screenshot. If `stats` is given it is filled with per-stage timings and counts.
+        With a `session_id`, a frame that is unchanged since that session's previous parse (at most
+        `reuse_max_changed_blocks` changed 16px cells, default from config) returns the previous result
+        if it was parsed with the same options, and sets stats['reused']. Elements of a session's whole-frame parses get a 'track_id' that stays
+        the same while the element stays on screen (util/element_tracker.py), and unchanged icons keep
+        their caption; stats['tracking'] counts matches. With `ui_tree`, the containment tree of the elements (util/ui_tree.py)
+        is put in stats['ui_tree']. `parse_options` are described in `_parse_image`.
+        """
+        t_stage = time.time()
+        image = self.decode_image(image_base64)
+        return self.parse_image(image, stats=stats, timings={'decode': time.time() - t_stage}, session_id=session_id, reuse_max_changed_blocks=reuse_max_changed_blocks, ui_tree=ui_tree, **parse_options)
+
+    def parse_image(self, image: Union[Frame, Image.Image], stats: Optional[Dict] = None, timings: Optional[Dict] = None, session_id: Optional[str] = None, reuse_max_changed_blocks: Optional[int] = None, ui_tree: bool = False, **parse_options):
+        """Parse an already decoded screenshot (a Frame, or a PIL image which is converted to one once), see `parse`."""
+        timings = {} if timings is None else timings
+        stats = {} if stats is None else stats
+        image = Frame.coerce(image)
+        signature = None
+        # a region parse is not a result for the whole frame, keep it out of session reuse
+        if session_id is not None and not parse_options.get('regions') and not parse_options.get('window_title'):
+            t_stage = time.time()
+            signature = self.frame_detector.signature(image.array)
+            options_key = self._options_key(parse_options)
+            with self._sessions_lock:
+                previous = self.sessions.get(session_id)
+            # a result parsed with other options (budget, preset, OCR settings) is not the one asked for,
+            # and one degraded to meet a deadline only serves requests that have a deadline themselves
+            reused = (previous is not None and previous[1] == options_key and (not previous[2] or parse_options.get('deadline_ms') is not None)
+                      and self.frame_detector.is_unchanged(previous[0], signature, reuse_max_changed_blocks))
+            timings['frame_hash'] = time.time() - t_stage
+            stats['reused'] = reused
+            if reused:
+                dino_labled_img, parsed_content_list = previous[3]
+                self._fill_stats(stats, timings, image, parsed_content_list, ui_tree)
+                return dino_labled_img, parsed_content_list
+
+        tracker = None
+        if session_id is not None and self.track_elements and not parse_options.get('regions') and not parse_options.get('window_title'):
+            tracker = self._tracker(session_id)
+        result = self._parse_image(image, timings, stats, element_tracker=tracker, **parse_options)
+        if tracker is not None:
+            stats['tracking'] = tracker.last_stats
+        if signature is not None:
+            signature.release()
+            with self._sessions_lock:
+                self.sessions[session_id] = (signature, options_key, bool(stats.get('plan', {}).get('degradations')), result)
+                self.sessions.move_to_end(session_id)
+                while len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+        self._fill_stats(stats, timings, image, result[1], ui_tree)
+        return result
+
+    def _options_key(self, parse_options: Dict) -> Tuple:
+        """
+        The options a parse result depends on, defaults filled in, to tell whether a session's stored result
+        fits a request. The deadline is left out: any reuse meets it, and degraded results are tracked apart.
+        """
+        budget = parse_options.get('caption_budget')
+        if budget is not None and not budget.unlimited:
+            budget = (budget.max_captions, budget.time_budget_ms, tuple(tuple(point) for point in budget.focus_points))
+        else:
+            budget = None
+        return (
+            parse_options.get('preset') or self.default_preset or 'accurate',
+            budget,
+            normalize_languages(parse_options.get('ocr_languages')) or self.reader_pool.default_languages,
+            parse_options.get('ocr_mode') or self.ocr_mode,
+        )
+
+    def parse_images(self, images: Sequence[Union[Frame, Image.Image]], stats: Optional[List[Dict]] = None, ui_tree: bool = False, **parse_options) -> List[Tuple]:
+        """
+        Parse several screenshots (an eval set, the frames of a recorded trajectory) with their OCR batched
+        across frames (`check_ocr_boxes`); detection and captioning still run frame by frame. Returns what
+        `parse_image` returns for each frame. `stats`, if given, is extended with one stats dict per frame;
+        timings['ocr'] is the frame's share, by pixels, of its OCR batch. Takes the options of `parse_image`
+        except sessions, regions, window titles and deadlines. With an OCR pool, frames are parsed one by one.
+        """
+        for option in ('regions', 'window_title', 'deadline_ms'):
+            if parse_options.get(option):
+                raise ValueError(f'{option} is not supported when parsing a batch of frames')
+        frames = [Frame.coerce(image) for image in images]
+        frame_stats = [{} for _ in frames]
+        if stats is not None:
+            stats.extend(frame_stats)
+        if self.ocr_pool is not None:
+            return [self.parse_image(frame, stats=s, ui_tree=ui_tree, **parse_options) for frame, s in zip(frames, frame_stats)]
+        ocr_mode = parse_options.get('ocr_mode') or self.ocr_mode
+        if ocr_mode not in OCR_MODES:
+            raise ValueError(f'Unknown OCR mode {ocr_mode}, expected one of {list(OCR_MODES)}')
+        preset = parse_options.get('preset') or self.default_preset or 'accurate'
+        # frames read with the same EasyOCR settings share a batch
+        groups = defaultdict(list)
+        for i, frame in enumerate(frames):
+            plan = self.planner.plan(preset, frame.size, detector_imgsz(self.som_model), ocr_mode=ocr_mode)
+            groups[tuple(sorted(plan.easyocr_args.items()))].append(i)
+        frame_timings = [{} for _ in frames]
+        ocr_results = [None] * len(frames)
+        for key, ids in groups.items():
+            ocr_stats = {}
+            t_stage = time.time()
+            results = check_ocr_boxes([frames[i] for i in ids], easyocr_args=dict(key), ocr_stats=ocr_stats, ocr_languages=parse_options.get('ocr_languages'), reader_pool=self.reader_pool, ocr_mode=ocr_mode)
+            seconds = time.time() - t_stage
+            pixels = sum(frames[i].size[0] * frames[i].size[1] for i in ids)
+            for i, result in zip(ids, results):
+                ocr_results[i] = result
+                frame_timings[i]['ocr'] = seconds * frames[i].size[0] * frames[i].size[1] / pixels
+                frame_stats[i]['ocr_batch'] = {'frames': len(ids), 'seconds': seconds}
+                if 'languages' in ocr_stats:
+                    frame_stats[i]['ocr_languages'] = ocr_stats['languages']
+        parsed = []
+        for frame, s, timings, ocr_result in zip(frames, frame_stats, frame_timings, ocr_results):
+            result = self._parse_image(frame, timings, s, ocr_result=ocr_result, **parse_options)
+            self._fill_stats(s, timings, frame, result[1], ui_tree)
+            parsed.append(result)
+        return parsed
+
+    def _tracker(self, session_id: str) -> ElementTracker:
+        with self._sessions_lock:
+            tracker = self.trackers.get(session_id)
+            if tracker is None:
+                tracker = self.trackers[session_id] = ElementTracker(min_iou=self.config.get('track_min_iou', 0.3), carry_max_distance=self.config.get('track_carry_max_distance', 0.04))
+            self.trackers.move_to_end(session_id)
+            while len(self.trackers) > self.max_sessions:
+                self.trackers.popitem(last=False)
+        return tracker
+
+    @staticmethod
+    def _fill_stats(stats: Dict, timings: Dict, image: Frame, parsed_content_list: List[Dict], ui_tree: bool = False):
+        if ui_tree:
+            t_stage = time.time()
+            stats['ui_tree'] = build_ui_tree(parsed_content_list)
+            timings['ui_tree'] = time.time() - t_stage
+        stats['timings'] = timings
+        stats['image_size'] = image.size
+        stats['num_text'] = sum(1 for elem in parsed_content_list if elem['type'] == 'text')
+        stats['num_icon'] = sum(1 for elem in parsed_content_list if elem['type'] == 'icon')
+
+    def _parse_image(self, image: Frame, timings: Dict, stats: Dict, caption_budget: Optional[CaptionBudget] = None, preset: Optional[str] = None, deadline_ms: Optional[float] = None, regions: Optional[Sequence[Sequence[float]]] = None, window_title: Optional[str] = None, element_tracker: Optional[ElementTracker] = None, ocr_languages: Optional[Sequence[str]] = None, ocr_mode: Optional[str] = None, ocr_result: Optional[Tuple[List[str], List]] = None):
+        """
+        caption_budget: caption at most this many icons / milliseconds, the rest are returned with
+            'caption_pending': True and can be filled in later with `caption_pending`.
+        preset: 'fast', 'balanced' or 'accurate' (util/parse_presets.py), default from config.
+        deadline_ms: time the parse may take (including decoding); cheaper settings are chosen to meet it.
+            The settings used and the degradations applied are reported in stats['plan'].
+        regions: xyxy ratio rectangles; OCR and detection only run inside them (util/regions.py) and only
+            elements found there are returned, still in full-frame coordinates.
+        window_title: add the rectangle of this window, looked up on the VM server at config['windows_host_url'].
+        element_tracker: the session's tracker (set by `parse_image` for session parses of the whole frame).
+        ocr_languages: EasyOCR language codes to read (e.g. ['en'] or ['en', 'ja']), default config['ocr_languages'].
+            A set EasyOCR cannot load falls back to the default; stats['ocr_languages'] has the ones read.
+        ocr_mode: 'full' or 'recognize' (util/ocr_engine.py), default config['ocr_mode']; reported in stats['plan'].
+        ocr_result: (texts, xyxy pixel boxes) already read for this frame (set by `parse_images`), OCR is skipped.
+        """
         print('image size:', image.size)
+        regions = list(regions or [])
+        if window_title:
+            if not self.config.get('windows_host_url'):
+                raise ValueError('Parsing a window by title needs windows_host_url in the config')
+            regions.append(window_region(self.config['windows_host_url'], window_title, image.size))
+        if regions:
+            regions = clip_regions(regions, image.size)
+            if not regions:
+                raise ValueError('No region overlaps the screenshot')
+            stats['regions'] = regions
+        ocr_mode = ocr_mode or self.ocr_mode
+        if ocr_mode not in OCR_MODES:
+            raise ValueError(f'Unknown OCR mode {ocr_mode}, expected one of {list(OCR_MODES)}')
+        plan = self.planner.plan(preset or self.default_preset or 'accurate', image.size, detector_imgsz(self.som_model), deadline_ms=deadline_ms, elapsed_ms=sum(timings.values()) * 1000, detect_tile=self._detect_tile(image.size), detect_tile_overlap=self.detect_tile_overlap, ocr_mode=ocr_mode)
+        caption_budget = plan.caption_budget(caption_budget)
+        stats['plan'] = plan.to_dict()
         
         box_overlay_ratio = max(image.size) / 3200
         draw_bbox_config = {
@@ -33,7 +267,137 @@ class Omniparser(object):
             'thickness': max(int(3 * box_overlay_ratio), 1),
         }
 
-        (text, ocr_bbox), _ = check_ocr_box(image, display_img=False, output_bb_format='xyxy', easyocr_args={'text_threshold': 0.8}, use_paddleocr=False)
-        dino_labled_img, label_coordinates, parsed_content_list = get_som_labeled_img(image, self.som_model, BOX_TRESHOLD = self.config['BOX_TRESHOLD'], output_coord_in_ratio=True, ocr_bbox=ocr_bbox,draw_bbox_config=draw_bbox_config, caption_model_processor=self.caption_model_processor, ocr_text=text,use_local_semantics=True, iou_threshold=0.7, scale_img=False, batch_size=128)
+        detections, speculative_captions = None, None
+        if regions:
+            (text, ocr_bbox), detections = self._read_regions(image, regions, timings, stats, plan, ocr_languages)
+        elif ocr_result is not None:
+            text, ocr_bbox = ocr_result
+        # a caption budget asks for less caption work, don't spend it on guesses
+        elif self.speculative and caption_budget is None:
+            (text, ocr_bbox), detections, speculative_captions = self._speculate(image, timings, stats, plan, ocr_languages)
+        else:
+            t_stage = time.time()
+            text, ocr_bbox = self._ocr(image, stats, plan, ocr_languages)
+            timings['ocr'] = time.time() - t_stage
+        caption_stats = {}
+        dino_labled_img, label_coordinates, parsed_content_list = get_som_labeled_img(image, self.som_model, BOX_TRESHOLD = self.config['BOX_TRESHOLD'], output_coord_in_ratio=True, ocr_bbox=ocr_bbox,draw_bbox_config=draw_bbox_config, caption_model_processor=self.caption_model_processor, ocr_text=text,use_local_semantics=True, iou_threshold=0.7, scale_img=plan.yolo_imgsz is not None, imgsz=plan.yolo_imgsz, batch_size=self.caption_batch_size, timings=timings, caption_budget=caption_budget, caption_cache=self.caption_cache, caption_stats=caption_stats, icon_index=self.icon_index, roi_captioner=self.roi_captioner, detections=detections, speculative_captions=speculative_captions, overlay_format=plan.overlay_format, overlay_quality=plan.overlay_quality, detect_tile=plan.detect_tile, detect_tile_overlap=self.detect_tile_overlap, element_tracker=element_tracker)
+        stats['caption'] = caption_stats
+        if not regions:
+            # costs are per full-frame megapixel, region parses would skew them
+            self.planner.observe(plan, timings)
+        if speculative_captions is not None:
+            used = sum(1 for elem in parsed_content_list if elem.pop('speculative', False))
+            stats['speculative'] = {'captioned': len(speculative_captions), 'used': used, 'discarded': len(speculative_captions) - used}
+        return dino_labled_img, parsed_content_list
+
+    def _detect_tile(self, size: Tuple[int, int]) -> Optional[int]:
+        """Tile size for detecting on an image of `size`, None for a single pass."""
+        if self.detect_tile_min_side and max(size) >= self.detect_tile_min_side:
+            return self.detect_tile_size
+        return None
+
+    def _ocr(self, image: Frame, stats: Dict, plan: ParsePlan, languages: Optional[Sequence[str]] = None):
+        """(texts, xyxy boxes) of the frame; with an OCR pool its job counts and times go to stats['ocr_pool']."""
+        ocr_stats = stats.setdefault('ocr_pool', {}) if self.ocr_pool is not None else {}
+        (text, ocr_bbox), _ = check_ocr_box(image, display_img=False, output_bb_format='xyxy', easyocr_args=plan.easyocr_args, use_paddleocr=False, ocr_pool=self.ocr_pool, ocr_tiles=self.ocr_tiles, ocr_stats=ocr_stats, ocr_languages=languages, reader_pool=self.reader_pool, ocr_mode=plan.ocr_mode)
+        if 'languages' in ocr_stats:
+            stats['ocr_languages'] = ocr_stats.pop('languages')
+        return text, ocr_bbox
+
+    def _read_regions(self, image: Frame, regions: List[Tuple[int, int, int, int]], timings: Dict, stats: Dict, plan: ParsePlan, ocr_languages: Optional[Sequence[str]] = None):
+        """OCR results and detections of the pixel `regions`, shifted to full-frame pixels."""
+        text, ocr_bbox, xyxy, logits = [], [], [], []
+        timings['ocr'], timings['detect'] = 0.0, 0.0
+        for x0, y0, x1, y1 in regions:
+            crop = Frame(image.array[y0:y1, x0:x1])
+            t_stage = time.time()
+            region_text, region_bbox = self._ocr(crop, stats, plan, ocr_languages)
+            timings['ocr'] += time.time() - t_stage
+            text.extend(region_text)
+            ocr_bbox.extend([bx0 + x0, by0 + y0, bx1 + x0, by1 + y0] for bx0, by0, bx1, by1 in region_bbox)
+
+            t_stage = time.time()
+            tile = plan.detect_tile and self._detect_tile(crop.size)
+            region_xyxy, region_logits, _ = predict_yolo(model=self.som_model, image=crop.bgr, box_threshold=self.config['BOX_TRESHOLD'], imgsz=plan.yolo_imgsz, scale_img=plan.yolo_imgsz is not None, iou_threshold=0.1, tile=tile, tile_overlap=self.detect_tile_overlap)
+            xyxy.append(region_xyxy + torch.tensor([x0, y0, x0, y0], dtype=region_xyxy.dtype, device=region_xyxy.device))
+            logits.append(region_logits)
+            timings['detect'] += time.time() - t_stage
+        return (text, ocr_bbox), (torch.cat(xyxy), torch.cat(logits))
+
+    def _speculate(self, image: Frame, timings: Dict, stats: Dict, plan: ParsePlan, ocr_languages: Optional[Sequence[str]] = None):
+        """
+        Run OCR in the background while detecting icons and captioning the ones OCR is unlikely to
+        merge or drop (see `speculative_icon_candidates`). Captions of boxes that filtering removes
+        anyway are discarded.
+        """
+        def run_ocr():
+            t_ocr = time.time()
+            result = self._ocr(image, stats, plan, ocr_languages)
+            timings['ocr'] = time.time() - t_ocr
+            return result
+        ocr_future = self._ocr_executor.submit(run_ocr)
+
+        t_stage = time.time()
+        w, h = image.size
+        xyxy, logits, _ = predict_yolo(model=self.som_model, image=image.bgr, box_threshold=self.config['BOX_TRESHOLD'], imgsz=plan.yolo_imgsz, scale_img=plan.yolo_imgsz is not None, iou_threshold=0.1, tile=plan.detect_tile, tile_overlap=self.detect_tile_overlap)
+        timings['detect'] = time.time() - t_stage
+
+        t_stage = time.time()
+        # same ratio boxes as get_som_labeled_img computes, so captions can be matched by box
+        boxes = xyxy / torch.Tensor([w, h, w, h]).to(xyxy.device)
+        candidates = speculative_icon_candidates(boxes, iou_threshold=0.7, image_size=(w, h), max_area=self.config.get('speculative_max_area', 0.0025), max_aspect=self.config.get('speculative_max_aspect', 2.5))
+        get_parsed_content_icon_budgeted(candidates, image.array, self.caption_model_processor, batch_size=self.caption_batch_size, caption_cache=self.caption_cache, icon_index=self.icon_index, roi_captioner=self.roi_captioner)
+        speculative_captions = {tuple(elem['bbox']): elem['content'] for elem in candidates if not elem.get('caption_pending')}
+        timings['speculate'] = time.time() - t_stage
+
+        t_stage = time.time()
+        ocr_result = ocr_future.result()
+        timings['ocr_wait'] = time.time() - t_stage
+        return ocr_result, (xyxy, logits), speculative_captions
+
+    def caption_pending(self, image: Union[Frame, Image.Image], parsed_content_list: List[Dict], element_ids: Optional[List[int]] = None) -> List[int]:
+        """Caption elements left pending by a budgeted parse (all of them, or those in `element_ids`); returns the ids updated."""
+        if element_ids is None:
+            element_ids = range(len(parsed_content_list))
+        ids = [i for i in element_ids if 0 <= i < len(parsed_content_list) and parsed_content_list[i].get('caption_pending')]
+        elems = [parsed_content_list[i] for i in ids]
+        for elem in elems:
+            elem['content'] = None
+        get_parsed_content_icon_budgeted(elems, Frame.coerce(image).array, self.caption_model_processor, batch_size=self.caption_batch_size, caption_cache=self.caption_cache, icon_index=self.icon_index, roi_captioner=self.roi_captioner)
+        return ids
+
+    def warmup(self, resolutions: Sequence[Tuple[int, int]] = ((1920, 1080),), densities: Sequence[float] = (0.3, 0.9)) -> List[Dict]:
+        """
+        Run throwaway parses on synthetic screens so lazy initialization (kernel selection, OCR and
+        caption model first calls) is paid before real traffic. Densities vary the icon count and
+        therefore the caption batch shapes.
+        """
+        from util.synthetic import generate_screen
+        report = []
+        # synthetic icons must not end up as neighbours of real ones
+        icon_index, self.icon_index = self.icon_index, None
+        try:
+            for width, height in resolutions:
+                for density in densities:
+                    image, _ = generate_screen(width, height, layout='mixed', density=density)
+                    buffered = io.BytesIO()
+                    image.save(buffered, format='PNG')
+                    start = time.time()
+                    self.parse(base64.b64encode(buffered.getvalue()).decode('ascii'))
+                    report.append({'resolution': f'{width}x{height}', 'density': density, 'latency': time.time() - start})
+        finally:
+            self.icon_index = icon_index
+        return report
+
+    def close(self):
+        """Stop the OCR worker processes and the speculative OCR thread."""
+        if self.ocr_pool is not None:
+            self.ocr_pool.shutdown()
+        if self._ocr_executor is not None:
+            self._ocr_executor.shutdown()
 
-        return dino_labled_img, parsed_content_list
\ No newline at end of file
+    def save_icon_index(self, path: Optional[str] = None):
+        path = path or self.config.get('icon_index_path')
+        if self.icon_index is not None and path:
+            self.icon_index.save(path)
+            print(f'Saved {len(self.icon_index)} icons to {path}')
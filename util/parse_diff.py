@@ -0,0 +1,119 @@
+"""
+Differences between two parses of the same screen.
+
+`diff_parses` pairs the elements of a parse with those of an earlier one and
+reports what the agent needs to update its picture of the screen:
+    added     - elements with no counterpart in the previous parse
+    removed   - ids of previous elements with no counterpart
+    moved     - counterparts whose box moved by more than `move_tolerance`
+    changed   - counterparts whose content differs (may also have moved)
+    id_map    - current id -> previous id for every counterpart
+Parses of one session are paired by 'track_id' (util/element_tracker.py).
+Otherwise each element is paired with the best overlapping previous element of
+the same type, found through the previous parse's grid index
+(util/element_index.py). Text left unpaired is then paired with previous text
+of the same content, which catches scrolled lines. `apply_diff` rebuilds the
+current element list from the previous list and a diff, so a client only has
+to receive the deltas.
+"""
+import difflib
+from typing import Dict, List, Optional
+
+from util.element_index import ElementIndex
+
+
+def _iou(a, b) -> float:
+    ix = min(a[2], b[2]) - max(a[0], b[0])
+    iy = min(a[3], b[3]) - max(a[1], b[1])
+    if ix <= 0 or iy <= 0:
+        return 0.0
+    inter = ix * iy
+    return inter / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+
+def _similarity(a: Optional[str], b: Optional[str]) -> float:
+    return difflib.SequenceMatcher(None, a or '', b or '').ratio()
+
+
+def pair_elements(previous: List[Dict], current: List[Dict], previous_index: Optional[ElementIndex] = None, by_track_id: bool = False, min_iou: float = 0.3) -> Dict[int, int]:
+    """current id -> previous id of the elements that are the same element."""
+    if by_track_id:
+        previous_ids = {elem['track_id']: i for i, elem in enumerate(previous) if 'track_id' in elem}
+        return {j: previous_ids[elem['track_id']] for j, elem in enumerate(current) if elem.get('track_id') in previous_ids}
+    index = previous_index if previous_index is not None else ElementIndex(previous)
+    pairs = []
+    for j, elem in enumerate(current):
+        for i in index.in_region(elem['bbox']):
+            if previous[i]['type'] != elem['type']:
+                continue
+            iou = _iou(previous[i]['bbox'], elem['bbox'])
+            if iou >= min_iou:
+                pairs.append((iou + _similarity(previous[i]['content'], elem['content']), i, j))
+    pairs.sort(key=lambda pair: -pair[0])
+    paired, used = {}, set()
+    for _, i, j in pairs:
+        if j not in paired and i not in used:
+            paired[j] = i
+            used.add(i)
+    # text that moved without overlapping its old place (scrolling): same content, nearest first
+    for j, elem in enumerate(current):
+        if j in paired or elem['type'] != 'text' or not elem['content']:
+            continue
+        x, y = (elem['bbox'][0] + elem['bbox'][2]) / 2, (elem['bbox'][1] + elem['bbox'][3]) / 2
+        candidates = [i for i in index.find_text(elem['content'], match='exact') if i not in used and previous[i]['type'] == 'text']
+        if candidates:
+            i = min(candidates, key=lambda i: index.distance(i, x, y))
+            paired[j] = i
+            used.add(i)
+    return paired
+
+
+def diff_parses(previous: List[Dict], current: List[Dict], previous_index: Optional[ElementIndex] = None, by_track_id: bool = False, move_tolerance: float = 0.002) -> Dict:
+    """
+    The diff of `current` against `previous` (both parsed_content_lists). Boxes that moved by at most
+    `move_tolerance` on every side count as unmoved.
+    """
+    paired = pair_elements(previous, current, previous_index=previous_index, by_track_id=by_track_id)
+    added, moved, changed = [], [], []
+    for j, elem in enumerate(current):
+        if j not in paired:
+            added.append({'id': j, 'element': elem})
+            continue
+        i = paired[j]
+        prev = previous[i]
+        if max(abs(a - b) for a, b in zip(prev['bbox'], elem['bbox'])) > move_tolerance:
+            moved.append({'id': j, 'previous_id': i, 'element': elem, 'previous_bbox': prev['bbox']})
+        if prev['content'] != elem['content']:
+            changed.append({'id': j, 'previous_id': i, 'element': elem, 'previous_content': prev['content']})
+    matched = set(paired.values())
+    return {
+        'added': added,
+        'removed': [i for i in range(len(previous)) if i not in matched],
+        'moved': moved,
+        'changed': changed,
+        'id_map': paired,
+        'unchanged': len(paired) - len({entry['id'] for entry in moved + changed}),
+    }
+
+
+def apply_diff(previous: List[Dict], diff: Dict) -> List[Dict]:
+    """The current parsed_content_list from the previous one and `diff_parses`' result (also after a JSON round trip)."""
+    id_map = {int(j): i for j, i in diff['id_map'].items()}
+    updated = {entry['id']: entry['element'] for entry in diff['added'] + diff['moved'] + diff['changed']}
+    n = len(id_map) + len(diff['added'])
+    return [updated[j] if j in updated else previous[id_map[j]] for j in range(n)]
+
+
+def diff_screen_info(diff: Dict) -> str:
+    """Short text of the diff for an agent prompt, in the style of screen_info."""
+    def describe(elem):
+        return f"{'Text' if elem['type'] == 'text' else 'Icon'}: {elem['content']}"
+    lines = [f"Added ID: {entry['id']}, {describe(entry['element'])}" for entry in diff['added']]
+    lines += [f"Removed previous ID: {i}" for i in diff['removed']]
+    changed = {entry['id'] for entry in diff['changed']}
+    lines += [f"Moved ID: {entry['id']} (was {entry['previous_id']}), {describe(entry['element'])}" for entry in diff['moved'] if entry['id'] not in changed]
+    lines += [f"Changed ID: {entry['id']} (was {entry['previous_id']}), {describe(entry['element'])}, previously: {entry['previous_content']}" for entry in diff['changed']]
+    renumbered = [f'{i}->{j}' for j, i in sorted((int(j), i) for j, i in diff['id_map'].items()) if j != i]
+    if renumbered:
+        lines.append('Renumbered (previous->current ID): ' + ', '.join(renumbered))
+    return ''.join(line + '\n' for line in lines)
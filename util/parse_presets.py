@@ -0,0 +1,227 @@
+"""
+Named parse presets and per-request deadlines.
+
+A `ParsePreset` fixes the knobs that decide what a parse costs: EasyOCR's
+canvas size, the detector input size, the caption budget and how the
+annotated overlay is encoded. 'accurate' is what a parse without a preset
+does. With a deadline, `ParsePlanner` starts from the requested preset (default
+'accurate') and predicts each stage's time from per-megapixel costs learned on
+earlier parses. Then it walks a ladder of cheaper settings: JPEG overlay, a
+smaller OCR canvas, one detector pass instead of tiles, a smaller detector
+input. It stops once OCR, detection and annotation fit in `fixed_share` of the
+time that is left. Captions get a time budget of whatever remains. Each step taken is listed in the plan's
+`degradations`.
+"""
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from util.caption_budget import CaptionBudget
+from util.tiled_detect import tile_grid
+
+# EasyOCR's default canvas_size
+OCR_NATIVE_CANVAS = 2560
+
+
+class ParsePreset(object):
+    def __init__(self, name: str, ocr_canvas_size: int = OCR_NATIVE_CANVAS, yolo_imgsz: Optional[int] = None, max_captions: Optional[int] = None, caption_time_budget_ms: Optional[float] = None, overlay_format: str = 'PNG', overlay_quality: int = 90):
+        """
+        ocr_canvas_size: EasyOCR shrinks frames whose longer side exceeds this before detecting text.
+        yolo_imgsz: detector input size; None (or anything at least the detector's own size) keeps the detector's size.
+        max_captions, caption_time_budget_ms: as in CaptionBudget, None for no limit.
+        overlay_format: 'PNG' or 'JPEG' (with overlay_quality) for som_image_base64.
+        """
+        self.name = name
+        self.ocr_canvas_size = ocr_canvas_size
+        self.yolo_imgsz = yolo_imgsz
+        self.max_captions = max_captions
+        self.caption_time_budget_ms = caption_time_budget_ms
+        self.overlay_format = overlay_format
+        self.overlay_quality = overlay_quality
+
+
+PRESETS = {
+    'fast': ParsePreset('fast', ocr_canvas_size=1280, yolo_imgsz=640, caption_time_budget_ms=250, overlay_format='JPEG', overlay_quality=75),
+    'balanced': ParsePreset('balanced', ocr_canvas_size=1920, yolo_imgsz=960, caption_time_budget_ms=1000, overlay_format='JPEG', overlay_quality=90),
+    'accurate': ParsePreset('accurate'),
+}
+
+# cheaper settings tried in order under a deadline; each is kept only if it is cheaper than the current setting
+OCR_CANVAS_LADDER = (1920, 1280, 960)
+YOLO_IMGSZ_LADDER = (960, 640)
+
+
+def detector_imgsz(model) -> int:
+    """Input size the detector runs at when none is given (ultralytics keeps the training imgsz in `overrides`)."""
+    imgsz = (getattr(model, 'overrides', None) or {}).get('imgsz') or 640
+    return max(imgsz) if isinstance(imgsz, (list, tuple)) else int(imgsz)
+
+
+class ParsePlan(object):
+    """Settings chosen for one parse."""
+
+    def __init__(self, preset: ParsePreset, image_size: Tuple[int, int], detector_size: int, detect_tile: Optional[int] = None, detect_tile_overlap: int = 160, ocr_mode: str = 'full'):
+        self.preset = preset.name
+        self.image_size = image_size
+        # 'full' or 'recognize' (util/ocr_engine.py); the canvas size only applies to 'full'
+        self.ocr_mode = ocr_mode
+        self.ocr_canvas_size = preset.ocr_canvas_size
+        # None: the detector's own size
+        self.yolo_imgsz = preset.yolo_imgsz if preset.yolo_imgsz and preset.yolo_imgsz < detector_size else None
+        self.detector_size = detector_size
+        # tiled detection (util/tiled_detect.py) with this tile size, None for one pass over the frame
+        self.detect_tile = detect_tile
+        self.detect_tile_overlap = detect_tile_overlap
+        self.max_captions = preset.max_captions
+        self.caption_time_budget_ms = preset.caption_time_budget_ms
+        self.overlay_format = preset.overlay_format
+        self.overlay_quality = preset.overlay_quality
+        self.degradations: List[str] = []
+
+    @property
+    def ocr_megapixels(self) -> float:
+        w, h = self.image_size
+        if self.ocr_mode != 'full':
+            return w * h / 1e6
+        shrink = min(1.0, self.ocr_canvas_size / max(w, h))
+        return w * h * shrink * shrink / 1e6
+
+    @property
+    def detect_megapixels(self) -> float:
+        w, h = self.image_size
+        if self.detect_tile:
+            side = min(self.yolo_imgsz or self.detect_tile, self.detect_tile)
+            return len(tile_grid(w, h, self.detect_tile, self.detect_tile_overlap)) * side * side / 1e6
+        side = self.yolo_imgsz or self.detector_size
+        # letterboxed to side on the longer edge
+        return side * side * min(w, h) / max(w, h) / 1e6
+
+    @property
+    def ocr_cost_key(self) -> str:
+        """Key of the planner's per-megapixel OCR cost, which differs per mode."""
+        return 'ocr' if self.ocr_mode == 'full' else 'ocr_' + self.ocr_mode
+
+    @property
+    def frame_megapixels(self) -> float:
+        return self.image_size[0] * self.image_size[1] / 1e6
+
+    @property
+    def easyocr_args(self) -> Dict:
+        args = {'text_threshold': 0.8}
+        if self.ocr_canvas_size != OCR_NATIVE_CANVAS:
+            args['canvas_size'] = self.ocr_canvas_size
+        return args
+
+    def caption_budget(self, requested: Optional[CaptionBudget] = None) -> Optional[CaptionBudget]:
+        """The request's caption budget tightened by this plan's limits (None if neither limits anything)."""
+        max_captions, time_budget_ms = self.max_captions, self.caption_time_budget_ms
+        focus_points = []
+        if requested is not None:
+            max_captions = _min(max_captions, requested.max_captions)
+            time_budget_ms = _min(time_budget_ms, requested.time_budget_ms)
+            focus_points = requested.focus_points
+        if max_captions is None and time_budget_ms is None and not focus_points:
+            return None
+        return CaptionBudget(max_captions=max_captions, time_budget_ms=time_budget_ms, focus_points=focus_points)
+
+    def to_dict(self) -> Dict:
+        return {
+            'preset': self.preset,
+            'ocr_mode': self.ocr_mode,
+            'ocr_canvas_size': self.ocr_canvas_size,
+            'yolo_imgsz': self.yolo_imgsz or self.detect_tile or self.detector_size,
+            'detect_tile': self.detect_tile,
+            'max_captions': self.max_captions,
+            'caption_time_budget_ms': self.caption_time_budget_ms,
+            'overlay_format': self.overlay_format,
+            'degradations': list(self.degradations),
+        }
+
+
+def _min(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+
+class ParsePlanner(object):
+    # seconds per megapixel before anything was measured (CPU-like, so a cold deadline errs on the fast side)
+    PRIORS = {'ocr': 1.0, 'ocr_recognize': 0.4, 'detect': 0.3, 'annotate_PNG': 0.06, 'annotate_JPEG': 0.02}
+
+    def __init__(self, fixed_share: float = 0.6, smoothing: float = 0.3):
+        """
+        fixed_share: share of the remaining deadline OCR, detection and annotation may take; captions get the rest.
+        """
+        self.fixed_share = fixed_share
+        self.smoothing = smoothing
+        self.seconds_per_megapixel = dict(self.PRIORS)
+        self._lock = threading.Lock()
+
+    def predict_seconds(self, plan: ParsePlan) -> float:
+        with self._lock:
+            costs = dict(self.seconds_per_megapixel)
+        return (costs[plan.ocr_cost_key] * plan.ocr_megapixels
+                + costs['detect'] * plan.detect_megapixels
+                + costs['annotate_' + plan.overlay_format] * plan.frame_megapixels)
+
+    def plan(self, preset: str, image_size: Tuple[int, int], detector_size: int, deadline_ms: Optional[float] = None, elapsed_ms: float = 0.0, detect_tile: Optional[int] = None, detect_tile_overlap: int = 160, ocr_mode: str = 'full') -> ParsePlan:
+        if preset not in PRESETS:
+            raise ValueError(f'Unknown preset {preset}, expected one of {sorted(PRESETS)}')
+        plan = ParsePlan(PRESETS[preset], image_size, detector_size, detect_tile=detect_tile, detect_tile_overlap=detect_tile_overlap, ocr_mode=ocr_mode)
+        if deadline_ms is None:
+            return plan
+        remaining = max(deadline_ms - elapsed_ms, 0.0) / 1000
+        for step in self._ladder(plan):
+            if self.predict_seconds(plan) <= self.fixed_share * remaining:
+                break
+            step()
+        caption_seconds = max(remaining - self.predict_seconds(plan), 0.0)
+        if plan.caption_time_budget_ms is None or caption_seconds * 1000 < plan.caption_time_budget_ms:
+            plan.caption_time_budget_ms = caption_seconds * 1000
+            plan.degradations.append(f'caption_time_budget_ms={plan.caption_time_budget_ms:.0f}')
+        return plan
+
+    @staticmethod
+    def _ladder(plan: ParsePlan):
+        def overlay_jpeg():
+            plan.overlay_format, plan.overlay_quality = 'JPEG', 80
+            plan.degradations.append('overlay_format=JPEG')
+
+        def ocr_canvas(size):
+            def step():
+                plan.ocr_canvas_size = size
+                plan.degradations.append(f'ocr_canvas_size={size}')
+            return step
+
+        def single_pass():
+            plan.detect_tile = None
+            plan.degradations.append('detect_tile=off')
+
+        def yolo_imgsz(size):
+            def step():
+                plan.yolo_imgsz = size
+                plan.degradations.append(f'yolo_imgsz={size}')
+            return step
+
+        steps = []
+        if plan.overlay_format != 'JPEG':
+            steps.append(overlay_jpeg)
+        if plan.ocr_mode == 'full':
+            steps.extend(ocr_canvas(size) for size in OCR_CANVAS_LADDER if size < plan.ocr_canvas_size)
+        if plan.detect_tile:
+            steps.append(single_pass)
+        # after single_pass, the detector runs at its own size
+        steps.extend(yolo_imgsz(size) for size in YOLO_IMGSZ_LADDER if size < (plan.yolo_imgsz or plan.detector_size))
+        return steps
+
+    def observe(self, plan: ParsePlan, timings: Dict):
+        """Update the per-megapixel costs from the stage timings of a parse run with `plan`."""
+        measured = {'ocr': plan.ocr_megapixels, 'detect': plan.detect_megapixels, 'annotate': plan.frame_megapixels}
+        with self._lock:
+            for stage, megapixels in measured.items():
+                if stage not in timings or megapixels <= 0:
+                    continue
+                key = {'ocr': plan.ocr_cost_key, 'annotate': 'annotate_' + plan.overlay_format}.get(stage, stage)
+                cost = timings[stage] / megapixels
+                self.seconds_per_megapixel[key] += self.smoothing * (cost - self.seconds_per_megapixel[key])
@@ -0,0 +1,49 @@
+"""
+Recent parse results kept in memory under a parse id, so follow-up requests
+(deferred captions, queries, diffs) can refer to a parse without resending
+the screenshot.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from util.frame import Frame
+
+
+class StoredParse(object):
+    def __init__(self, image: Frame, parsed_content_list: List[Dict], som_image_base64: str, session_id: Optional[str] = None, ui_tree: Optional[Dict] = None):
+        self.parse_id = uuid.uuid4().hex
+        self.created = time.time()
+        self.image = image
+        self.parsed_content_list = parsed_content_list
+        self.som_image_base64 = som_image_base64
+        self.session_id = session_id
+        # containment tree (util/ui_tree.py), built on first use unless the parse asked for it
+        self.ui_tree = ui_tree
+        # lookup indexes (util/element_index.py), built on the first query and dropped when captions change
+        self.element_index = None
+
+
+class ParseStore(object):
+    """LRU of the last `max_items` parses (each holds its screenshot, so keep this small)."""
+
+    def __init__(self, max_items: int = 8):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, stored: StoredParse) -> str:
+        with self._lock:
+            self._items[stored.parse_id] = stored
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return stored.parse_id
+
+    def get(self, parse_id: str) -> Optional[StoredParse]:
+        with self._lock:
+            stored = self._items.get(parse_id)
+            if stored is not None:
+                self._items.move_to_end(parse_id)
+            return stored
@@ -0,0 +1,157 @@
+"""
+On-demand profiling of a single parse.
+
+`profile_call` runs a function under cProfile (deterministic call counts and
+timings, rendered as pstats text) together with a low-rate stack sampler on the
+same thread (rendered as collapsed stacks for flamegraph.pl / speedscope /
+inferno). torch.profiler can be layered on top to see operator-level time.
+"""
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Callable, Optional, Tuple
+
+# sort orders pstats accepts: the pstats.SortKey values and their aliases (tottime, cumtime, ...)
+PSTATS_SORT_KEYS = tuple(sorted(pstats.Stats.sort_arg_dict_default))
+
+
+class StackSampler(threading.Thread):
+    """Samples the Python stack of one thread at a fixed interval and counts identical stacks."""
+
+    def __init__(self, target_thread_id: int, interval: float = 0.005):
+        super().__init__(daemon=True)
+        self.target_thread_id = target_thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target_thread_id)
+            names = []
+            while frame is not None:
+                names.append(self._frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class ProfileResult(object):
+    def __init__(self, stats: pstats.Stats, stacks: Counter, wall_time: float, sample_interval: float, torch_table: Optional[str] = None, torch_stacks: Optional[str] = None):
+        self.profile_id = uuid.uuid4().hex
+        self.created = time.time()
+        self.wall_time = wall_time
+        self.sample_interval = sample_interval
+        self.stats = stats
+        self.stacks = stacks
+        self.torch_table = torch_table
+        self.torch_stacks = torch_stacks
+
+    def pstats_text(self, sort: str = 'cumulative', limit: int = 80) -> str:
+        stream = io.StringIO()
+        stats = pstats.Stats(stream=stream)
+        stats.add(self.stats)
+        stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def pstats_raw(self) -> bytes:
+        """Same bytes as `Stats.dump_stats`, loadable by snakeviz/gprof2dot/pstats."""
+        return marshal.dumps(self.stats.stats)
+
+    def collapsed_text(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def summary(self) -> dict:
+        return {
+            'profile_id': self.profile_id,
+            'created': self.created,
+            'wall_time': self.wall_time,
+            'samples': sum(self.stacks.values()),
+            'sample_interval': self.sample_interval,
+            'has_torch': self.torch_table is not None,
+        }
+
+
+def _torch_profiler():
+    try:
+        import torch
+    except ImportError:
+        return None
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    return torch.profiler.profile(activities=activities, with_stack=True, record_shapes=False)
+
+
+def profile_call(fn: Callable, *args, use_torch: bool = False, sample_interval: float = 0.005, **kwargs) -> Tuple[object, ProfileResult]:
+    """Run `fn(*args, **kwargs)` under cProfile and the stack sampler (plus torch.profiler if requested)."""
+    torch_prof = _torch_profiler() if use_torch else None
+    sampler = StackSampler(threading.get_ident(), interval=sample_interval)
+    profiler = cProfile.Profile()
+    start = time.time()
+    if torch_prof is not None:
+        torch_prof.__enter__()
+    sampler.start()
+    profiler.enable()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+        sampler.stop()
+        if torch_prof is not None:
+            torch_prof.__exit__(None, None, None)
+    wall_time = time.time() - start
+
+    torch_table, torch_stacks = None, None
+    if torch_prof is not None:
+        torch_table = torch_prof.key_averages().table(sort_by='self_cpu_time_total', row_limit=60)
+        fd, path = tempfile.mkstemp(suffix='.stacks')
+        os.close(fd)
+        try:
+            torch_prof.export_stacks(path, 'self_cpu_time_total')
+            with open(path) as f:
+                torch_stacks = f.read()
+        finally:
+            os.remove(path)
+    return result, ProfileResult(pstats.Stats(profiler), sampler.stacks, wall_time, sample_interval, torch_table, torch_stacks)
+
+
+class ProfileStore(object):
+    """Keeps the most recent `max_items` profiles, addressable by profile id."""
+
+    def __init__(self, max_items: int = 32):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, result: ProfileResult) -> str:
+        with self._lock:
+            self._items[result.profile_id] = result
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return result.profile_id
+
+    def get(self, profile_id: str) -> Optional[ProfileResult]:
+        with self._lock:
+            return self._items.get(profile_id)
+
+    def list(self):
+        with self._lock:
+            return [item.summary() for item in self._items.values()]
@@ -0,0 +1,73 @@
+"""
+Regions of interest for partial parses.
+
+A region parse runs OCR and detection only on the given rectangles of the
+screenshot, then filters, captions and annotates against the full frame, so
+elements come back in full-frame ratio coordinates with the usual ids.
+Regions are given as xyxy ratios, or as a window title that is looked up in
+the VM server's `/windows/list` (screen pixel coordinates).
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+
+class WindowNotFoundError(LookupError):
+    """No window on the VM matches the requested title."""
+
+
+def clip_regions(regions: Sequence[Sequence[float]], image_size: Tuple[int, int], min_size: int = 8) -> List[Tuple[int, int, int, int]]:
+    """
+    Pixel (x0, y0, x1, y1) rectangles for xyxy ratio `regions`, clipped to the frame. Overlapping
+    regions are merged into their bounding box so nothing is read twice; regions under `min_size`
+    pixels on a side are dropped.
+    """
+    w, h = image_size
+    boxes = []
+    for region in regions:
+        if len(region) != 4:
+            raise ValueError(f'A region is [x1, y1, x2, y2] in ratios, got {list(region)}')
+        x0, y0, x1, y1 = region
+        box = (max(int(x0 * w), 0), max(int(y0 * h), 0), min(int(round(x1 * w)), w), min(int(round(y1 * h)), h))
+        if box[2] - box[0] >= min_size and box[3] - box[1] >= min_size:
+            boxes.append(box)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+
+def find_window(windows: List[Dict], title: str) -> Optional[Dict]:
+    """Exact (case-insensitive) title match first, then substring matches, preferring the active window."""
+    query = title.lower()
+    exact = [w for w in windows if w.get('title', '').lower() == query]
+    partial = [w for w in windows if query in w.get('title', '').lower() and w.get('width', 0) > 0 and w.get('height', 0) > 0]
+    for candidates in (exact, partial):
+        if candidates:
+            return sorted(candidates, key=lambda w: not w.get('active', False))[0]
+    return None
+
+
+def window_region(windows_host_url: str, title: str, image_size: Tuple[int, int], timeout: float = 5.0) -> List[float]:
+    """
+    xyxy ratio rectangle of the window titled `title`, from the VM server's `/windows/list`. Raises
+    WindowNotFoundError when no window matches and requests' exceptions when the server is unreachable.
+    """
+    response = requests.get(f"{windows_host_url.rstrip('/')}/windows/list", timeout=timeout)
+    response.raise_for_status()
+    window = find_window(response.json().get('windows', []), title)
+    if window is None:
+        raise WindowNotFoundError(f'No window found matching: {title}')
+    w, h = image_size
+    # window positions are screen pixels, the same space as the screenshot
+    return [window['left'] / w, window['top'] / h, (window['left'] + window['width']) / w, (window['top'] + window['height']) / h]
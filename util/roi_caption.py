@@ -0,0 +1,118 @@
+"""
+Experimental Florence-2 caption mode sharing one vision pass across all icons.
+
+The default path crops every icon, resizes it to the processor's 768x768 input
+and runs the DaViT vision tower once per icon. `RoiCaptioner` instead runs the
+tower over the whole screenshot (upscaled by `scale` and cut into 768px tiles),
+stitches the unpooled token grids into one feature map with stride 32, and
+`roi_align`s an `roi_size` x `roi_size` grid of features for each icon box.
+Those grids go through the same position embedding, pooling, projection and
+norm as `Florence2ForConditionalGeneration._encode_image` and are decoded with
+the language model as usual. Small icons cover only a few feature cells, so
+captions are less precise than per-crop ones; see benchmarks/bench_roi_caption.py.
+"""
+from typing import List, Optional, Sequence
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from torchvision.ops import roi_align
+
+
+class RoiCaptioner(object):
+    def __init__(self, caption_model_processor, scale: float = 2.0, roi_size: int = 8, tile: int = 768):
+        """
+        scale: the screenshot is upscaled by this much before encoding, so small icons span more feature cells.
+        roi_size: side of the feature grid pooled per icon (the per-crop path yields 24x24).
+        tile: encoder input size; must be what the vision tower and position embedding were trained on.
+        """
+        self.model = caption_model_processor['model']
+        self.processor = caption_model_processor['processor']
+        if not self.supports(self.model):
+            raise ValueError(f'{self.model.config.name_or_path} does not expose Florence-2 vision tower internals, roi caption mode needs florence2')
+        self.scale = scale
+        self.roi_size = roi_size
+        self.tile = tile
+        image_processor = self.processor.image_processor
+        self.mean = torch.tensor(image_processor.image_mean).view(1, 3, 1, 1)
+        self.std = torch.tensor(image_processor.image_std).view(1, 3, 1, 1)
+        self._prompt_ids = {}
+
+    @staticmethod
+    def supports(model) -> bool:
+        return all(hasattr(model, attr) for attr in ('vision_tower', 'image_projection', 'image_proj_norm', '_merge_input_ids_with_image_features', 'language_model')) \
+            and hasattr(model.vision_tower, 'forward_features_unpool')
+
+    def grid(self, height: int, width: int):
+        """(rows, cols) of encoder tiles covering a height x width screenshot after scaling."""
+        return -(-int(round(height * self.scale)) // self.tile), -(-int(round(width * self.scale)) // self.tile)
+
+    @torch.inference_mode()
+    def encode_frame(self, image_source: np.ndarray) -> torch.Tensor:
+        """(1, C, H/32, W/32) unpooled vision features of the whole (scaled) screenshot."""
+        device, dtype = self.model.device, self.model.dtype
+        pixels = torch.from_numpy(np.ascontiguousarray(image_source)).permute(2, 0, 1).unsqueeze(0).float().div_(255)
+        rows, cols = self.grid(pixels.shape[2], pixels.shape[3])
+        height, width = int(round(pixels.shape[2] * self.scale)), int(round(pixels.shape[3] * self.scale))
+        pixels = F.interpolate(pixels, size=(height, width), mode='bilinear', align_corners=False)
+        pixels = (pixels - self.mean) / self.std
+        pixels = F.pad(pixels, (0, cols * self.tile - width, 0, rows * self.tile - height))
+        tiles = pixels.unfold(2, self.tile, self.tile).unfold(3, self.tile, self.tile)  # 1, 3, rows, cols, tile, tile
+        tiles = tiles.permute(0, 2, 3, 1, 4, 5).reshape(rows * cols, 3, self.tile, self.tile)
+        features = self.model.vision_tower.forward_features_unpool(tiles.to(device=device, dtype=dtype))
+        side = int(features.shape[1] ** 0.5)
+        channels = features.shape[2]
+        features = features.view(rows, cols, side, side, channels).permute(4, 0, 2, 1, 3).reshape(1, channels, rows * side, cols * side)
+        return features
+
+    def _pool(self, features: torch.Tensor, boxes: Sequence[Sequence[float]], image_size) -> torch.Tensor:
+        height, width = image_size
+        side = features.shape[3] // self.grid(height, width)[1]
+        # a feature cell covers tile / side scaled pixels
+        cells_per_pixel = side / self.tile * self.scale
+        rois = torch.tensor([[0, x1 * width, y1 * height, x2 * width, y2 * height] for x1, y1, x2, y2 in boxes], dtype=torch.float32, device=features.device)
+        pooled = roi_align(features.float(), rois, output_size=self.roi_size, spatial_scale=cells_per_pixel, sampling_ratio=2, aligned=True)
+        return pooled.to(features.dtype).permute(0, 2, 3, 1)  # N, roi, roi, C
+
+    def _project(self, x: torch.Tensor) -> torch.Tensor:
+        """Mirror of the post-tower part of `_encode_image` for (N, h, w, C) grids."""
+        model = self.model
+        n, h, w, channels = x.shape
+        if model.image_pos_embed is not None:
+            x = x + model.image_pos_embed(x)
+        x = x.view(n, 1, h * w, channels)
+        if model.visual_temporal_embed is not None:
+            x = x + model.visual_temporal_embed(x[:, :, 0]).view(1, 1, 1, channels)
+        feats = {'spatial_avg_pool': x.mean(dim=2), 'temporal_avg_pool': x.mean(dim=1), 'last_frame': x[:, -1]}
+        x = torch.cat([feats[source] for source in model.image_feature_source], dim=1)
+        x = x @ model.image_projection
+        return model.image_proj_norm(x)
+
+    def _input_ids(self, prompt: str) -> torch.Tensor:
+        if prompt not in self._prompt_ids:
+            # the processor expands task tokens like <CAPTION> into the instruction text; it needs an image to run
+            inputs = self.processor(text=[prompt], images=[Image.new('RGB', (32, 32))], return_tensors='pt')
+            self._prompt_ids[prompt] = inputs['input_ids']
+        return self._prompt_ids[prompt].to(self.model.device)
+
+    @torch.inference_mode()
+    def caption(self, image_source: np.ndarray, boxes: Sequence[Sequence[float]], features: Optional[torch.Tensor] = None, prompt: Optional[str] = None, batch_size: int = 128) -> List[str]:
+        """Captions for ratio xyxy `boxes`; pass `features` from `encode_frame` to reuse them across calls."""
+        if not len(boxes):
+            return []
+        if features is None:
+            features = self.encode_frame(image_source)
+        model = self.model
+        input_ids = self._input_ids(prompt or '<CAPTION>')
+        generated_texts = []
+        for i in range(0, len(boxes), batch_size):
+            batch = boxes[i:i + batch_size]
+            image_features = self._project(self._pool(features, batch, image_source.shape[:2]))
+            inputs_embeds = model.get_input_embeddings()(input_ids.expand(len(batch), -1))
+            inputs_embeds, attention_mask = model._merge_input_ids_with_image_features(image_features, inputs_embeds)
+            # use_cache=False matches the per-crop path (newer transformers versions)
+            generated_ids = model.language_model.generate(input_ids=None, inputs_embeds=inputs_embeds, attention_mask=attention_mask, max_new_tokens=20, num_beams=1, do_sample=False, use_cache=False)
+            generated_text = self.processor.batch_decode(generated_ids, skip_special_tokens=True)
+            generated_texts.extend(gen.strip() for gen in generated_text)
+        return generated_texts
@@ -0,0 +1,185 @@
+"""
+Shared-memory frame ring for co-located clients and parse servers.
+
+The client copies raw RGB frames into one of `num_slots` fixed-size slots of a
+named shared memory block and sends only (name, slot, seq) over HTTP; the
+server attaches to the block once and copies the frame out of its slot,
+skipping PNG encoding, base64, the HTTP body and image decoding.
+
+Layout (all uint64):
+    [magic, version, num_slots, slot_bytes]      ring header
+    [seq, width, height, channels] * num_slots   slot headers
+    padding to 64 bytes, then num_slots * slot_bytes of pixel data
+A slot's seq is zeroed while it is being written, so a reader can detect a
+frame that was overwritten (or is half written) by comparing seq.
+"""
+import itertools
+import os
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from typing import Dict, Optional
+
+import numpy as np
+
+MAGIC = 0x4F4D4E4952494E47  # 'OMNIRING'
+VERSION = 1
+NAME_PREFIX = 'omniparser_'
+DEFAULT_SLOT_BYTES = 3840 * 2160 * 3
+# where POSIX shared memory blocks are visible as files (Linux)
+SHM_DIR = '/dev/shm'
+
+
+class StaleFrameError(RuntimeError):
+    """The slot no longer holds the requested frame."""
+
+
+def _block_id(name: str) -> Optional[int]:
+    """Inode of the named block, None if it is gone or blocks are not visible as files."""
+    try:
+        return os.stat(os.path.join(SHM_DIR, name)).st_ino
+    except OSError:
+        return None
+
+
+def _data_offset(num_slots: int) -> int:
+    offset = 4 * 8 + num_slots * 4 * 8
+    return (offset + 63) // 64 * 64
+
+
+class FrameRing(object):
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((4,), dtype=np.uint64, buffer=shm.buf)
+        if int(self.header[0]) != MAGIC or int(self.header[1]) != VERSION:
+            raise ValueError(f'{shm.name} is not a frame ring')
+        self.num_slots = int(self.header[2])
+        self.slot_bytes = int(self.header[3])
+        self.slots = np.ndarray((self.num_slots, 4), dtype=np.uint64, buffer=shm.buf, offset=4 * 8)
+        self.data = np.ndarray((self.num_slots, self.slot_bytes), dtype=np.uint8, buffer=shm.buf, offset=_data_offset(self.num_slots))
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @classmethod
+    def create(cls, num_slots: int = 3, slot_bytes: int = DEFAULT_SLOT_BYTES, name: Optional[str] = None) -> 'FrameRing':
+        name = name or f'{NAME_PREFIX}{uuid.uuid4().hex[:12]}'
+        size = _data_offset(num_slots) + num_slots * slot_bytes
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((4,), dtype=np.uint64, buffer=shm.buf)
+        header[:] = (MAGIC, VERSION, num_slots, slot_bytes)
+        np.ndarray((num_slots, 4), dtype=np.uint64, buffer=shm.buf, offset=4 * 8)[:] = 0
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'FrameRing':
+        if not name.startswith(NAME_PREFIX):
+            raise ValueError(f'Refusing to attach to shared memory {name!r}')
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=name)
+            # before 3.13 the resource tracker would unlink the client's block when this process exits
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(shm._name, 'shared_memory')
+            except Exception:
+                pass
+        return cls(shm, owner=False)
+
+    def write(self, frame: np.ndarray) -> Dict:
+        """Copy an (H, W, 3) uint8 frame into the next slot; returns the reference to send to the server."""
+        if frame.dtype != np.uint8 or frame.ndim != 3:
+            raise ValueError(f'Expected an (H, W, C) uint8 frame, got {frame.shape} {frame.dtype}')
+        height, width, channels = frame.shape
+        if height * width * channels > self.slot_bytes:
+            raise ValueError(f'Frame of {height * width * channels} bytes exceeds slot size {self.slot_bytes}')
+        with self._lock:
+            seq = next(self._seq)
+            slot = seq % self.num_slots
+            self.slots[slot, 0] = 0
+            self.data[slot, :height * width * channels].reshape(height, width, channels)[...] = frame
+            self.slots[slot, 1:] = (width, height, channels)
+            self.slots[slot, 0] = seq
+        return {'name': self.name, 'slot': slot, 'seq': seq, 'width': width, 'height': height}
+
+    def read(self, slot: int, seq: int) -> np.ndarray:
+        """Read-only view of the frame in its slot; copy it and then call `check` to detect overwrites."""
+        self.check(slot, seq)
+        width, height, channels = (int(v) for v in self.slots[slot, 1:])
+        view = self.data[slot, :height * width * channels].reshape(height, width, channels)
+        view.flags.writeable = False
+        return view
+
+    def check(self, slot: int, seq: int):
+        if not 0 <= slot < self.num_slots:
+            raise StaleFrameError(f'Slot {slot} out of range')
+        if int(self.slots[slot, 0]) != seq:
+            raise StaleFrameError(f'Slot {slot} holds seq {int(self.slots[slot, 0])}, expected {seq}')
+
+    def close(self):
+        # numpy views keep the buffer exported; drop them before closing the mapping
+        self.header = self.slots = self.data = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class FrameRingReader(object):
+    """
+    Server-side cache of attached rings, keyed by shared memory name. At most `max_rings` stay mapped,
+    the least recently used is closed first. Where blocks are visible in SHM_DIR, a ring whose block
+    was unlinked (or replaced by a new block of the same name) is closed on the next lookup.
+    """
+
+    def __init__(self, max_rings: int = 8):
+        self.max_rings = max(1, max_rings)
+        # name -> (ring, inode of its block or None)
+        self._rings: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._track_blocks = os.path.isdir(SHM_DIR)
+
+    def __len__(self) -> int:
+        return len(self._rings)
+
+    def get(self, name: str) -> FrameRing:
+        closing = []
+        with self._lock:
+            if self._track_blocks:
+                for stale in [n for n, (_, block) in self._rings.items() if block is not None and _block_id(n) != block]:
+                    closing.append(self._rings.pop(stale)[0])
+            entry = self._rings.get(name)
+            if entry is None:
+                ring = FrameRing.attach(name)
+                self._rings[name] = (ring, _block_id(name) if self._track_blocks else None)
+            else:
+                ring = entry[0]
+            self._rings.move_to_end(name)
+            while len(self._rings) > self.max_rings:
+                closing.append(self._rings.popitem(last=False)[1][0])
+        for old in closing:
+            self._close(old)
+        return ring
+
+    def drop(self, name: str):
+        with self._lock:
+            entry = self._rings.pop(name, None)
+        if entry is not None:
+            self._close(entry[0])
+
+    @staticmethod
+    def _close(ring: FrameRing):
+        try:
+            ring.close()
+        except BufferError:
+            # a request still holds a view of it; the mapping is released when that view is collected
+            pass
@@ -0,0 +1,141 @@
+"""
+Synthetic GUI screenshot generator.
+
+Produces deterministic (seeded) screens with known element boxes so the parsing
+pipeline can be exercised at controlled resolutions and element densities
+without real screenshots. Layouts:
+    text_rows       - a document-like page of text lines
+    icon_grid       - a launcher/toolbar-like grid of icons with labels
+    nested_windows  - overlapping windows, each with a title bar, toolbar and content
+    mixed           - a desktop: taskbar + nested windows + icon grid + text
+"""
+import random
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+LAYOUTS = ('text_rows', 'icon_grid', 'nested_windows', 'mixed')
+
+_WORDS = ['File', 'Edit', 'View', 'Insert', 'Format', 'Tools', 'Help', 'Save', 'Open', 'Close', 'Settings',
+          'Search', 'Account', 'Share', 'Export', 'Print', 'Undo', 'Redo', 'Copy', 'Paste', 'Delete', 'Rename',
+          'Properties', 'Refresh', 'Download', 'Upload', 'Cancel', 'Apply', 'OK', 'Next', 'Back', 'Finish']
+
+
+def _font(size: int):
+    try:
+        return ImageFont.truetype('DejaVuSans.ttf', size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+class _Canvas(object):
+    def __init__(self, width: int, height: int, rng: random.Random, background=(245, 245, 245), scale: Optional[float] = None):
+        self.image = Image.new('RGB', (width, height), background)
+        self.draw = ImageDraw.Draw(self.image)
+        self.rng = rng
+        self.elements: List[Dict] = []
+        self.scale = scale or max(width, height) / 1920
+
+    def text(self, x: int, y: int, size: int = 14, words: int = 2, color=(20, 20, 20)):
+        size = max(int(size * self.scale), 8)
+        content = ' '.join(self.rng.choice(_WORDS) for _ in range(words))
+        font = _font(size)
+        self.draw.text((x, y), content, fill=color, font=font)
+        x1, y1, x2, y2 = self.draw.textbbox((x, y), content, font=font)
+        self.elements.append({'type': 'text', 'bbox': [x1, y1, x2, y2], 'content': content})
+        return x2, y2
+
+    def icon(self, x: int, y: int, size: int = 24):
+        size = max(int(size * self.scale), 8)
+        color = tuple(self.rng.randint(30, 220) for _ in range(3))
+        shape = self.rng.choice(('rect', 'ellipse', 'triangle', 'glyph'))
+        box = [x, y, x + size, y + size]
+        if shape == 'rect':
+            self.draw.rounded_rectangle(box, radius=size // 5, fill=color)
+        elif shape == 'ellipse':
+            self.draw.ellipse(box, fill=color)
+        elif shape == 'triangle':
+            self.draw.polygon([(x + size // 2, y), (x + size, y + size), (x, y + size)], fill=color)
+        else:
+            self.draw.rectangle(box, outline=color, width=max(size // 8, 1))
+            self.draw.line([x + size // 4, y + size // 2, x + 3 * size // 4, y + size // 2], fill=color, width=max(size // 8, 1))
+        self.elements.append({'type': 'icon', 'bbox': box, 'content': shape})
+        return box
+
+    def window(self, x1: int, y1: int, x2: int, y2: int, density: float):
+        title_h = max(int(30 * self.scale), 12)
+        # elements the new window paints over are no longer visible
+        self.elements = [e for e in self.elements if not (x1 <= (e['bbox'][0] + e['bbox'][2]) / 2 <= x2 and y1 <= (e['bbox'][1] + e['bbox'][3]) / 2 <= y2)]
+        self.draw.rectangle([x1, y1, x2, y2], fill=(255, 255, 255), outline=(120, 120, 120))
+        self.draw.rectangle([x1, y1, x2, y1 + title_h], fill=(225, 230, 240))
+        self.elements.append({'type': 'window', 'bbox': [x1, y1, x2, y2], 'content': None})
+        self.text(x1 + title_h, y1 + title_h // 4, size=13, words=2)
+        for i in range(3):
+            self.icon(x2 - (i + 1) * title_h, y1 + title_h // 5, size=18)
+        toolbar_y = y1 + title_h + 4
+        x = x1 + 6
+        while x + title_h < x2 and self.rng.random() < 0.35 + 0.6 * density:
+            self.icon(x, toolbar_y, size=22)
+            x += int(title_h * 1.4)
+        self.text_rows(x1 + 10, toolbar_y + title_h + 6, x2 - 10, y2 - 6, density)
+
+    def text_rows(self, x1: int, y1: int, x2: int, y2: int, density: float):
+        line_h = max(int(24 * self.scale), 10)
+        y = y1
+        while y + line_h < y2:
+            if self.rng.random() < density:
+                words = self.rng.randint(1, max(2, int((x2 - x1) / (90 * self.scale))))
+                self.text(x1, y, size=14, words=min(words, 12))
+            y += line_h
+
+    def icon_grid(self, x1: int, y1: int, x2: int, y2: int, density: float, labels: bool = True):
+        cell = max(int(96 * self.scale / max(density, 0.1) ** 0.5), 24)
+        for gy in range(y1, y2 - cell, cell):
+            for gx in range(x1, x2 - cell, cell):
+                if self.rng.random() < density:
+                    box = self.icon(gx + cell // 4, gy + cell // 8, size=int(cell * 0.45 / self.scale))
+                    if labels:
+                        self.text(gx + cell // 8, box[3] + 2, size=11, words=1)
+
+
+def generate_screen(width: int = 1920, height: int = 1080, layout: str = 'mixed', density: float = 0.5, seed: int = 0, ui_scale: Optional[float] = None) -> Tuple[Image.Image, List[Dict]]:
+    """
+    Returns (RGB image, elements). Elements carry pixel xyxy boxes and a type in
+    {'text', 'icon', 'window'}; `density` in (0, 1] scales how many are drawn.
+    `ui_scale` sizes elements like display scaling (1.0 = 1080p sizes); by default
+    they grow with the resolution.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f'Unknown layout {layout}, expected one of {LAYOUTS}')
+    rng = random.Random(f'{width}x{height}-{layout}-{density}-{seed}')
+    canvas = _Canvas(width, height, rng, scale=ui_scale)
+    if layout == 'text_rows':
+        canvas.text_rows(int(0.05 * width), int(0.05 * height), int(0.95 * width), int(0.95 * height), density)
+    elif layout == 'icon_grid':
+        canvas.icon_grid(0, 0, width, height, density)
+    elif layout == 'nested_windows':
+        n_windows = 1 + int(4 * density)
+        for i in range(n_windows):
+            w = rng.randint(width // 3, int(width * 0.8))
+            h = rng.randint(height // 3, int(height * 0.8))
+            x = rng.randint(0, width - w)
+            y = rng.randint(0, height - h)
+            canvas.window(x, y, x + w, y + h, density)
+    else:
+        taskbar_h = max(int(48 * canvas.scale), 16)
+        canvas.icon_grid(0, 0, width // 6, height - taskbar_h, density)
+        canvas.window(width // 5, height // 12, int(width * 0.7), int(height * 0.8), density)
+        canvas.window(int(width * 0.55), height // 4, int(width * 0.97), height - taskbar_h - 10, density)
+        canvas.draw.rectangle([0, height - taskbar_h, width, height], fill=(32, 32, 40))
+        x = width // 3
+        while x < 2 * width // 3:
+            canvas.icon(x, height - taskbar_h + taskbar_h // 6, size=30)
+            x += int(taskbar_h * 1.2)
+        canvas.text(width - int(120 * canvas.scale), height - taskbar_h + taskbar_h // 4, size=13, words=1, color=(235, 235, 235))
+    elements = []
+    for elem in canvas.elements:
+        x1, y1, x2, y2 = elem['bbox']
+        x1, y1, x2, y2 = max(x1, 0), max(y1, 0), min(x2, width), min(y2, height)
+        if x2 > x1 and y2 > y1:
+            elements.append(dict(elem, bbox=[x1, y1, x2, y2]))
+    return canvas.image, elements
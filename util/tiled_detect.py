@@ -0,0 +1,109 @@
+"""
+Tiled icon detection for high-resolution screens.
+
+A single detector pass over a 4K or ultra-wide screenshot either shrinks it to
+the detector's input size, which loses small icons, or runs at native size,
+which is slow. `predict_yolo_tiled` cuts the frame into overlapping `tile`
+squares and detects on all of them in one batched `predict` call. It then
+merges the results in frame coordinates:
+    - boxes that end on a tile edge inside the frame are cut-off pieces
+      (`overlap` is chosen so that icons fit whole into some tile)
+    - whole boxes go through class-agnostic NMS, which removes the copies
+      found by neighbouring tiles
+    - pieces mostly covered by a kept box are dropped; pieces of elements larger
+      than the overlap are joined across the seam they were cut at
+"""
+import math
+from typing import List, Tuple
+
+import numpy as np
+import torch
+from torchvision.ops import nms
+
+# boxes within this many pixels of an interior tile edge count as cut off
+EDGE_MARGIN = 2
+
+
+def tile_grid(width: int, height: int, tile: int, overlap: int) -> List[Tuple[int, int, int, int]]:
+    """(x0, y0, x1, y1) tiles covering the frame, evenly spread with at least `overlap` pixels shared."""
+    def starts(length):
+        if length <= tile:
+            return [0]
+        n = math.ceil((length - overlap) / (tile - overlap))
+        step = (length - tile) / (n - 1)
+        return [int(round(i * step)) for i in range(n)]
+    return [(x, y, min(x + tile, width), min(y + tile, height)) for y in starts(height) for x in starts(width)]
+
+
+def _join_pieces(pieces: torch.Tensor, scores: torch.Tensor):
+    """Union pieces that overlap and span the same extent across their seam (one element cut by tiles)."""
+    boxes = [p.tolist() for p in pieces]
+    confs = scores.tolist()
+    joined = True
+    while joined:
+        joined = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                ix = min(a[2], b[2]) - max(a[0], b[0])
+                iy = min(a[3], b[3]) - max(a[1], b[1])
+                if ix <= 0 or iy <= 0:
+                    continue
+                # same rows (cut by a vertical seam) or same columns (cut by a horizontal seam)
+                rows = iy / (max(a[3], b[3]) - min(a[1], b[1]))
+                cols = ix / (max(a[2], b[2]) - min(a[0], b[0]))
+                if max(rows, cols) >= 0.7:
+                    boxes[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    confs[i] = max(confs[i], confs[j])
+                    del boxes[j], confs[j]
+                    joined = True
+                    break
+            if joined:
+                break
+    return torch.tensor(boxes, dtype=pieces.dtype).reshape(-1, 4), torch.tensor(confs, dtype=scores.dtype)
+
+
+def predict_yolo_tiled(model, image: np.ndarray, box_threshold: float, tile: int = 1280, overlap: int = 160, iou_threshold: float = 0.1, imgsz=None):
+    """
+    Same result as `predict_yolo` (pixel xyxy boxes, confidences, phrases) for an HxWx3 BGR array,
+    detected tile by tile. `imgsz` is the detector input per tile, default the tile size.
+    """
+    height, width = image.shape[:2]
+    tiles = tile_grid(width, height, tile, overlap)
+    crops = [image[y0:y1, x0:x1] for x0, y0, x1, y1 in tiles]
+    # one call with a list source runs the tiles as one batch
+    results = model.predict(source=crops, conf=box_threshold, iou=iou_threshold, imgsz=imgsz or tile)
+
+    xyxy, conf, cut = [], [], []
+    for (x0, y0, x1, y1), result in zip(tiles, results):
+        boxes = result.boxes.xyxy.float().cpu()
+        scores = result.boxes.conf.float().cpu()
+        cut.append(((boxes[:, 0] <= EDGE_MARGIN) & (x0 > 0))
+                   | ((boxes[:, 1] <= EDGE_MARGIN) & (y0 > 0))
+                   | ((boxes[:, 2] >= x1 - x0 - EDGE_MARGIN) & (x1 < width))
+                   | ((boxes[:, 3] >= y1 - y0 - EDGE_MARGIN) & (y1 < height)))
+        xyxy.append(boxes + torch.tensor([x0, y0, x0, y0], dtype=boxes.dtype))
+        conf.append(scores)
+    xyxy, conf, cut = torch.cat(xyxy), torch.cat(conf), torch.cat(cut)
+
+    whole_xyxy, whole_conf = xyxy[~cut], conf[~cut]
+    keep = nms(whole_xyxy, whole_conf, iou_threshold)
+    kept_xyxy, kept_conf = whole_xyxy[keep], whole_conf[keep]
+
+    pieces, piece_conf = xyxy[cut], conf[cut]
+    if len(pieces) and len(kept_xyxy):
+        lt = torch.max(pieces[:, None, :2], kept_xyxy[None, :, :2])
+        rb = torch.min(pieces[:, None, 2:], kept_xyxy[None, :, 2:])
+        inter = (rb - lt).clamp(min=0).prod(dim=2)
+        area = (pieces[:, 2:] - pieces[:, :2]).prod(dim=1).clamp(min=1e-6)
+        uncovered = (inter / area[:, None]).max(dim=1).values < 0.5
+        pieces, piece_conf = pieces[uncovered], piece_conf[uncovered]
+    if len(pieces):
+        pieces, piece_conf = _join_pieces(pieces, piece_conf)
+        xyxy, conf = torch.cat([kept_xyxy, pieces]), torch.cat([kept_conf, piece_conf])
+        keep = nms(xyxy, conf, iou_threshold)
+        xyxy, conf = xyxy[keep], conf[keep]
+    else:
+        xyxy, conf = kept_xyxy, kept_conf
+    phrases = [str(i) for i in range(len(xyxy))]
+    return xyxy, conf, phrases
@@ -0,0 +1,108 @@
+"""
+Containment hierarchy (UI tree) over parsed elements.
+
+`parsed_content_list` is flat. `build_ui_tree` nests every element under the
+smallest element that contains it (windows and panels the detector found,
+then controls, then text), so consumers can take a subtree instead of scanning
+the whole list. Element ids are indices into `parsed_content_list`, the same ids
+the overlay labels show.
+
+Elements are inserted largest first into a uniform grid. An element's parent
+is the most recently inserted, i.e. smallest, element registered in the cell of
+its centre that contains it. Sorting makes this O(n log n) for the usual
+screens, where few large boxes cover many cells.
+"""
+import math
+from typing import Dict, List, Optional, Sequence
+
+
+def _area(box: Sequence[float]) -> float:
+    return max(box[2] - box[0], 0.0) * max(box[3] - box[1], 0.0)
+
+
+def _contains(outer: Sequence[float], inner: Sequence[float], threshold: float) -> bool:
+    """Whether at least `threshold` of `inner`'s area lies inside `outer` (OCR boxes often spill a little)."""
+    ix = min(outer[2], inner[2]) - max(outer[0], inner[0])
+    iy = min(outer[3], inner[3]) - max(outer[1], inner[1])
+    if ix <= 0 or iy <= 0:
+        return False
+    area = _area(inner)
+    return area > 0 and ix * iy >= threshold * area
+
+
+def build_ui_tree(parsed_content_list: List[Dict], contain_threshold: float = 0.9) -> Dict:
+    """
+    Returns {'parent': parent id or None per element, 'children': child ids per element (in reading
+    order), 'roots': ids without a parent, 'depth': depth per element (roots are 0)}. Boxes are xyxy,
+    in ratios or pixels. A box never gets a parent smaller than itself; of two identical boxes the
+    earlier one is the parent.
+    """
+    n = len(parsed_content_list)
+    boxes = [elem['bbox'] for elem in parsed_content_list]
+    parent: List[Optional[int]] = [None] * n
+    if n:
+        x0 = min(b[0] for b in boxes)
+        y0 = min(b[1] for b in boxes)
+        span_x = max(max(b[2] for b in boxes) - x0, 1e-9)
+        span_y = max(max(b[3] for b in boxes) - y0, 1e-9)
+        cells = max(1, int(math.sqrt(n)))
+
+        def cell(x, y):
+            cx = min(max(int((x - x0) / span_x * cells), 0), cells - 1)
+            cy = min(max(int((y - y0) / span_y * cells), 0), cells - 1)
+            return cx, cy
+
+        grid: Dict = {}
+        for i in sorted(range(n), key=lambda i: (-_area(boxes[i]), i)):
+            box = boxes[i]
+            for candidate in reversed(grid.get(cell((box[0] + box[2]) / 2, (box[1] + box[3]) / 2), ())):
+                if _contains(boxes[candidate], box, contain_threshold):
+                    parent[i] = candidate
+                    break
+            (c0x, c0y), (c1x, c1y) = cell(box[0], box[1]), cell(box[2], box[3])
+            for cx in range(c0x, c1x + 1):
+                for cy in range(c0y, c1y + 1):
+                    grid.setdefault((cx, cy), []).append(i)
+
+    children: List[List[int]] = [[] for _ in range(n)]
+    roots = []
+    for i in sorted(range(n), key=lambda i: (boxes[i][1], boxes[i][0])):
+        (roots if parent[i] is None else children[parent[i]]).append(i)
+    depth = [0] * n
+    stack = list(roots)
+    while stack:
+        i = stack.pop()
+        for child in children[i]:
+            depth[child] = depth[i] + 1
+            stack.append(child)
+    return {'parent': parent, 'children': children, 'roots': roots, 'depth': depth}
+
+
+def subtree(tree: Dict, element_id: int) -> List[int]:
+    """`element_id` followed by all its descendants, depth first in reading order."""
+    ids, stack = [], [element_id]
+    while stack:
+        i = stack.pop()
+        ids.append(i)
+        stack.extend(reversed(tree['children'][i]))
+    return ids
+
+
+def tree_screen_info(parsed_content_list: List[Dict], tree: Dict, root: Optional[int] = None, max_depth: Optional[int] = None) -> str:
+    """
+    The agent's `screen_info` text (one 'ID: n, Text|Icon: content' line per element), indented by
+    nesting. With `max_depth`, deeper elements are folded into a '(+k nested)' note on their ancestor,
+    which keeps prompts for large screens short; with `root`, only that subtree is listed.
+    """
+    lines = []
+    stack = [(i, 0) for i in reversed([root] if root is not None else tree['roots'])]
+    while stack:
+        i, level = stack.pop()
+        elem = parsed_content_list[i]
+        line = f"{'  ' * level}ID: {i}, {'Text' if elem['type'] == 'text' else 'Icon'}: {elem['content']}"
+        if max_depth is not None and level >= max_depth and tree['children'][i]:
+            line += f' (+{len(subtree(tree, i)) - 1} nested)'
+        else:
+            stack.extend((child, level + 1) for child in reversed(tree['children'][i]))
+        lines.append(line)
+    return ''.join(line + '\n' for line in lines)
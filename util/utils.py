@@ -17,25 +17,24 @@ import cv2
 import numpy as np
 # %matplotlib inline
 from matplotlib import pyplot as plt
-import easyocr
-from paddleocr import PaddleOCR
+from util.ocr_engine import ReaderPool, create_paddle_ocr, run_easyocr, run_easyocr_batched, run_easyocr_recognize, run_paddleocr, run_paddleocr_batched
 
-# EasyOCR initialization with Korean support
-reader = easyocr.Reader(['en', 'ko'])
+# EasyOCR readers by language set (default English + Korean), created on first use
+ocr_readers = ReaderPool()
 
 # PaddleOCR 3.x API - completely new interface
 # Uses predict() method, returns dict with 'rec_texts', 'rec_scores', 'dt_polys'
-try:
-    paddle_ocr = PaddleOCR(
-        use_doc_orientation_classify=False,
-        use_doc_unwarping=False,
-        use_textline_orientation=False,
-        text_recognition_model_name="korean_PP-OCRv5_mobile_rec"
-    )
-except Exception as e:
-    print(f"Warning: PaddleOCR initialization failed: {e}")
-    print("Falling back to EasyOCR only")
-    paddle_ocr = None
+# created on first use; None if it failed to initialize
+_paddle_ocr = None
+_paddle_ocr_loaded = False
+
+
+def get_paddle_ocr():
+    global _paddle_ocr, _paddle_ocr_loaded
+    if not _paddle_ocr_loaded:
+        _paddle_ocr = create_paddle_ocr()
+        _paddle_ocr_loaded = True
+    return _paddle_ocr
 import time
 import base64
 
@@ -49,9 +48,27 @@ from torchvision.transforms import ToPILImage
 import supervision as sv
 import torchvision.transforms as T
 from util.box_annotator import BoxAnnotator 
-
-
-def get_caption_model_processor(model_name, model_name_or_path="Salesforce/blip2-opt-2.7b", device=None):
+from util.frame import Frame
+from util.model_cache import DEFAULT_CACHE_DIR, load_cached_module, record_load_time
+from util.batch_sizer import AdaptiveBatchSizer, run_batched
+from util.tiled_detect import predict_yolo_tiled
+from util import box_ops
+from util.caption_budget import CAPTION_PLACEHOLDER, CaptionBudget, CaptionCache, CaptionCostModel, rank_icons
+
+# seconds per captioned icon, shared by all budgeted requests in the process
+CAPTION_COST = CaptionCostModel()
+# caption batch sizes when none is given, adapted to free memory and batch latency
+CAPTION_BATCH = AdaptiveBatchSizer(start=32, max_size=256)
+# the same for roi captioning (util/roi_caption.py), whose per-icon memory differs from a crop's
+ROI_CAPTION_BATCH = AdaptiveBatchSizer(start=32, max_size=256)
+PHI3V_BATCH = AdaptiveBatchSizer(start=5, max_size=16, bytes_per_item=512 * 2 ** 20)
+
+
+def get_caption_model_processor(model_name, model_name_or_path="Salesforce/blip2-opt-2.7b", device=None, weight_cache_dir=DEFAULT_CACHE_DIR):
+    """
+    weight_cache_dir: directory of memory-mapped safetensors copies of the weights (see util/model_cache.py),
+    shared read-only by every process on the host. None disables the cache.
+    """
     if not device:
         # Prioritize: CUDA > MPS (Apple Silicon NPU) > CPU
         if torch.cuda.is_available():
@@ -60,42 +77,59 @@ def get_caption_model_processor(model_name, model_name_or_path="Salesforce/blip2
             device = "mps"
         else:
             device = "cpu"
+    # Use float32 for CPU and MPS (MPS has incomplete float16 support), float16 for CUDA only
+    dtype = torch.float32 if device == 'cpu' or device == 'mps' else torch.float16
+    from accelerate import init_empty_weights
     if model_name == "blip2":
-        from transformers import Blip2Processor, Blip2ForConditionalGeneration
+        from transformers import Blip2Config, Blip2Processor, Blip2ForConditionalGeneration
         processor = Blip2Processor.from_pretrained("Salesforce/blip2-opt-2.7b")
-        if device == 'cpu' or device == 'mps':
-            # Use float32 for CPU and MPS (MPS has incomplete float16 support)
-            model = Blip2ForConditionalGeneration.from_pretrained(
-            model_name_or_path, device_map=None, torch_dtype=torch.float32
-        )
-        else:
-            # Use float16 for CUDA only
-            model = Blip2ForConditionalGeneration.from_pretrained(
-            model_name_or_path, device_map=None, torch_dtype=torch.float16
-        ).to(device)
+
+        def build_empty():
+            with init_empty_weights():
+                return Blip2ForConditionalGeneration._from_config(Blip2Config.from_pretrained(model_name_or_path), torch_dtype=dtype)
+        model = load_cached_module(
+            'blip2', model_name_or_path, dtype,
+            build_pretrained=lambda: Blip2ForConditionalGeneration.from_pretrained(model_name_or_path, device_map=None, torch_dtype=dtype),
+            build_empty=build_empty, cache_dir=weight_cache_dir)
     elif model_name == "florence2":
-        from transformers import AutoProcessor, AutoModelForCausalLM
+        from transformers import AutoConfig, AutoProcessor, AutoModelForCausalLM
         processor = AutoProcessor.from_pretrained("microsoft/Florence-2-base", trust_remote_code=True)
+
+        def build_empty():
+            config = AutoConfig.from_pretrained(model_name_or_path, trust_remote_code=True)
+            with init_empty_weights():
+                return AutoModelForCausalLM.from_config(config, torch_dtype=dtype, trust_remote_code=True, attn_implementation="eager")
         # attn_implementation="eager" fixes compatibility with newer transformers versions
-        if device == 'cpu' or device == 'mps':
-            # Use float32 for CPU and MPS (MPS has incomplete float16 support)
-            model = AutoModelForCausalLM.from_pretrained(model_name_or_path, torch_dtype=torch.float32, trust_remote_code=True, attn_implementation="eager")
-        else:
-            # Use float16 for CUDA only
-            model = AutoModelForCausalLM.from_pretrained(model_name_or_path, torch_dtype=torch.float16, trust_remote_code=True, attn_implementation="eager").to(device)
+        model = load_cached_module(
+            'florence2', model_name_or_path, dtype,
+            build_pretrained=lambda: AutoModelForCausalLM.from_pretrained(model_name_or_path, torch_dtype=dtype, trust_remote_code=True, attn_implementation="eager"),
+            build_empty=build_empty, cache_dir=weight_cache_dir)
+    # from_config keeps the config's name_or_path, from_pretrained sets the path; caption_crops branches on it
+    model.config.name_or_path = model_name_or_path
     return {'model': model.to(device), 'processor': processor}
 
 
 def get_yolo_model(model_path):
     from ultralytics import YOLO
-    # Load the model.
+    # Load the model. The detector is small and ultralytics fuses conv+bn in place on the first
+    # predict, so its weights are not mmap-cached, only timed.
+    start = time.time()
     model = YOLO(model_path)
+    record_load_time('icon_detect', start)
     return model
 
 
+def crop_icon(coord, image_source, size=64):
+    """Crop a ratio xyxy box from an HxWx3 array and resize it to the caption model input size."""
+    xmin, xmax = int(coord[0]*image_source.shape[1]), int(coord[2]*image_source.shape[1])
+    ymin, ymax = int(coord[1]*image_source.shape[0]), int(coord[3]*image_source.shape[0])
+    cropped_image = image_source[ymin:ymax, xmin:xmax, :]
+    return cv2.resize(cropped_image, (size, size))
+
+
 @torch.inference_mode()
-def get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=None, batch_size=128):
-    # Number of samples per batch, --> 128 roughly takes 4 GB of GPU memory for florence v2 model
+def get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=None, batch_size=128, batch_stats=None):
+    # Number of samples per batch, --> 128 roughly takes 4 GB of GPU memory for florence v2 model; None adapts it (see caption_crops)
     to_pil = ToPILImage()
     if starting_idx:
         non_ocr_boxes = filtered_boxes[starting_idx:]
@@ -104,14 +138,19 @@ def get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_
     croped_pil_image = []
     for i, coord in enumerate(non_ocr_boxes):
         try:
-            xmin, xmax = int(coord[0]*image_source.shape[1]), int(coord[2]*image_source.shape[1])
-            ymin, ymax = int(coord[1]*image_source.shape[0]), int(coord[3]*image_source.shape[0])
-            cropped_image = image_source[ymin:ymax, xmin:xmax, :]
-            cropped_image = cv2.resize(cropped_image, (64, 64))
-            croped_pil_image.append(to_pil(cropped_image))
+            croped_pil_image.append(to_pil(crop_icon(coord, image_source)))
         except:
             continue
+    return caption_crops(croped_pil_image, caption_model_processor, prompt=prompt, batch_size=batch_size, batch_stats=batch_stats)
+
 
+@torch.inference_mode()
+def caption_crops(croped_pil_image, caption_model_processor, prompt=None, batch_size=128, batch_stats=None):
+    """
+    batch_size: fixed batch size, or None to size batches adaptively (CAPTION_BATCH). Either way a batch
+    that runs out of memory is retried in halves.
+    batch_stats: Optional dict, gets the batch sizes used and the number of OOM retries.
+    """
     model, processor = caption_model_processor['model'], caption_model_processor['processor']
     if not prompt:
         if 'florence' in model.config.name_or_path:
@@ -119,12 +158,9 @@ def get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_
         else:
             prompt = "The image shows"
     
-    generated_texts = []
     device = model.device
-    for i in range(0, len(croped_pil_image), batch_size):
-        start = time.time()
-        batch = croped_pil_image[i:i+batch_size]
-        t1 = time.time()
+
+    def caption_batch(batch):
         if model.device.type == 'cuda':
             inputs = processor(images=batch, text=[prompt]*len(batch), return_tensors="pt", do_resize=False).to(device=device, dtype=torch.float16)
         else:
@@ -135,16 +171,109 @@ def get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_
         else:
             generated_ids = model.generate(**inputs, max_length=100, num_beams=5, no_repeat_ngram_size=2, early_stopping=True, num_return_sequences=1) # temperature=0.01, do_sample=True,
         generated_text = processor.batch_decode(generated_ids, skip_special_tokens=True)
-        generated_text = [gen.strip() for gen in generated_text]
-        generated_texts.extend(generated_text)
-    
-    return generated_texts
+        return [gen.strip() for gen in generated_text]
 
+    sizer = CAPTION_BATCH if batch_size is None else AdaptiveBatchSizer.fixed(batch_size)
+    return run_batched(croped_pil_image, caption_batch, sizer, device, batch_stats=batch_stats)
 
 
-def get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor):
+def get_parsed_content_icon_budgeted(icon_elems, image_source, caption_model_processor, caption_budget=None, caption_cache=None, prompt=None, batch_size=128, caption_stats=None, icon_index=None, roi_captioner=None):
+    """
+    Caption `icon_elems` (dicts with ratio 'bbox') in place. Cache hits, and with an `icon_index` crops
+    close enough to an already captioned icon, are free; the remaining icons are captioned in
+    `rank_icons` order until `caption_budget` is spent. Icons left over get CAPTION_PLACEHOLDER and
+    'caption_pending': True. With a `roi_captioner` (util/roi_caption.py) the icons are captioned from
+    one vision pass over the whole frame instead of one per crop.
+    """
     to_pil = ToPILImage()
-    if ocr_bbox:
+    budget = caption_budget or CaptionBudget()
+    start = time.time()
+    crops, keys, todo = [], [], []
+    n_empty = 0
+    for i, elem in enumerate(icon_elems):
+        try:
+            crop = crop_icon(elem['bbox'], image_source)
+        except cv2.error:
+            # degenerate box: nothing to caption now or in a later /caption/ call, so no placeholder either
+            crop = None
+            if elem['content'] is None:
+                elem['content'] = ''
+                n_empty += 1
+        key = CaptionCache.key(crop) if crop is not None and caption_cache is not None else None
+        crops.append(crop)
+        keys.append(key)
+        cached = caption_cache.get(key) if key is not None else None
+        if cached is not None:
+            elem['content'] = cached
+        elif crop is not None:
+            todo.append(i)
+    n_cached = len(icon_elems) - len(todo) - n_empty
+
+    n_nearest, vectors = 0, {}
+    if icon_index is not None and todo:
+        embedded = icon_index.embed([crops[i] for i in todo])
+        misses = []
+        for i, vector, caption in zip(todo, embedded, icon_index.lookup(embedded)):
+            if caption is None:
+                vectors[i] = vector
+                misses.append(i)
+            else:
+                icon_elems[i]['content'] = caption
+                if keys[i] is not None:
+                    caption_cache.put(keys[i], caption)
+        n_nearest = len(todo) - len(misses)
+        todo = misses
+
+    todo = [todo[j] for j in rank_icons([icon_elems[i] for i in todo], budget.focus_points)]
+    if budget.max_captions is not None:
+        todo = todo[:budget.max_captions]
+    deadline = start + budget.time_budget_ms / 1000 if budget.time_budget_ms is not None else None
+    done, frame_features = 0, None
+    device = caption_model_processor['model'].device
+    adaptive = ROI_CAPTION_BATCH if roi_captioner is not None else CAPTION_BATCH
+    while done < len(todo):
+        n = batch_size if batch_size is not None else adaptive.next_size(device, len(todo) - done)
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            n = CAPTION_COST.items_within(remaining, n)
+        chunk = todo[done:done + n]
+        t_batch = time.time()
+        if roi_captioner is not None:
+            if frame_features is None:
+                frame_features = roi_captioner.encode_frame(image_source)
+            # through run_batched like caption_crops, so an OOM retries with smaller batches
+            sizer = ROI_CAPTION_BATCH if batch_size is None else AdaptiveBatchSizer.fixed(n)
+            captions = run_batched([icon_elems[i]['bbox'] for i in chunk], lambda boxes: roi_captioner.caption(image_source, boxes, features=frame_features, prompt=prompt, batch_size=len(boxes)), sizer, device, batch_stats=caption_stats)
+        else:
+            captions = caption_crops([to_pil(crops[i]) for i in chunk], caption_model_processor, prompt=prompt, batch_size=None if batch_size is None else n, batch_stats=caption_stats)
+        CAPTION_COST.observe(len(chunk), time.time() - t_batch)
+        for i, caption in zip(chunk, captions):
+            icon_elems[i]['content'] = caption
+            if keys[i] is not None:
+                caption_cache.put(keys[i], caption)
+        if vectors:
+            icon_index.add(np.stack([vectors[i] for i in chunk]), captions)
+        done += len(chunk)
+
+    n_pending = 0
+    for elem in icon_elems:
+        if elem['content'] is None:
+            elem['content'] = CAPTION_PLACEHOLDER
+            elem['caption_pending'] = True
+            n_pending += 1
+        else:
+            elem.pop('caption_pending', None)
+    if caption_stats is not None:
+        caption_stats.update({'captioned': done, 'cached': n_cached, 'nearest': n_nearest, 'pending': n_pending, 'empty': n_empty})
+    return [elem['content'] for elem in icon_elems]
+
+
+
+def get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor, batch_stats=None):
+    to_pil = ToPILImage()
+    if ocr_bbox is not None and len(ocr_bbox):
         non_ocr_boxes = filtered_boxes[len(ocr_bbox):]
     else:
         non_ocr_boxes = filtered_boxes
@@ -160,11 +289,7 @@ def get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, captio
     messages = [{"role": "user", "content": "<|image_1|>\ndescribe the icon in one sentence"}] 
     prompt = processor.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
 
-    batch_size = 5  # Number of samples per batch
-    generated_texts = []
-
-    for i in range(0, len(croped_pil_image), batch_size):
-        images = croped_pil_image[i:i+batch_size]
+    def caption_batch(images):
         image_inputs = [processor.image_processor(x, return_tensors="pt") for x in images]
         inputs ={'input_ids': [], 'attention_mask': [], 'pixel_values': [], 'image_sizes': []}
         texts = [prompt] * len(images)
@@ -189,62 +314,30 @@ def get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, captio
         # # remove input tokens 
         generate_ids = generate_ids[:, inputs_cat['input_ids'].shape[1]:]
         response = processor.batch_decode(generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)
-        response = [res.strip('\n').strip() for res in response]
-        generated_texts.extend(response)
+        return [res.strip('\n').strip() for res in response]
+
+    # batches start at 5 and adapt to free memory and latency (PHI3V_BATCH)
+    return run_batched(croped_pil_image, caption_batch, PHI3V_BATCH, device, batch_stats=batch_stats)
 
-    return generated_texts
 
 def remove_overlap(boxes, iou_threshold, ocr_bbox=None):
+    """
+    boxes: (N, 4) xyxy tensor. Drops boxes overlapping a smaller box by more than iou_threshold and,
+    with `ocr_bbox` (list of xyxy), boxes overlapping an OCR box without being inside it.
+    Returns the OCR boxes followed by the kept boxes as one tensor.
+    """
     assert ocr_bbox is None or isinstance(ocr_bbox, List)
-
-    def box_area(box):
-        return (box[2] - box[0]) * (box[3] - box[1])
-
-    def intersection_area(box1, box2):
-        x1 = max(box1[0], box2[0])
-        y1 = max(box1[1], box2[1])
-        x2 = min(box1[2], box2[2])
-        y2 = min(box1[3], box2[3])
-        return max(0, x2 - x1) * max(0, y2 - y1)
-
-    def IoU(box1, box2):
-        intersection = intersection_area(box1, box2)
-        union = box_area(box1) + box_area(box2) - intersection + 1e-6
-        if box_area(box1) > 0 and box_area(box2) > 0:
-            ratio1 = intersection / box_area(box1)
-            ratio2 = intersection / box_area(box2)
-        else:
-            ratio1, ratio2 = 0, 0
-        return max(intersection / union, ratio1, ratio2)
-
-    def is_inside(box1, box2):
-        # return box1[0] >= box2[0] and box1[1] >= box2[1] and box1[2] <= box2[2] and box1[3] <= box2[3]
-        intersection = intersection_area(box1, box2)
-        ratio1 = intersection / box_area(box1)
-        return ratio1 > 0.95
-
-    boxes = boxes.tolist()
-    filtered_boxes = []
+    boxes = boxes.double()
+    kept = boxes[box_ops.suppress_larger(boxes, iou_threshold)]
     if ocr_bbox:
-        filtered_boxes.extend(ocr_bbox)
-    # print('ocr_bbox!!!', ocr_bbox)
-    for i, box1 in enumerate(boxes):
-        # if not any(IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2) for j, box2 in enumerate(boxes) if i != j):
-        is_valid_box = True
-        for j, box2 in enumerate(boxes):
-            # keep the smaller box
-            if i != j and IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2):
-                is_valid_box = False
-                break
-        if is_valid_box:
-            # add the following 2 lines to include ocr bbox
-            if ocr_bbox:
-                # only add the box if it does not overlap with any ocr bbox
-                if not any(IoU(box1, box3) > iou_threshold and not is_inside(box1, box3) for k, box3 in enumerate(ocr_bbox)):
-                    filtered_boxes.append(box1)
-            else:
-                filtered_boxes.append(box1)
-    return torch.tensor(filtered_boxes)
+        ocr = torch.tensor(ocr_bbox, dtype=torch.float64, device=boxes.device)
+        inter = box_ops.intersection_area(kept, ocr)
+        inside = inter / box_ops.box_area(kept)[:, None] > 0.95
+        kept = kept[~((box_ops.overlap_matrix(kept, ocr, inter) > iou_threshold) & ~inside).any(dim=1)]
+        kept = torch.cat([ocr, kept])
+    if not len(kept):
+        return torch.tensor([])
+    return kept.float().cpu()
 
 
 def remove_overlap_new(boxes, iou_threshold, ocr_bbox=None):
@@ -252,80 +345,35 @@ def remove_overlap_new(boxes, iou_threshold, ocr_bbox=None):
     ocr_bbox format: [{'type': 'text', 'bbox':[x,y], 'interactivity':False, 'content':str }, ...]
     boxes format: [{'type': 'icon', 'bbox':[x,y], 'interactivity':True, 'content':None }, ...]
 
+    Without ocr_bbox (None) the bboxes of the surviving icons are returned; with it (even an empty
+    list) the remaining OCR elems followed by the surviving icon elems. See `box_ops.merge_ocr_into_icons`.
     '''
     assert ocr_bbox is None or isinstance(ocr_bbox, List)
-
-    def box_area(box):
-        return (box[2] - box[0]) * (box[3] - box[1])
-
-    def intersection_area(box1, box2):
-        x1 = max(box1[0], box2[0])
-        y1 = max(box1[1], box2[1])
-        x2 = min(box1[2], box2[2])
-        y2 = min(box1[3], box2[3])
-        return max(0, x2 - x1) * max(0, y2 - y1)
-
-    def IoU(box1, box2):
-        intersection = intersection_area(box1, box2)
-        union = box_area(box1) + box_area(box2) - intersection + 1e-6
-        if box_area(box1) > 0 and box_area(box2) > 0:
-            ratio1 = intersection / box_area(box1)
-            ratio2 = intersection / box_area(box2)
-        else:
-            ratio1, ratio2 = 0, 0
-        return max(intersection / union, ratio1, ratio2)
-
-    def is_inside(box1, box2):
-        # return box1[0] >= box2[0] and box1[1] >= box2[1] and box1[2] <= box2[2] and box1[3] <= box2[3]
-        intersection = intersection_area(box1, box2)
-        ratio1 = intersection / box_area(box1)
-        return ratio1 > 0.80
-
-    # boxes = boxes.tolist()
-    filtered_boxes = []
-    if ocr_bbox:
-        filtered_boxes.extend(ocr_bbox)
-    # print('ocr_bbox!!!', ocr_bbox)
-    for i, box1_elem in enumerate(boxes):
-        box1 = box1_elem['bbox']
-        is_valid_box = True
-        for j, box2_elem in enumerate(boxes):
-            # keep the smaller box
-            box2 = box2_elem['bbox']
-            if i != j and IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2):
-                is_valid_box = False
-                break
-        if is_valid_box:
-            if ocr_bbox:
-                # keep yolo boxes + prioritize ocr label
-                box_added = False
-                ocr_labels = ''
-                for box3_elem in ocr_bbox:
-                    if not box_added:
-                        box3 = box3_elem['bbox']
-                        if is_inside(box3, box1): # ocr inside icon
-                            # box_added = True
-                            # delete the box3_elem from ocr_bbox
-                            try:
-                                # gather all ocr labels
-                                ocr_labels += box3_elem['content'] + ' '
-                                filtered_boxes.remove(box3_elem)
-                            except:
-                                continue
-                            # break
-                        elif is_inside(box1, box3): # icon inside ocr, don't added this icon box, no need to check other ocr bbox bc no overlap between ocr bbox, icon can only be in one ocr box
-                            box_added = True
-                            break
-                        else:
-                            continue
-                if not box_added:
-                    if ocr_labels:
-                        filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': ocr_labels, 'source':'box_yolo_content_ocr'})
-                    else:
-                        filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': None, 'source':'box_yolo_content_yolo'})
-            else:
-                filtered_boxes.append(box1)
-    return filtered_boxes # torch.tensor(filtered_boxes)
+    icon_boxes = torch.tensor([elem['bbox'] for elem in boxes], dtype=torch.float64).reshape(-1, 4)
+    if ocr_bbox is None:
+        return [boxes[i]['bbox'] for i in box_ops.suppress_larger(icon_boxes, iou_threshold).nonzero().flatten().tolist()]
+    ocr_boxes = torch.tensor([elem['bbox'] for elem in ocr_bbox], dtype=torch.float64).reshape(-1, 4)
+    icon_idx, labels, ocr_keep = box_ops.merge_ocr_into_icons(icon_boxes, iou_threshold, ocr_boxes, [elem['content'] for elem in ocr_bbox])
+    filtered_boxes = [elem for elem, keep in zip(ocr_bbox, ocr_keep.tolist()) if keep]
+    for i, label in zip(icon_idx.tolist(), labels):
+        filtered_boxes.append({'type': 'icon', 'bbox': boxes[i]['bbox'], 'interactivity': True, 'content': label, 'source': 'box_yolo_content_ocr' if label else 'box_yolo_content_yolo'})
+    return filtered_boxes
+
+
+def speculative_icon_candidates(boxes, iou_threshold, image_size, max_area=0.0025, max_aspect=2.5):
+    """
+    Icon elems worth captioning before OCR has finished, from (N, 4) ratio xyxy detections: those that
+    survive the icon vs icon pass of `remove_overlap_new` and are small and not wide, i.e. unlikely to
+    hold text OCR would claim.
+    """
+    w, h = image_size
+    boxes = boxes.cpu().double()
+    boxes = boxes[box_ops.int_box_area(boxes, w, h) > 0]
+    survivors = boxes[box_ops.suppress_larger(boxes, iou_threshold)]
+    bw, bh = (survivors[:, 2] - survivors[:, 0]) * w, (survivors[:, 3] - survivors[:, 1]) * h
+    small = box_ops.box_area(survivors) <= max_area
+    narrow = (bh > 0) & (bw <= max_aspect * bh)
+    return [{'type': 'icon', 'bbox': box, 'interactivity': True, 'content': None} for box in survivors[small & narrow].tolist()]
 
 
 def load_image(image_path: str) -> Tuple[np.array, torch.Tensor]:
@@ -394,10 +442,15 @@ def predict(model, image, caption, box_threshold, text_threshold):
     return boxes, logits, phrases
 
 
-def predict_yolo(model, image, box_threshold, imgsz, scale_img, iou_threshold=0.7):
+def predict_yolo(model, image, box_threshold, imgsz, scale_img, iou_threshold=0.7, tile=None, tile_overlap=160):
     """ Use huggingface model to replace the original model
+    image: PIL image, or an HxWx3 array in BGR order (ultralytics' convention for arrays, see Frame.bgr)
+    tile: detect on overlapping tile x tile crops of an array image in one batch and merge them
+        (util/tiled_detect.py); `imgsz` then is the input size per tile when scale_img is set
     """
     # model = model['model']
+    if tile:
+        return predict_yolo_tiled(model, image, box_threshold, tile=tile, overlap=tile_overlap, iou_threshold=iou_threshold, imgsz=imgsz if scale_img else None)
     if scale_img:
         result = model.predict(
         source=image,
@@ -423,52 +476,100 @@ def int_box_area(box, w, h):
     area = (int_box[2] - int_box[0]) * (int_box[3] - int_box[1])
     return area
 
-def get_som_labeled_img(image_source: Union[str, Image.Image], model=None, BOX_TRESHOLD=0.01, output_coord_in_ratio=False, ocr_bbox=None, text_scale=0.4, text_padding=5, draw_bbox_config=None, caption_model_processor=None, ocr_text=[], use_local_semantics=True, iou_threshold=0.9,prompt=None, scale_img=False, imgsz=None, batch_size=128):
+def get_som_labeled_img(image_source: Union[str, Image.Image, Frame], model=None, BOX_TRESHOLD=0.01, output_coord_in_ratio=False, ocr_bbox=None, text_scale=0.4, text_padding=5, draw_bbox_config=None, caption_model_processor=None, ocr_text=[], use_local_semantics=True, iou_threshold=0.9,prompt=None, scale_img=False, imgsz=None, batch_size=128, timings=None, caption_budget=None, caption_cache=None, caption_stats=None, icon_index=None, roi_captioner=None, detections=None, speculative_captions=None, overlay_format='PNG', overlay_quality=90, detect_tile=None, detect_tile_overlap=160, element_tracker=None):
     """Process either an image path or Image object
     
     Args:
-        image_source: Either a file path (str) or PIL Image object
+        image_source: A file path (str), PIL Image object or Frame (util/frame.py, avoids per-stage copies)
         ...
+        timings: Optional dict, filled with per-stage seconds ('detect', 'filter', 'caption', 'annotate')
+        caption_budget: Optional CaptionBudget limiting how many icons are captioned (see util/caption_budget.py)
+        caption_cache: Optional CaptionCache of captions by icon crop
+        caption_stats: Optional dict, filled with the caption batch sizes used and OOM retries, and with
+            captioned/cached/nearest/pending counts when budget or cache is used
+        batch_size: caption batch size, None to adapt it to free memory and batch latency
+        icon_index: Optional IconIndex reusing captions of near-duplicate icons (see util/icon_index.py)
+        roi_captioner: Optional RoiCaptioner, captions icons from shared whole-frame features (see util/roi_caption.py)
+        detections: Optional (xyxy pixel tensor, logits) from an earlier `predict_yolo` call on this image
+        speculative_captions: Optional dict of tuple(ratio bbox) -> caption computed ahead of time; icons that
+            survive filtering with the same box take it instead of being captioned
+        overlay_format: encoding of the returned annotated image, 'PNG' or 'JPEG' (at overlay_quality)
+        detect_tile, detect_tile_overlap: Optional tiled detection of high-resolution screens (see `predict_yolo`)
+        element_tracker: Optional ElementTracker of the session; sets 'track_id' on the elements and carries
+            captions of unchanged icons over from the previous frame (see util/element_tracker.py)
     """
+    if timings is None:
+        timings = {}
     if isinstance(image_source, str):
         image_source = Image.open(image_source)
-    image_source = image_source.convert("RGB") # for CLIP
-    w, h = image_source.size
+    if not isinstance(image_source, Frame):
+        image_source = Frame.from_image(image_source)
+    frame = image_source
+    w, h = frame.size
     if not imgsz:
         imgsz = (h, w)
     # print('image size:', w, h)
-    xyxy, logits, phrases = predict_yolo(model=model, image=image_source, box_threshold=BOX_TRESHOLD, imgsz=imgsz, scale_img=scale_img, iou_threshold=0.1)
+    t_stage = time.time()
+    if detections is None:
+        xyxy, logits, phrases = predict_yolo(model=model, image=frame.bgr, box_threshold=BOX_TRESHOLD, imgsz=imgsz, scale_img=scale_img, iou_threshold=0.1, tile=detect_tile, tile_overlap=detect_tile_overlap)
+        timings['detect'] = time.time() - t_stage
+    else:
+        xyxy, logits = detections
     xyxy = xyxy / torch.Tensor([w, h, w, h]).to(xyxy.device)
-    image_source = np.asarray(image_source)
-    phrases = [str(i) for i in range(len(phrases))]
+    image_source = frame.array
+    t_stage = time.time()
 
-    # annotate the image with labels
+    # boxes stay in (N, 4) tensors through filtering; float64 like the python floats the list-based filter used
+    icon_xyxy = xyxy.cpu().double()
     if ocr_bbox:
-        ocr_bbox = torch.tensor(ocr_bbox) / torch.Tensor([w, h, w, h])
-        ocr_bbox=ocr_bbox.tolist()
+        ocr_xyxy = (torch.tensor(ocr_bbox) / torch.Tensor([w, h, w, h])).double()
     else:
         print('no ocr bbox!!!')
-        ocr_bbox = None
-
-    ocr_bbox_elem = [{'type': 'text', 'bbox':box, 'interactivity':False, 'content':txt, 'source': 'box_ocr_content_ocr'} for box, txt in zip(ocr_bbox, ocr_text) if int_box_area(box, w, h) > 0] 
-    xyxy_elem = [{'type': 'icon', 'bbox':box, 'interactivity':True, 'content':None} for box in xyxy.tolist() if int_box_area(box, w, h) > 0]
-    filtered_boxes = remove_overlap_new(boxes=xyxy_elem, iou_threshold=iou_threshold, ocr_bbox=ocr_bbox_elem)
-    
-    # sort the filtered_boxes so that the one with 'content': None is at the end, and get the index of the first 'content': None
-    filtered_boxes_elem = sorted(filtered_boxes, key=lambda x: x['content'] is None)
-    # get the index of the first 'content': None
-    starting_idx = next((i for i, box in enumerate(filtered_boxes_elem) if box['content'] is None), -1)
-    filtered_boxes = torch.tensor([box['bbox'] for box in filtered_boxes_elem])
+        ocr_xyxy = torch.zeros((0, 4), dtype=torch.float64)
+    n_ocr = min(len(ocr_xyxy), len(ocr_text))
+    ocr_xyxy, ocr_text = ocr_xyxy[:n_ocr], list(ocr_text)[:n_ocr]
+    ocr_valid = box_ops.int_box_area(ocr_xyxy, w, h) > 0
+    ocr_xyxy = ocr_xyxy[ocr_valid]
+    ocr_text = [txt for txt, valid in zip(ocr_text, ocr_valid.tolist()) if valid]
+    icon_xyxy = icon_xyxy[box_ops.int_box_area(icon_xyxy, w, h) > 0]
+    icon_idx, icon_labels, ocr_keep = box_ops.merge_ocr_into_icons(icon_xyxy, iou_threshold, ocr_xyxy, ocr_text)
+    boxes = torch.cat([ocr_xyxy[ocr_keep], icon_xyxy[icon_idx]])
+    contents = [txt for txt, keep in zip(ocr_text, ocr_keep.tolist()) if keep] + icon_labels
+    n_text = int(ocr_keep.sum())
+
+    # elements with 'content': None (icons still to caption) go to the end, in their order; starting_idx is the first of them
+    order = [i for i, content in enumerate(contents) if content is not None] + [i for i, content in enumerate(contents) if content is None]
+    starting_idx = next((rank for rank, i in enumerate(order) if contents[i] is None), -1)
+    filtered_boxes = boxes[order].float()
+    filtered_boxes_elem = []
+    for i, bbox in zip(order, boxes[order].tolist()):
+        if i < n_text:
+            filtered_boxes_elem.append({'type': 'text', 'bbox': bbox, 'interactivity': False, 'content': contents[i], 'source': 'box_ocr_content_ocr'})
+        else:
+            filtered_boxes_elem.append({'type': 'icon', 'bbox': bbox, 'interactivity': True, 'content': contents[i], 'source': 'box_yolo_content_ocr' if contents[i] is not None else 'box_yolo_content_yolo'})
+    if speculative_captions:
+        # after sorting, so element order is the same as without speculation
+        for box in filtered_boxes_elem:
+            if box['content'] is None and tuple(box['bbox']) in speculative_captions:
+                box['content'] = speculative_captions[tuple(box['bbox'])]
+                box['source'] = 'box_yolo_content_yolo'
+                box['speculative'] = True
+    if element_tracker is not None:
+        element_tracker.update(filtered_boxes_elem, image_source)
     print('len(filtered_boxes):', len(filtered_boxes), starting_idx)
+    timings['filter'] = time.time() - t_stage
 
     # get parsed icon local semantics
     time1 = time.time()
     if use_local_semantics:
         caption_model = caption_model_processor['model']
         if 'phi3_v' in caption_model.config.model_type: 
-            parsed_content_icon = get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor)
+            parsed_content_icon = get_parsed_content_icon_phi3v(filtered_boxes, ocr_xyxy, image_source, caption_model_processor, batch_stats=caption_stats)
+        elif caption_budget is not None or caption_cache is not None or icon_index is not None or roi_captioner is not None or speculative_captions or element_tracker is not None:
+            icon_elems = [box for box in filtered_boxes_elem if box['content'] is None]
+            parsed_content_icon = get_parsed_content_icon_budgeted(icon_elems, image_source, caption_model_processor, caption_budget=caption_budget, caption_cache=caption_cache, prompt=prompt, batch_size=batch_size, caption_stats=caption_stats, icon_index=icon_index, roi_captioner=roi_captioner)
         else:
-            parsed_content_icon = get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=prompt,batch_size=batch_size)
+            parsed_content_icon = get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=prompt,batch_size=batch_size, batch_stats=caption_stats)
         ocr_text = [f"Text Box ID {i}: {txt}" for i, txt in enumerate(ocr_text)]
         icon_start = len(ocr_text)
         parsed_content_icon_ls = []
@@ -482,7 +583,9 @@ def get_som_labeled_img(image_source: Union[str, Image.Image], model=None, BOX_T
     else:
         ocr_text = [f"Text Box ID {i}: {txt}" for i, txt in enumerate(ocr_text)]
         parsed_content_merged = ocr_text
-    print('time to get parsed content:', time.time()-time1)
+    timings['caption'] = time.time() - time1
+    print('time to get parsed content:', timings['caption'])
+    t_stage = time.time()
 
     filtered_boxes = box_convert(boxes=filtered_boxes, in_fmt="xyxy", out_fmt="cxcywh")
 
@@ -496,11 +599,15 @@ def get_som_labeled_img(image_source: Union[str, Image.Image], model=None, BOX_T
     
     pil_img = Image.fromarray(annotated_frame)
     buffered = io.BytesIO()
-    pil_img.save(buffered, format="PNG")
+    if overlay_format == 'JPEG':
+        pil_img.save(buffered, format="JPEG", quality=overlay_quality)
+    else:
+        pil_img.save(buffered, format="PNG")
     encoded_image = base64.b64encode(buffered.getvalue()).decode('ascii')
     if output_coord_in_ratio:
         label_coordinates = {k: [v[0]/w, v[1]/h, v[2]/w, v[3]/h] for k, v in label_coordinates.items()}
         assert w == annotated_frame.shape[1] and h == annotated_frame.shape[0]
+    timings['annotate'] = time.time() - t_stage
 
     return encoded_image, label_coordinates, filtered_boxes_elem
 
@@ -520,52 +627,39 @@ def get_xywh_yolo(input):
     x, y, w, h = int(x), int(y), int(w), int(h)
     return x, y, w, h
 
-def check_ocr_box(image_source: Union[str, Image.Image], display_img = True, output_bb_format='xywh', goal_filtering=None, easyocr_args=None, use_paddleocr=False):
+def _ocr_array(image_source: Union[str, Image.Image, Frame]) -> np.ndarray:
     if isinstance(image_source, str):
         image_source = Image.open(image_source)
+    if isinstance(image_source, Frame):
+        # read-only view, the OCR engines do not write into their input
+        return image_source.array
     if image_source.mode == 'RGBA':
         # Convert RGBA to RGB to avoid alpha channel issues
         image_source = image_source.convert('RGB')
-    image_np = np.array(image_source)
-    w, h = image_source.size
-    if use_paddleocr and paddle_ocr is not None:
-        if easyocr_args is None:
-            text_threshold = 0.5
-        else:
-            text_threshold = easyocr_args.get('text_threshold', 0.5)
-
-        # PaddleOCR 3.x uses predict() and returns dict/object with rec_texts, rec_scores, dt_polys
-        result = paddle_ocr.predict(input=image_np)
-
-        # Handle result format - may be list of dicts or single dict
-        if isinstance(result, list) and len(result) > 0:
-            result = result[0]
+    return np.array(image_source)
 
-        # Extract from result dict/object
-        if result is None or not hasattr(result, '__getitem__'):
-            coord, text = [], []
-        else:
-            # Get the result dict (might be wrapped in 'res' key)
-            res = result.get('res', result) if isinstance(result, dict) else result
-
-            rec_texts = res.get('rec_texts', []) if isinstance(res, dict) else getattr(res, 'rec_texts', [])
-            rec_scores = res.get('rec_scores', []) if isinstance(res, dict) else getattr(res, 'rec_scores', [])
-            dt_polys = res.get('dt_polys', []) if isinstance(res, dict) else getattr(res, 'dt_polys', [])
-
-            # Filter by threshold and build coord/text lists
-            coord, text = [], []
-            for i, (txt, score) in enumerate(zip(rec_texts, rec_scores)):
-                if score > text_threshold and i < len(dt_polys):
-                    # dt_polys are numpy arrays of shape (4, 2) - convert to list format
-                    poly = dt_polys[i].tolist() if hasattr(dt_polys[i], 'tolist') else dt_polys[i]
-                    coord.append(poly)
-                    text.append(txt)
+def check_ocr_box(image_source: Union[str, Image.Image, Frame], display_img = True, output_bb_format='xywh', goal_filtering=None, easyocr_args=None, use_paddleocr=False, ocr_pool=None, ocr_tiles=0, ocr_stats=None, ocr_languages=None, reader_pool=None, ocr_mode='full'):
+    """
+    ocr_pool: run OCR in these worker processes (util/ocr_pool.py) instead of the module readers,
+        as one job or, with `ocr_tiles` > 1, as that many horizontal bands; `ocr_stats` gets the job counts and times.
+    ocr_languages: EasyOCR language codes to read, default those of the reader pool (`reader_pool`, else
+        the module's `ocr_readers`); `ocr_stats['languages']` gets the ones read after any fallback.
+    ocr_mode: 'full' (EasyOCR readtext) or 'recognize' (EasyOCR recognition on cheap text line proposals,
+        see util/ocr_engine.py); PaddleOCR always reads the full frame.
+    """
+    image_np = _ocr_array(image_source)
+    if ocr_pool is not None:
+        coord, text = ocr_pool.readtext(image_np, easyocr_args=easyocr_args, use_paddleocr=use_paddleocr, tiles=ocr_tiles, job_stats=ocr_stats, languages=ocr_languages, mode=ocr_mode)
+    elif use_paddleocr and get_paddle_ocr() is not None:
+        coord, text = run_paddleocr(get_paddle_ocr(), image_np, easyocr_args)
     else:  # EasyOCR (or fallback if PaddleOCR unavailable)
-        if easyocr_args is None:
-            easyocr_args = {}
-        result = reader.readtext(image_np, **easyocr_args)
-        coord = [item[0] for item in result]
-        text = [item[1] for item in result]
+        reader, languages = (reader_pool or ocr_readers).get(ocr_languages)
+        if ocr_stats is not None:
+            ocr_stats['languages'] = list(languages)
+        if ocr_mode == 'recognize':
+            coord, text = run_easyocr_recognize(reader, image_np, easyocr_args)
+        else:
+            coord, text = run_easyocr(reader, image_np, easyocr_args)
     if display_img:
         opencv_img = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
         bb = []
@@ -580,4 +674,22 @@ def check_ocr_box(image_source: Union[str, Image.Image], display_img = True, out
             bb = [get_xywh(item) for item in coord]
         elif output_bb_format == 'xyxy':
             bb = [get_xyxy(item) for item in coord]
-    return (text, bb), goal_filtering
\ No newline at end of file
+    return (text, bb), goal_filtering
+
+def check_ocr_boxes(image_sources: List[Union[str, Image.Image, Frame]], output_bb_format='xyxy', easyocr_args=None, use_paddleocr=False, ocr_stats=None, ocr_languages=None, reader_pool=None, ocr_mode='full', batch_size=32):
+    """
+    `check_ocr_box` of several frames (e.g. the screenshots of a trajectory) at once: (texts, boxes) per
+    frame. EasyOCR recognizes the text of all frames in shared batches of `batch_size` boxes and runs
+    detection on same-size frames together; PaddleOCR gets the frames as one list. Batches only fill up
+    on a GPU, EasyOCR recognizes box by box on the CPU. `ocr_stats` gets the EasyOCR 'languages' read.
+    """
+    images = [_ocr_array(image_source) for image_source in image_sources]
+    if use_paddleocr and get_paddle_ocr() is not None:
+        results = run_paddleocr_batched(get_paddle_ocr(), images, easyocr_args)
+    else:
+        reader, languages = (reader_pool or ocr_readers).get(ocr_languages)
+        if ocr_stats is not None:
+            ocr_stats['languages'] = list(languages)
+        results = run_easyocr_batched(reader, images, easyocr_args, mode=ocr_mode, batch_size=batch_size)
+    to_bb = get_xywh if output_bb_format == 'xywh' else get_xyxy
+    return [(text, [to_bb(item) for item in coord]) for coord, text in results]
\ No newline at end of file